@@ -0,0 +1,52 @@
+"""
+This script compares the time needed to read a whole index with different numbers of slices
+It is meant to be run against a local test cluster, e.g. python benchmark_sliced_reader.py faang_build_1_specimen
+"""
+import time
+import click
+from elasticsearch import Elasticsearch
+from es_reader import iterate_hits, DEFAULT_PAGE_SIZE
+
+
+@click.command()
+@click.argument('index')
+@click.option(
+    '--es_host',
+    default='localhost:9200',
+    help='Specify the Elastic Search server (port could be included), default to be localhost:9200'
+)
+@click.option(
+    '--slices',
+    default='1,2,4,8',
+    help='Specify the numbers of slices to compare, separated by comma, default to be 1,2,4,8'
+)
+@click.option(
+    '--page_size',
+    default=DEFAULT_PAGE_SIZE,
+    type=int,
+    help=f'Specify the number of hits fetched with one request, default to be {DEFAULT_PAGE_SIZE}'
+)
+@click.option(
+    '--source',
+    default='',
+    help='Specify the fields to be returned separated by comma, e.g. biosampleId,etag. '
+         'If not provided, then the whole documents are read'
+)
+def main(index, es_host, slices, page_size, source):
+    """
+    Read the index once for each number of slices and print the duration and the throughput
+    """
+    es = Elasticsearch(es_host)
+    source_fields = source.split(',') if source else None
+    print("slices\thits\tseconds\thits/second")
+    for slice_number in [int(number) for number in slices.split(',')]:
+        started = time.time()
+        ids = set()
+        for hit in iterate_hits(es, index, source=source_fields, page_size=page_size, slices=slice_number):
+            ids.add(hit['_id'])
+        duration = time.time() - started
+        print(f"{slice_number}\t{len(ids)}\t{duration:.2f}\t{len(ids) / duration:.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+"""
+This script switches a build of indices between the bulk-build profile and the production profile
+1. start: disable refresh and replicas so the import scripts could write into the build quickly, the settings in use
+   are kept in <es_index_prefix>.build_profile.json. The bulk indexers refresh the indices they wrote when they
+   finish, so the scripts reading the build later in the pipeline see the documents
+2. finish: restore the settings kept by start, force merge the segments and wait for the indices to become green
+"""
+import json
+import os
+import time
+import click
+from typing import Dict
+from elasticsearch import Elasticsearch
+from constants import TYPES, BUILD_INDEX_SETTINGS, PRODUCTION_INDEX_SETTINGS, STAGING_NODE1
+from utils import remove_underscore_from_end_prefix
+
+# the file keeping the settings of the indices before the bulk-build profile was applied
+STATE_FILE_SUFFIX = '.build_profile.json'
+
+
+@click.command()
+@click.argument('es_index_prefix')
+@click.option(
+    '--es_host',
+    default=STAGING_NODE1,
+    help='Specify the Elastic Search server (port could be included), e.g. wp-np3-e2:9200.'
+)
+@click.option(
+    '--stage',
+    default='finish',
+    help='Either start (apply the bulk-build settings) or finish (restore the production settings), '
+         'default to be finish'
+)
+@click.option(
+    '--timeout',
+    default='30m',
+    help='Specify how long to wait for the indices to become green, default to be 30m'
+)
+def main(es_host, es_index_prefix, stage, timeout) -> None:
+    """
+    Apply the bulk-build profile to or restore the production profile for a build of indices
+    """
+    es = Elasticsearch(es_host)
+    build_profile = BuildProfile(es, es_index_prefix)
+    if stage == 'start':
+        build_profile.start()
+    elif stage == 'finish':
+        build_profile.finish(timeout)
+    else:
+        print('stage parameter can only accept value of start or finish')
+        exit(1)
+
+
+class BuildProfile:
+    """
+    Tune the settings of one build of indices, i.e. all indices named <es_index_prefix>_<type>, for bulk loading
+    """
+    def __init__(self, es, es_index_prefix: str, types=None):
+        """
+        :param es: elasticsearch python library instance
+        :param es_index_prefix: the index prefix which indicates the build of indices
+        :param types: the types of indices in the build, default to be all types in constants.TYPES
+        """
+        self.es = es
+        self.es_index_prefix = remove_underscore_from_end_prefix(es_index_prefix)
+        if types is None:
+            types = TYPES
+        self.indices = [f"{self.es_index_prefix}_{es_type}" for es_type in types]
+        self.state_file = f"{self.es_index_prefix}{STATE_FILE_SUFFIX}"
+
+    def existing_indices(self):
+        return [index for index in self.indices if self.es.indices.exists(index=index)]
+
+    def start(self) -> None:
+        """
+        Disable refresh and replicas while the build is being populated
+        """
+        indices = self.existing_indices()
+        if not indices:
+            print(f"No indices found for {self.es_index_prefix}")
+            return
+        # the indices already under the bulk-build profile keep the settings captured before, not the bulk-build ones
+        captured = self.load_state()
+        new_indices = [index for index in indices if index not in captured]
+        if new_indices:
+            captured.update(self.get_current_settings(new_indices))
+            with open(self.state_file, 'w') as f:
+                json.dump(captured, f, indent=2)
+        self.es.indices.put_settings(index=','.join(indices), body={'index': BUILD_INDEX_SETTINGS})
+        print(f"Bulk-build settings {BUILD_INDEX_SETTINGS} applied to {','.join(indices)}")
+
+    def load_state(self) -> Dict[str, Dict]:
+        """
+        :return: the settings kept by start keyed by index names, empty if start has not been run
+        """
+        if not os.path.exists(self.state_file):
+            return dict()
+        with open(self.state_file) as f:
+            return json.load(f)
+
+    def get_current_settings(self, indices) -> Dict[str, Dict]:
+        """
+        :param indices: the names of the indices
+        :return: the settings changed by the bulk-build profile of each index, including the default values
+        """
+        names = [f'index.{name}' for name in BUILD_INDEX_SETTINGS.keys()]
+        response = self.es.indices.get_settings(index=','.join(indices), name=names, include_defaults=True,
+                                                flat_settings=True)
+        current = dict()
+        for index, detail in response.items():
+            current[index] = dict()
+            for name in BUILD_INDEX_SETTINGS.keys():
+                key = f'index.{name}'
+                value = detail.get('settings', dict()).get(key, detail.get('defaults', dict()).get(key))
+                if value is not None:
+                    current[index][name] = value
+        return current
+
+    def get_restored_settings(self, indices) -> Dict[str, Dict]:
+        """
+        :param indices: the names of the indices
+        :return: the settings to restore for each index, the ones kept by start or the production settings
+        """
+        captured = self.load_state()
+        if not captured:
+            print(f"{self.state_file} not found, the default production settings are restored")
+        return {index: dict(PRODUCTION_INDEX_SETTINGS, **captured.get(index, dict())) for index in indices}
+
+    def finish(self, timeout='30m') -> None:
+        """
+        Restore the settings kept by start, force merge and wait for green health, then report the durations
+        :param timeout: how long to wait for the green health status
+        """
+        indices = self.existing_indices()
+        if not indices:
+            print(f"No indices found for {self.es_index_prefix}")
+            return
+        index_str = ','.join(indices)
+        started = time.time()
+        # the build is considered to start when the first index of the build was created
+        settings = self.es.indices.get_settings(index=index_str, name='index.creation_date')
+        creation_dates = [int(detail['settings']['index']['creation_date']) for detail in settings.values()]
+        build_duration = started - min(creation_dates) / 1000
+
+        restored = self.get_restored_settings(indices)
+        for index, index_settings in restored.items():
+            self.es.indices.put_settings(index=index, body={'index': index_settings})
+        self.es.indices.refresh(index=index_str)
+        self.es.indices.forcemerge(index=index_str, max_num_segments=1, request_timeout=3600)
+        health = self.es.cluster.health(index=index_str, wait_for_status='green', timeout=timeout,
+                                        request_timeout=3600)
+        finalise_duration = time.time() - started
+
+        if os.path.exists(self.state_file):
+            os.remove(self.state_file)
+        for index, index_settings in restored.items():
+            print(f"Settings {index_settings} restored to {index}")
+        print(f"Health status of the build: {health['status']}")
+        print(f"Build took {build_duration:.0f} seconds, finalisation took {finalise_duration:.0f} seconds")
+
+
+if __name__ == "__main__":
+    main()
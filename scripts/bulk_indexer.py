@@ -0,0 +1,505 @@
+"""
+Buffered writer built on the Elasticsearch _bulk API
+Documents are queued locally and sent in chunks using index (overwrite) semantics, which replaces the
+exists/delete/create round-trips previously done for every single document
+"""
+import hashlib
+import json
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Set
+from elasticsearch import helpers
+from elasticsearch.exceptions import TransportError
+from write_metrics import WRITE_METRICS
+from es_reader import iterate_hits
+from record_counter import RECORD_COUNTER
+
+# number of documents sent in one _bulk request
+DEFAULT_CHUNK_SIZE = 500
+# upper limit of the payload of one _bulk request
+DEFAULT_MAX_CHUNK_BYTES = 10 * 1024 * 1024
+# number of _bulk requests sent at the same time by ParallelBulkIndexer
+DEFAULT_MAX_IN_FLIGHT = 4
+# the chunk size is never shrunk below this number of documents
+DEFAULT_MIN_CHUNK_SIZE = 50
+# how many times rejected actions are sent again before they are reported as failed
+DEFAULT_MAX_RETRIES = 8
+# the status codes returned by an overloaded cluster, either for the whole request or for single actions
+RETRY_STATUSES = (429, 503)
+# the field holding the hash of the document content, used to skip unchanged documents
+CONTENT_HASH_FIELD = 'contentHash'
+# delete_unseen refuses to delete when more than this share of the tracked documents was not written,
+# which more likely means an incomplete data retrieval than withdrawn records
+DEFAULT_MAX_UNSEEN_RATIO = 0.1
+# the number of stale ids included in the reports
+REPORTED_IDS_LIMIT = 100
+
+logger = logging.getLogger('bulk_indexer')
+
+
+def compute_content_hash(doc: Dict) -> str:
+    """
+    Calculate the hash of the document content which does not depend on the order of the keys
+    :param doc: the document, the content hash field itself is ignored
+    :return: the hex digest of the hash
+    """
+    content = {k: v for k, v in doc.items() if k != CONTENT_HASH_FIELD}
+    serialized = json.dumps(content, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha1(serialized.encode('utf-8')).hexdigest()
+
+
+class BulkIndexer:
+    def __init__(self, es, chunk_size=DEFAULT_CHUNK_SIZE, max_chunk_bytes=DEFAULT_MAX_CHUNK_BYTES, doc_type='_doc',
+                 dead_letter=None, metrics=WRITE_METRICS, refresh_on_close=True, record_counter=RECORD_COUNTER):
+        """
+        :param es: elasticsearch python library instance
+        :param chunk_size: the maximum number of documents in one _bulk request
+        :param max_chunk_bytes: the maximum size in bytes of one _bulk request
+        :param doc_type: the mapping type sent with each action, None for clusters without mapping types
+        :param dead_letter: optional DeadLetterQueue instance which the failed actions are appended to
+        :param metrics: the WriteMetrics instance which records the requests, shared by all writers by default
+        :param refresh_on_close: whether to refresh the indices written when the indexer is closed
+        :param record_counter: the RecordCounter whose counts of the indices written are forgotten on close
+        """
+        self.es = es
+        self.dead_letter = dead_letter
+        self.metrics = metrics
+        self.chunk_size = chunk_size
+        self.max_chunk_bytes = max_chunk_bytes
+        self.doc_type = doc_type
+        self.refresh_on_close = refresh_on_close
+        self.record_counter = record_counter
+        # the indices written since the last refresh
+        self.written_indices: Set[str] = set()
+        self.actions: List[Dict] = list()
+        self.buffered_bytes = 0
+        self.succeeded = 0
+        # the number of updates not applied as the documents do not exist
+        self.missing = 0
+        self.errors: List[Dict] = list()
+        # results could be recorded from several threads by subclasses
+        self.lock = threading.Lock()
+        # for the indices with change tracking enabled, keys are index names
+        self.content_hashes: Dict[str, Dict[str, str]] = dict()
+        self.seen: Dict[str, Set[str]] = dict()
+        self.change_counts: Dict[str, Dict[str, int]] = dict()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def track_changes(self, index, query=None) -> None:
+        """
+        Load the content hashes of the documents already in the index. Afterwards documents written into the index
+        get the content hash field and are skipped if the content has not changed,
+        documents not written during the run could be removed with delete_unseen
+        :param index: the name of the index
+        :param query: optional query to limit the tracked documents to the ones managed by the caller
+        """
+        hashes = dict()
+        for hit in iterate_hits(self.es, index, query, [CONTENT_HASH_FIELD]):
+            hashes[hit['_id']] = hit['_source'].get(CONTENT_HASH_FIELD)
+        self.content_hashes[index] = hashes
+        self.seen[index] = set()
+        self.change_counts[index] = {'written': 0, 'skipped': 0, 'deleted': 0}
+
+    def index(self, index, doc_id, body) -> None:
+        """
+        Queue one document to be written into the index, an existing document with the same id will be overwritten
+        :param index: the name of the index to write into
+        :param doc_id: the id of the document
+        :param body: the document, either a dict or an already serialized JSON string
+        """
+        if index in self.content_hashes:
+            body = json.loads(body) if isinstance(body, str) else dict(body)
+            content_hash = compute_content_hash(body)
+            self.seen[index].add(doc_id)
+            if self.content_hashes[index].get(doc_id) == content_hash:
+                self.change_counts[index]['skipped'] += 1
+                return
+            body[CONTENT_HASH_FIELD] = content_hash
+            self.change_counts[index]['written'] += 1
+        if not isinstance(body, str):
+            body = self.es.transport.serializer.dumps(body)
+        action = {
+            '_op_type': 'index',
+            '_index': index,
+            '_id': doc_id,
+            '_source': body
+        }
+        self.add(action, len(body))
+
+    def update(self, index, doc_id, body: Dict, doc_as_upsert=False) -> None:
+        """
+        Queue a partial update of one document, updates of documents which do not exist are counted as missing
+        unless doc_as_upsert is set
+        :param index: the name of the index
+        :param doc_id: the id of the document
+        :param body: the body of the update request, e.g. {'doc': {...}}
+        :param doc_as_upsert: whether to create the document from the partial document if it does not exist
+        """
+        action = {
+            '_op_type': 'update',
+            '_index': index,
+            '_id': doc_id
+        }
+        action.update(body)
+        if doc_as_upsert:
+            action['doc_as_upsert'] = True
+        self.add(action, len(self.es.transport.serializer.dumps(body)))
+
+    def delete(self, index, doc_id) -> None:
+        """
+        Queue the deletion of one document
+        :param index: the name of the index
+        :param doc_id: the id of the document
+        """
+        self.add({'_op_type': 'delete', '_index': index, '_id': doc_id}, 0)
+
+    def delete_unseen(self, dry_run=True, max_ratio=DEFAULT_MAX_UNSEEN_RATIO) -> Dict[str, Dict]:
+        """
+        Delete the documents which were loaded by track_changes but not written during this run.
+        Indices where nothing has been written or where more than max_ratio of the tracked documents were not written
+        are left untouched as that more likely means a failed data retrieval
+        :param dry_run: only report the documents not written without deleting them
+        :param max_ratio: the maximum share of the tracked documents which could be deleted from one index
+        :return: for every tracked index the number of documents not written, the first of their ids and
+        whether they were deleted
+        """
+        result = dict()
+        for index, hashes in self.content_hashes.items():
+            unseen = sorted(hashes.keys() - self.seen[index])
+            result[index] = {'unseen': len(unseen), 'ids': unseen[:REPORTED_IDS_LIMIT], 'deleted': False}
+            if not unseen:
+                continue
+            if not self.seen[index]:
+                logger.warning(f"Nothing written into {index} during the run, stale documents are kept")
+                continue
+            if len(unseen) > max_ratio * len(hashes):
+                logger.error(f"{len(unseen)} of {len(hashes)} documents of {index} not written during the run, "
+                             f"more than {max_ratio:.0%}, stale documents are kept: {unseen[:REPORTED_IDS_LIMIT]}")
+                continue
+            if dry_run:
+                logger.warning(f"{len(unseen)} documents of {index} not written during the run would be deleted: "
+                               f"{unseen[:REPORTED_IDS_LIMIT]}")
+                continue
+            logger.warning(f"Deleting {len(unseen)} documents of {index} not written during the run: "
+                           f"{unseen[:REPORTED_IDS_LIMIT]}")
+            for doc_id in unseen:
+                self.delete(index, doc_id)
+            self.change_counts[index]['deleted'] += len(unseen)
+            result[index]['deleted'] = True
+        return result
+
+    def add(self, action: Dict, size: int) -> None:
+        """
+        Queue one bulk action and send the buffer when either the count or the size limit is reached
+        :param action: the action in the format expected by elasticsearch.helpers
+        :param size: the size of the serialized action body, used for the byte limit
+        """
+        if self.doc_type:
+            action['_type'] = self.doc_type
+        self.actions.append(action)
+        self.buffered_bytes += size
+        if len(self.actions) >= self.chunk_size or self.buffered_bytes >= self.max_chunk_bytes:
+            self.flush()
+
+    def flush(self) -> None:
+        """
+        Send all queued actions to Elasticsearch
+        """
+        if not self.actions:
+            return
+        actions = self.actions
+        self.actions = list()
+        self.buffered_bytes = 0
+        self.send(actions)
+
+    def send(self, actions: List[Dict]) -> None:
+        """
+        Send the actions with the _bulk API and record the result of every action
+        :param actions: the actions to send
+        """
+        for action, (ok, item) in zip(actions, self.send_request(actions)):
+            self.record_result(action, ok, item)
+
+    def send_request(self, actions: List[Dict]) -> List:
+        """
+        Send the actions with elasticsearch.helpers.streaming_bulk and record the write metrics per index
+        :param actions: the actions to send
+        :return: the results yielded by elasticsearch.helpers.streaming_bulk, one for each action in the same order
+        """
+        started = time.time()
+        results = list(helpers.streaming_bulk(self.es, actions, chunk_size=len(actions),
+                                              max_chunk_bytes=self.max_chunk_bytes,
+                                              raise_on_error=False, raise_on_exception=False))
+        latency = time.time() - started
+        # keys are index names, values are the numbers of documents and bytes
+        counts: Dict[str, List[int]] = dict()
+        for action in actions:
+            count = counts.setdefault(action['_index'], [0, 0])
+            count[0] += 1
+            count[1] += get_action_size(action, self.es.transport.serializer)
+        for index, (documents, size) in counts.items():
+            self.metrics.record_request(index, documents, size, latency)
+        with self.lock:
+            self.written_indices.update(counts.keys())
+        return results
+
+    def record_result(self, action: Dict, ok: bool, item: Dict) -> None:
+        """
+        Count the succeeded action or keep the details of the failed one and add it to the dead-letter file
+        :param action: the action sent
+        :param ok: whether the action succeeded
+        :param item: the item of the _bulk response for the action
+        """
+        with self.lock:
+            if ok:
+                self.succeeded += 1
+                return
+            op_type, detail = list(item.items())[0]
+            if op_type == 'update' and detail.get('status') == 404 and not action.get('doc_as_upsert'):
+                self.missing += 1
+                return
+            error = {
+                'op_type': op_type,
+                'index': detail.get('_index'),
+                'id': detail.get('_id'),
+                'status': detail.get('status'),
+                'error': detail.get('error')
+            }
+            self.errors.append(error)
+        self.metrics.record_errors(error['index'], 1)
+        logger.error(f"Error when try to {op_type} {error['id']} in index {error['index']}: {error['error']}")
+        if self.dead_letter:
+            self.dead_letter.append_action(action)
+
+    def close(self) -> None:
+        """
+        Send whatever remains in the buffer, must be called before the program finishes
+        """
+        self.flush()
+        self.refresh()
+
+    def refresh(self) -> None:
+        """
+        Make the documents written visible to searches. The bulk-build profile disables the periodic refresh,
+        the scripts reading the build later in the pipeline would not see the documents otherwise.
+        The record counts of the indices written are forgotten, so they are counted again
+        """
+        with self.lock:
+            indices = sorted(self.written_indices)
+            self.written_indices = set()
+        for index in indices:
+            self.record_counter.invalidate(index)
+        if not self.refresh_on_close or not indices:
+            return
+        try:
+            self.es.indices.refresh(index=','.join(indices))
+        except TransportError as e:
+            logger.warning(f"Failed to refresh {','.join(indices)}: {e}")
+
+    def report(self) -> Dict:
+        """
+        :return: the numbers of succeeded and failed actions sent so far,
+        the numbers of written, skipped and deleted documents for the indices with change tracking
+        the number of updates of missing documents and the number of actions recorded in the dead-letter file
+        """
+        result = {
+            'succeeded': self.succeeded,
+            'failed': len(self.errors)
+        }
+        if self.change_counts:
+            result['changes'] = self.change_counts
+        if self.missing:
+            result['missing'] = self.missing
+        if self.dead_letter:
+            result['dead_letters'] = self.dead_letter.count
+        return result
+
+
+class ParallelBulkIndexer(BulkIndexer):
+    """
+    Send the _bulk requests from a pool of threads, at most max_in_flight requests at the same time.
+    When all requests are in flight, queueing more documents blocks until one of them finishes.
+    Actions rejected with 429 or 503 are sent again after an exponential backoff, the chunk size is halved
+    on every rejection and grown back step by step after requests which went through without rejections.
+    The chunks are sent independently, so the actions of one document could be applied out of order when they end up
+    in different chunks: callers must not queue more than one action for the same document id
+    """
+    def __init__(self, es, max_in_flight=DEFAULT_MAX_IN_FLIGHT, chunk_size=DEFAULT_CHUNK_SIZE,
+                 min_chunk_size=DEFAULT_MIN_CHUNK_SIZE, max_retries=DEFAULT_MAX_RETRIES, initial_backoff=1,
+                 max_backoff=60, **kwargs):
+        """
+        :param es: elasticsearch python library instance
+        :param max_in_flight: the maximum number of _bulk requests sent at the same time
+        :param chunk_size: the initial and also the maximum number of documents in one _bulk request
+        :param min_chunk_size: the chunk size is not shrunk below this number
+        :param max_retries: the maximum number of retries for the rejected actions
+        :param initial_backoff: seconds to wait before the first retry, doubled for each following retry
+        :param max_backoff: the upper limit of the seconds to wait before one retry
+        :param kwargs: other parameters of BulkIndexer
+        """
+        super().__init__(es, chunk_size=chunk_size, **kwargs)
+        self.max_in_flight = max_in_flight
+        self.max_chunk_size = chunk_size
+        self.min_chunk_size = min(min_chunk_size, chunk_size)
+        self.max_retries = max_retries
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.executor = ThreadPoolExecutor(max_workers=max_in_flight)
+        self.in_flight = threading.BoundedSemaphore(max_in_flight)
+        self.futures = list()
+        self.started = time.time()
+        self.counters = {'requests': 0, 'actions': 0, 'rejections': 0, 'retries': 0}
+
+    def flush(self) -> None:
+        """
+        Hand the queued actions over to the thread pool, blocks while max_in_flight requests are being sent
+        """
+        if not self.actions:
+            return
+        actions = self.actions
+        self.actions = list()
+        self.buffered_bytes = 0
+        self.in_flight.acquire()
+        future = self.executor.submit(self.send, actions)
+        future.add_done_callback(lambda f: self.in_flight.release())
+        self.futures = [f for f in self.futures if not f.done()]
+        self.futures.append(future)
+
+    def send(self, actions: List[Dict]) -> None:
+        """
+        Send the actions and retry the rejected ones until they are accepted or max_retries is reached,
+        the rejected actions are sent again in chunks of the shrunk chunk size
+        :param actions: the actions to send
+        """
+        attempt = 0
+        chunks = [actions]
+        while chunks:
+            retry = attempt < self.max_retries
+            rejected = list()
+            for chunk in chunks:
+                rejected.extend(self.send_chunk(chunk, retry))
+            if not rejected:
+                return
+            backoff = min(self.max_backoff, self.initial_backoff * 2 ** attempt)
+            # the jitter prevents all threads from retrying at the same moment
+            backoff = backoff / 2 + random.uniform(0, backoff / 2)
+            with self.lock:
+                chunk_size = self.chunk_size
+                self.counters['retries'] += len(rejected)
+            logger.warning(f"{len(rejected)} actions rejected, retry in {backoff:.1f} seconds "
+                           f"with chunk size {chunk_size}")
+            time.sleep(backoff)
+            for action in rejected:
+                self.metrics.record_retries(action['_index'], 1)
+            attempt += 1
+            chunks = [rejected[i:i + chunk_size] for i in range(0, len(rejected), chunk_size)]
+
+    def send_chunk(self, actions: List[Dict], retry: bool) -> List[Dict]:
+        """
+        Send one _bulk request and record the result of every action which is not going to be sent again
+        :param actions: the actions to send
+        :param retry: whether the rejected actions are going to be sent again
+        :return: the rejected actions to send again
+        """
+        results = list(zip(actions, self.send_request(actions)))
+        rejected = [action for action, (ok, item) in results if not ok and get_status(item) in RETRY_STATUSES]
+        with self.lock:
+            self.counters['requests'] += 1
+            self.counters['actions'] += len(actions)
+            self.counters['rejections'] += len(rejected)
+        if rejected:
+            self.shrink_chunk_size()
+        else:
+            self.grow_chunk_size()
+        for action, (ok, item) in results:
+            if not (retry and not ok and get_status(item) in RETRY_STATUSES):
+                self.record_result(action, ok, item)
+        return rejected if retry else list()
+
+    def shrink_chunk_size(self) -> None:
+        with self.lock:
+            self.chunk_size = max(self.min_chunk_size, self.chunk_size // 2)
+
+    def grow_chunk_size(self) -> None:
+        with self.lock:
+            step = max(1, self.max_chunk_size // 10)
+            self.chunk_size = min(self.max_chunk_size, self.chunk_size + step)
+
+    def close(self) -> None:
+        """
+        Send whatever remains in the buffer and wait for all requests in flight to finish
+        """
+        self.flush()
+        for future in self.futures:
+            # raise the exceptions not handled within the threads
+            future.result()
+        self.futures = list()
+        self.executor.shutdown(wait=True)
+        self.refresh()
+
+    def stats(self) -> Dict:
+        """
+        :return: the throughput and rejection counters since the indexer was created
+        """
+        with self.lock:
+            result = dict(self.counters)
+            result['chunk_size'] = self.chunk_size
+        elapsed = time.time() - self.started
+        result['elapsed'] = round(elapsed, 1)
+        result['actions_per_second'] = round(result['actions'] / elapsed, 1) if elapsed else 0
+        return result
+
+    def report(self) -> Dict:
+        """
+        :return: the report of BulkIndexer together with the throughput and rejection counters
+        """
+        result = super().report()
+        result['throughput'] = self.stats()
+        return result
+
+
+def update_documents(es, index, docs: Dict[str, Dict], doc_as_upsert=False, **kwargs) -> Dict:
+    """
+    Apply partial updates to many documents of one index with parallel _bulk requests
+    :param es: elasticsearch python library instance
+    :param index: the name of the index
+    :param docs: the partial documents, keys are the document ids
+    :param doc_as_upsert: whether to create the documents which do not exist
+    :param kwargs: other parameters of ParallelBulkIndexer, e.g. doc_type and dead_letter
+    :return: the report of the indexer
+    """
+    with ParallelBulkIndexer(es, **kwargs) as bulk_indexer:
+        for doc_id, doc in docs.items():
+            bulk_indexer.update(index, doc_id, {'doc': doc}, doc_as_upsert)
+    return bulk_indexer.report()
+
+
+def get_action_size(action: Dict, serializer) -> int:
+    """
+    :param action: the action in the format expected by elasticsearch.helpers
+    :param serializer: the serializer of the elasticsearch instance
+    :return: the size of the document or the partial document sent with the action, 0 for deletions
+    """
+    op_type = action.get('_op_type', 'index')
+    if op_type == 'delete':
+        return 0
+    if op_type == 'index':
+        body = action['_source']
+        return len(body) if isinstance(body, str) else len(serializer.dumps(body))
+    return len(serializer.dumps({k: v for k, v in action.items() if not k.startswith('_')}))
+
+
+def get_status(item: Dict):
+    """
+    :param item: the item of the _bulk response for one action
+    :return: the status code of the action
+    """
+    return list(item.values())[0].get('status')
@@ -1,6 +1,7 @@
 from elasticsearch import Elasticsearch
 
 from fetch_articles import *
+from bulk_indexer import update_documents
 
 
 def main(index, es):
@@ -9,9 +10,8 @@ def main(index, es):
 
 
 def clean_records(index, ids, es):
-    for id in ids:
-        body = {"doc": {"paperPublished": "false", "publishedArticles": []}}
-        es.update(index=index, doc_type="_doc", id=id, body=body)
+    docs = {id: {"paperPublished": "false", "publishedArticles": []} for id in ids}
+    update_documents(es, index, docs)
 
 
 if __name__ == "__main__":
@@ -1,39 +1,47 @@
 """
-Remove the oldest local etag cache files
+Remove the oldest etag harvests from the local etag store, and the etag cache files of the former format
 """
 import click
-import subprocess
+import glob
+import os
+from etag_store import EtagStore, ETAG_STORE_FILE
 
 
 @click.command()
 @click.option(
     '--number_to_keep',
     default="5",
-    help='Specify how many etag cache files will be kept locally, default to be 5'
+    help='Specify how many etag harvests will be kept locally, default to be 5'
 )
-def main(number_to_keep):
+@click.option(
+    '--store',
+    default=ETAG_STORE_FILE,
+    help=f'Specify the location of the etag store, default to be {ETAG_STORE_FILE}'
+)
+def main(number_to_keep, store):
     """
     The main function
-    :param number_to_keep:
+    :param number_to_keep: the number of the latest harvests to keep
+    :param store: the location of the etag store
     :return:
     """
     try:
         num = int(number_to_keep)
     except ValueError:
         print(f"The provided parameter value {number_to_keep} is not an integer")
-    # get the shell command output, the shell command list files in the datestamp order, newest at the top
-    result = subprocess.run(['ls -tl etag_list_*.txt'], stdout=subprocess.PIPE, shell=True).stdout.decode('utf-8')
-    lines = result.split('\n')
-    # remove the empty line as the command prompt always start in the new line,
-    # i.e. there is a \n at the end of ls result
-    lines.pop()
-    total = len(lines)
-    if num >= total:
-        print ("Within the limit, all etag cache files are kept")
+        exit(1)
+    if os.path.isfile(store):
+        etag_store = EtagStore(store)
+        removed = etag_store.prune(num)
+        etag_store.close()
+        print(f"Removed {removed['harvests']} etag harvests and {removed['accessions']} accessions not seen since")
+    # the dated etag cache files written before the etag store, the file names sort in date order
+    files = sorted(glob.glob('etag_list_*.txt'), reverse=True)
+    if num >= len(files):
+        print("Within the limit, all etag cache files are kept")
     else:
-        for i in range(num, len(lines)):
-            remaining = lines[i].split("etag_list_")[1:]
-            subprocess.run(f"rm etag_list_{remaining[0]}", shell=True)
+        for filename in files[num:]:
+            os.remove(filename)
 
 
 if __name__ == "__main__":
@@ -1,12 +1,24 @@
 """
 compare two versions of same type records stored in the two different indices
+Both indices are read in the order of the record ids and walked side by side, so the memory used does not depend on
+the size of the indices. The differences could be written into a JSON lines file, one difference per line
 """
+import json
+import threading
 import click
-import requests
-from typing import Set
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterator, Optional, Tuple
+from elasticsearch import Elasticsearch
 import constants
+from bulk_indexer import compute_content_hash
+from es_reader import sorted_hits
 from utils import remove_underscore_from_end_prefix
 
+ONLY_IN_1 = 'only_in_1'
+ONLY_IN_2 = 'only_in_2'
+CONTENT_DIFFERS = 'content_differs'
+
+
 @click.command()
 @click.option(
     '--es_host',
@@ -23,15 +35,27 @@ from utils import remove_underscore_from_end_prefix
 )
 @click.option(
     '--es_type',
-    help='Specify the type of data to be comapred, mandatory field'
+    help='Specify the type of data to be comapred, mandatory field, all to compare all types in parallel'
+)
+@click.option(
+    '--compare_content',
+    default="false",
+    help='Specify whether to compare the content of the records existing in both indices, default to be false'
+)
+@click.option(
+    '--diff_file',
+    default=None,
+    help='Specify the JSON lines file to write the differences into, default to print them only'
 )
-def main(es_host, es_index_1, es_index_2, es_type):
+def main(es_host, es_index_1, es_index_2, es_type, compare_content, diff_file):
     """
     The main function
     :param es_host: elastic search host server
     :param es_index_1: the index prefix 1
     :param es_index_2: the index prefix 2
-    :param es_type: the type of records to be compared
+    :param es_type: the type of records to be compared, all for all types
+    :param compare_content: whether to compare the content of the records existing in both indices
+    :param diff_file: the file to write the differences into
     :return:
     """
     error_flag = False
@@ -45,51 +69,101 @@ def main(es_host, es_index_1, es_index_2, es_type):
         print("mandatory parameter es_type is not provided")
         error_flag = True
     else:
-        if es_type not in constants.TYPES:
-            print("Unrecognized type which must be one of {}".format(",".join(constants.TYPES)))
+        if es_type != 'all' and es_type not in constants.TYPES:
+            print("Unrecognized type which must be all or one of {}".format(",".join(constants.TYPES)))
             error_flag = True
+    compare_content = compare_content.lower()
+    if compare_content not in ['true', 'false']:
+        print('compare_content parameter can only accept value of true or false')
+        error_flag = True
     if error_flag:
         exit()
 
     es_index_1 = remove_underscore_from_end_prefix(es_index_1)
     es_index_2 = remove_underscore_from_end_prefix(es_index_2)
-    resp1 = get_ids(es_host, es_index_1, es_type)
-    resp2 = get_ids(es_host, es_index_2, es_type)
-    for record_id in sorted(resp1):
-        if record_id in resp2:
-            resp2.remove(record_id)
-        else:
-            print(f"Only in {es_index_1}_{es_type}: {record_id}")
+    es_types = constants.TYPES if es_type == 'all' else [es_type]
+    es = Elasticsearch(es_host)
+    lock = threading.Lock()
+    out = open(diff_file, 'w') if diff_file else None
 
-    if resp2:
-        for record_id in sorted(resp2):
-            print(f"Only in {es_index_2}_{es_type}: {record_id}")
+    def report(status: str, index_type: str, record_id: str) -> None:
+        with lock:
+            if status == ONLY_IN_1:
+                print(f"Only in {es_index_1}_{index_type}: {record_id}")
+            elif status == ONLY_IN_2:
+                print(f"Only in {es_index_2}_{index_type}: {record_id}")
+            else:
+                print(f"Content differs in {index_type}: {record_id}")
+            if out:
+                out.write(json.dumps({'type': index_type, 'id': record_id, 'status': status}) + "\n")
 
+    try:
+        with ThreadPoolExecutor(max_workers=len(es_types)) as executor:
+            futures = {index_type: executor.submit(compare_indices, es, f"{es_index_1}_{index_type}",
+                                                   f"{es_index_2}_{index_type}", compare_content == 'true',
+                                                   lambda status, record_id, t=index_type: report(status, t, record_id))
+                       for index_type in es_types}
+            summary = {index_type: future.result() for index_type, future in futures.items()}
+    finally:
+        if out:
+            out.close()
+    print(json.dumps(summary, indent=2))
 
-def get_ids(es_host: str, es_index: str, es_type:str) -> Set[str]:
+
+def compare_indices(es, index_1: str, index_2: str, compare_content=False,
+                    on_difference: Optional[Callable[[str, str], None]] = None) -> Dict[str, int]:
     """
-    Return the id list in the form of Set
-    :param es_host: elastic search host server
-    :param es_index: the index prefix e.g. faang_build_1
-    :param es_type: the type of records to be compared
-    :return: the id list
+    Compare the records of two indices
+    :param es: elasticsearch python library instance
+    :param index_1: the first index
+    :param index_2: the second index
+    :param compare_content: whether to compare the content of the records existing in both indices
+    :param on_difference: called with the status and the record id for each difference
+    :return: the number of records of each status
     """
-    # first get the total number of records
-    url: str = f"{es_host}/{es_index}_{es_type}/_search?_source=_id"
-    response = requests.get(url).json()
-    total_number = response['hits']['total']
-    if total_number == 0:
-        return set()
-    # second get the list
-    results = set()
-    url = f"{url}&size={total_number}"
-    response = requests.get(url).json()
-    try:
-        for hit in response['hits']['hits']:
-            results.add(hit['_id'])
-        return results
-    except KeyError:
-        print (f"url: {url}\nresponse: {response}")
+    counts = {ONLY_IN_1: 0, ONLY_IN_2: 0, CONTENT_DIFFERS: 0, 'identical': 0}
+    for status, record_id in merge_join(get_ids(es, index_1, compare_content),
+                                        get_ids(es, index_2, compare_content)):
+        counts[status] += 1
+        if on_difference and status != 'identical':
+            on_difference(status, record_id)
+    return counts
+
+
+def get_ids(es, es_index: str, with_hash=False) -> Iterator[Tuple[str, Optional[str]]]:
+    """
+    Yield the ids of the records in ascending order
+    :param es: elasticsearch python library instance
+    :param es_index: the full index name e.g. faang_build_1_specimen
+    :param with_hash: whether to also calculate the content hash of each record
+    :return: generator of tuples of the id and the content hash, None if the hash is not wanted
+    """
+    for hit in sorted_hits(es, es_index, source=None if with_hash else False):
+        yield hit['_id'], compute_content_hash(hit['_source']) if with_hash else None
+
+
+def merge_join(ids_1: Iterator[Tuple[str, Optional[str]]],
+               ids_2: Iterator[Tuple[str, Optional[str]]]) -> Iterator[Tuple[str, str]]:
+    """
+    Walk two sorted streams of ids side by side
+    :param ids_1: the ids and content hashes of the first index in ascending order of the ids
+    :param ids_2: the ids and content hashes of the second index in ascending order of the ids
+    :return: generator of tuples of the status and the id
+    """
+    missing = (None, None)
+    record_1 = next(ids_1, missing)
+    record_2 = next(ids_2, missing)
+    while record_1 is not missing or record_2 is not missing:
+        if record_2 is missing or (record_1 is not missing and record_1[0] < record_2[0]):
+            yield ONLY_IN_1, record_1[0]
+            record_1 = next(ids_1, missing)
+        elif record_1 is missing or record_2[0] < record_1[0]:
+            yield ONLY_IN_2, record_2[0]
+            record_2 = next(ids_2, missing)
+        else:
+            yield (CONTENT_DIFFERS if record_1[1] != record_2[1] else 'identical'), record_1[0]
+            record_1 = next(ids_1, missing)
+            record_2 = next(ids_2, missing)
 
 
 if __name__ == "__main__":
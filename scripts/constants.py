@@ -36,6 +36,17 @@ ALIASES_IN_USE = {
 # Current indices in use
 TYPES = ['organism', 'specimen', 'file', 'experiment', 'dataset', 'analysis', 'article', 'log']
 
+# Index settings used while a build of indices is being populated, and the ones restored once the build finishes
+# when the settings in use before the build were not kept, see build_profile.py
+BUILD_INDEX_SETTINGS = {
+    'refresh_interval': '-1',
+    'number_of_replicas': 0
+}
+PRODUCTION_INDEX_SETTINGS = {
+    'refresh_interval': '1s',
+    'number_of_replicas': 1
+}
+
 # Paths for rsync command (is used during syncing process between staging and production elasticsearch servers)
 FROM = '/nfs/public/rw/reseq-info/elastic_search_staging/snapshot_repo/es6_faang_repo/'
 TO = '/nfs/public/rw/reseq-info/elastic_search/snapshot_repo/es6_faang_repo/'
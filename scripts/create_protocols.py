@@ -4,9 +4,17 @@ from elasticsearch import Elasticsearch, RequestsHttpConnection
 
 from constants import *
 from utils import *
+from snapshot_cache import read_index
+from document_lookup import DocumentLookup
 
 ES_USER = os.getenv('ES_USER')
 ES_PASSWORD = os.getenv('ES_PASSWORD')
+# the only fields of specimens needed to build the sample protocols
+SAMPLE_PROTOCOL_FIELDS = [
+    'specimenFromOrganism.specimenCollectionProtocol', 'poolOfSpecimens.poolCreationProtocol',
+    'cellSpecimen.purificationProtocol', 'cellCulture.cellCultureProtocol', 'cellLine.cultureProtocol',
+    'cellType.text', 'organism.organism.text', 'organism.breed.text', 'derivedFrom'
+]
 
 class CreateProtocols:
     """
@@ -38,9 +46,8 @@ class CreateProtocols:
         This function will create protocols data for samples
         """
         self.logger.info("Creating sample protocols")
-        results = self.es_staging.search(index="specimen", size=1000000)
         entries = {}
-        for result in results["hits"]["hits"]:
+        for result in read_index(self.es_staging, "specimen", source=SAMPLE_PROTOCOL_FIELDS):
             # Choose field name for specimen type and protocol
             if "specimenFromOrganism" in result["_source"] and \
                     'specimenCollectionProtocol' in \
@@ -125,6 +132,7 @@ class CreateProtocols:
                 entries[key]["key"] = key
                 entries[key]["url"] = url
 
+        protocols = list()
         for key, protocol_data in entries.items():
             if key == 'restricted access':
                 continue
@@ -139,20 +147,8 @@ class CreateProtocols:
                 protocol_data['protocolName'] = id
             else:
                 id = key
-            if es_staging.exists('protocol_samples', id=id):
-                es_staging.update(
-                    'protocol_samples', id=id,
-                    body={
-                        'doc': {
-                            'specimens': protocol_data["specimens"]
-                        }
-                    }
-                )
-            else:
-                es_staging.create(
-                    'protocol_samples', id=id,
-                    body=protocol_data
-                )
+            protocols.append((id, protocol_data))
+        self.write_protocols('protocol_samples', protocols, 'specimens')
 
 
     def create_experiment_protocol(self):
@@ -160,7 +156,6 @@ class CreateProtocols:
         This function will create protocols data for experiments
         """
         self.logger.info("Creating experiments protocols")
-        results = self.es_staging.search(index="experiment", size=1000000)
         entries = {}
         assay_types = {
             "ATAC-seq": ["transposaseProtocol"],
@@ -186,7 +181,7 @@ class CreateProtocols:
             "CAGE-seq": ["cageProtocol"],
 
         }
-        for result in results["hits"]["hits"]:
+        for result in read_index(self.es_staging, "experiment"):
             # Choose field name for specimen type and protocol
             if "experimentalProtocol" in result["_source"]:
                 protocol = "experimentalProtocol"
@@ -235,30 +230,15 @@ class CreateProtocols:
                 entries[key]["key"] = key
                 entries[key]["url"] = url
 
-        for key, protocol_data in entries.items():
-            if es_staging.exists('protocol_files', id=key):
-                es_staging.update(
-                    'protocol_files', id=key,
-                    body={
-                        'doc': {
-                            'experiments': protocol_data["experiments"]
-                        }
-                    }
-                )
-            else:
-                es_staging.create(
-                    'protocol_files', id=key,
-                    body=protocol_data
-                )
+        self.write_protocols('protocol_files', list(entries.items()), 'experiments')
 
     def create_analysis_protocol(self):
         """
         This function will create protocols data for analyses
         """
         self.logger.info("Creating analysis protocols")
-        results = self.es_staging.search(index="analysis", size=1000000)
         entries = {}
-        for result in results["hits"]["hits"]:
+        for result in read_index(self.es_staging, "analysis"):
             if "analysisProtocol" in result["_source"] and \
                     result["_source"]["analysisProtocol"]:
                 key = result['_source']['analysisProtocol']['filename']
@@ -313,6 +293,7 @@ class CreateProtocols:
                 entries[key]["key"] = key
                 entries[key]["url"] = url
 
+        protocols = list()
         for key, protocol_data in entries.items():
             if key == 'restricted access':
                 continue
@@ -327,20 +308,35 @@ class CreateProtocols:
                 protocol_data['protocolName'] = id
             else:
                 id = key
-            if es_staging.exists('protocol_analysis', id=id):
-                es_staging.update(
-                    'protocol_analysis', id=id,
+            protocols.append((id, protocol_data))
+        self.write_protocols('protocol_analysis', protocols, 'analyses')
+
+    def write_protocols(self, index, protocols, members):
+        """
+        Create the protocols not existing yet and update the records following the existing protocols,
+        the existence of all protocols is checked with a few _mget requests
+        :param index: the protocol index
+        :param protocols: list of tuples of the protocol id and the protocol data
+        :param members: the field holding the records following the protocol, e.g. specimens
+        """
+        lookup = DocumentLookup(self.es_staging, index)
+        lookup.prefetch(protocol_id for protocol_id, _ in protocols)
+        for protocol_id, protocol_data in protocols:
+            if lookup.exists(protocol_id):
+                self.es_staging.update(
+                    index, id=protocol_id,
                     body={
                         'doc': {
-                            'analyses': protocol_data["analyses"]
+                            members: protocol_data[members]
                         }
                     }
                 )
             else:
-                es_staging.create(
-                    'protocol_analysis', id=id,
+                self.es_staging.create(
+                    index, id=protocol_id,
                     body=protocol_data
                 )
+                lookup.set(protocol_id, dict())
 
 
 if __name__ == "__main__":
@@ -2,6 +2,7 @@ from elasticsearch import Elasticsearch
 import json
 
 from utils import *
+from snapshot_cache import read_index
 from constants import STAGING_NODE1, STAGING_NODE2, MALES, FEMALES
 
 
@@ -47,15 +48,13 @@ class CreateSummary:
                 standard_summary_name = 'standardSummaryFAANGOnly'
                 organism_summary_name = 'organismSummaryFAANGOnly'
                 breed_summary_name = 'breedSummaryFAANGOnly'
-            results = self.es_instance.search(index='organism', doc_type='_doc',
-                                              body=body, size=1000000)
-            standard_data = get_standard(results['hits']['hits'])
+            hits = list(read_index(self.es_instance, 'organism', query=body.get('query')))
+            standard_data = get_standard(hits)
             sex_data = dict()
-            paper_published_data = get_number_of_published_papers(
-                results['hits']['hits'])
+            paper_published_data = get_number_of_published_papers(hits)
             organism_data = dict()
             breed_data = dict()
-            for item in results['hits']['hits']:
+            for item in hits:
                 # get data for sex_data
                 sex = item['_source']['sex']['text']
                 if sex in MALES:
@@ -123,19 +122,17 @@ class CreateSummary:
                 organism_summary_name = 'organismSummaryFAANGOnly'
                 material_summary_name = 'materialSummaryFAANGOnly'
                 breed_summary_name = 'breedSummaryFAANGOnly'
-            results = self.es_instance.search(index='specimen', doc_type='_doc',
-                                              body=body, size=1000000)
+            hits = list(read_index(self.es_instance, 'specimen', query=body.get('query')))
             sex_data = dict()
-            paper_published_data = get_number_of_published_papers(
-                results['hits']['hits'])
-            standard_data = get_standard(results['hits']['hits'])
+            paper_published_data = get_number_of_published_papers(hits)
+            standard_data = get_standard(hits)
             cell_type_data = dict()
             organism_data = dict()
             material_data = dict()
             breed_data = dict()
 
             # get data for sex_data
-            for item in results['hits']['hits']:
+            for item in hits:
                 # get data for sex_data
                 if 'sex' in item['_source']['organism']:
                     sex = item['_source']['organism']['sex']['text']
@@ -220,14 +217,12 @@ class CreateSummary:
                 paper_published_summary_name = 'paperPublishedSummaryFAANGOnly'
                 specie_summary_name = 'specieSummaryFAANGOnly'
                 assay_type_summary_name = 'assayTypeSummaryFAANGOnly'
-            results = self.es_instance.search(index='dataset', doc_type='_doc',
-                                              body=body, size=1000000)
-            standard_data = get_standard(results['hits']['hits'])
-            paper_published_data = get_number_of_published_papers(
-                results['hits']['hits'])
+            hits = list(read_index(self.es_instance, 'dataset', query=body.get('query')))
+            standard_data = get_standard(hits)
+            paper_published_data = get_number_of_published_papers(hits)
             species_data = dict()
             assay_type_data = dict()
-            for item in results['hits']['hits']:
+            for item in hits:
                 # get data for species_data
                 for specie in item['_source']['species']:
                     species_data.setdefault(specie['text'], 0)
@@ -276,14 +271,12 @@ class CreateSummary:
                 paper_published_summary_name = 'paperPublishedSummaryFAANGOnly'
                 specie_summary_name = 'specieSummaryFAANGOnly'
                 assay_type_summary_name = 'assayTypeSummaryFAANGOnly'
-            results = self.es_instance.search(index='file', doc_type='_doc',
-                                              body=body, size=1000000)
+            hits = list(read_index(self.es_instance, 'file', query=body.get('query')))
             standard_data = dict()
-            paper_published_data = get_number_of_published_papers(
-                results['hits']['hits'])
+            paper_published_data = get_number_of_published_papers(hits)
             species_data = dict()
             assay_type_data = dict()
-            for item in results['hits']['hits']:
+            for item in hits:
                 # get data for standard_data
                 standard = item['_source']['experiment']['standardMet']
                 standard_data.setdefault(standard, 0)
@@ -0,0 +1,148 @@
+"""
+Dead-letter file for the Elasticsearch writes which failed, and the command to replay them
+Every failed action is appended to the file as one compact JSON line holding the operation, index, id and body,
+so after a transient problem of the cluster only the failed documents need to be sent again instead of re-running
+the whole import. Replaying sends the entries in bulk, the entries not replayed or failing again stay in the file
+"""
+import json
+import os
+import threading
+import uuid
+import click
+from typing import Dict, Iterator, List
+from elasticsearch import Elasticsearch
+from bulk_indexer import BulkIndexer
+from constants import STAGING_NODE1
+
+DEAD_LETTER_FILE = 'dead_letter.jsonl'
+
+
+@click.command()
+@click.option(
+    '--es_hosts',
+    default=STAGING_NODE1,
+    help='Specify the Elastic Search server(s) (port could be included), e.g. wp-np3-e2:9200. '
+         'If multiple servers are provided, please use ";" to separate them, e.g. "wp-np3-e2;wp-np3-e3"'
+)
+@click.option(
+    '--dead_letter_file',
+    default=DEAD_LETTER_FILE,
+    help=f'Specify the dead-letter file to replay, default to be {DEAD_LETTER_FILE}'
+)
+@click.option(
+    '--indices',
+    default="",
+    help='Specify the indices to replay, e.g. "faang_build_1_file;faang_build_1_dataset". '
+         'If not provided, then all entries are replayed'
+)
+def main(es_hosts, dead_letter_file, indices):
+    """
+    Re-submit the failed writes recorded in the dead-letter file
+    """
+    if not os.path.exists(dead_letter_file):
+        print(f'Dead-letter file {dead_letter_file} not found')
+        exit(1)
+    es = Elasticsearch(es_hosts.split(";"))
+    selected = set(indices.split(";")) if indices else None
+    result = replay(es, dead_letter_file, selected)
+    print(f"Replayed {result['replayed']} entries, {result['failed']} failed again, {result['kept']} kept in the file")
+
+
+class DeadLetterQueue:
+    """
+    Append-only file of the failed actions, safe to be used from several threads
+    """
+    def __init__(self, path=DEAD_LETTER_FILE):
+        """
+        :param path: the location of the dead-letter file
+        """
+        self.path = path
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def append(self, index, doc_id, body=None, op_type='index') -> None:
+        """
+        Record one failed write
+        :param index: the name of the index
+        :param doc_id: the id of the document
+        :param body: the document for index, the partial document (e.g. {'doc': ...}) for update, None for delete
+        :param op_type: the operation which failed, one of index, update and delete
+        """
+        entry = {'op_type': op_type, 'index': index, 'id': doc_id, 'body': body}
+        line = json.dumps(entry, separators=(',', ':'), default=str)
+        with self.lock:
+            with open(self.path, 'a') as f:
+                f.write(line + "\n")
+            self.count += 1
+
+    def append_action(self, action: Dict) -> None:
+        """
+        Record one failed bulk action
+        :param action: the action in the format expected by elasticsearch.helpers
+        """
+        op_type = action.get('_op_type', 'index')
+        body = None
+        if op_type == 'index':
+            body = action['_source']
+            if isinstance(body, str):
+                body = json.loads(body)
+        elif op_type == 'update':
+            body = {k: v for k, v in action.items() if not k.startswith('_')}
+        self.append(action['_index'], action['_id'], body, op_type)
+
+
+def read_entries(path) -> Iterator[Dict]:
+    """
+    :param path: the location of the dead-letter file
+    :return: the entries in the file, in the order they were written
+    """
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def replay(es, path, indices=None) -> Dict:
+    """
+    Send the entries of the dead-letter file again, then rewrite the file with the entries which are left
+    :param es: elasticsearch python library instance
+    :param path: the location of the dead-letter file
+    :param indices: the set of indices to replay, None for all indices
+    :return: the numbers of replayed, failed again and kept entries
+    """
+    to_replay: List[Dict] = list()
+    kept: List[Dict] = list()
+    for entry in read_entries(path):
+        if indices is None or entry['index'] in indices:
+            to_replay.append(entry)
+        else:
+            kept.append(entry)
+    # the failed ones are recorded into a new file which replaces the current one afterwards, the unique name keeps
+    # the file of an interrupted replay from being taken over
+    tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+    retry_queue = DeadLetterQueue(tmp_path)
+    try:
+        with BulkIndexer(es, dead_letter=retry_queue) as bulk_indexer:
+            for entry in to_replay:
+                if entry['op_type'] == 'index':
+                    bulk_indexer.index(entry['index'], entry['id'], entry['body'])
+                elif entry['op_type'] == 'delete':
+                    bulk_indexer.delete(entry['index'], entry['id'])
+                else:
+                    bulk_indexer.update(entry['index'], entry['id'], entry['body'])
+        for entry in kept:
+            retry_queue.append(entry['index'], entry['id'], entry['body'], entry['op_type'])
+    except Exception:
+        # the dead-letter file is left as it was
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    if os.path.exists(tmp_path):
+        os.replace(tmp_path, path)
+    else:
+        os.remove(path)
+    return {'replayed': len(to_replay), 'failed': len(bulk_indexer.errors), 'kept': len(kept)}
+
+
+if __name__ == "__main__":
+    main()
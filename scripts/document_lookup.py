@@ -0,0 +1,77 @@
+"""
+Look up documents of one index by id with few requests
+The ids wanted are resolved in batches with _mget and the results, including the ids not found, are kept in a
+bounded least recently used cache for the rest of the run, so checking the existence of many documents one by one
+costs a handful of requests instead of one request per document
+"""
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Union
+
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_CACHE_SIZE = 100000
+
+
+class DocumentLookup:
+    def __init__(self, es, index, source: Union[List[str], bool] = False, batch_size=DEFAULT_BATCH_SIZE,
+                 cache_size=DEFAULT_CACHE_SIZE):
+        """
+        :param es: elasticsearch python library instance
+        :param index: the name of the index
+        :param source: the fields of the documents to be returned, default to be none as only existence is checked
+        :param batch_size: the number of ids resolved with one _mget request
+        :param cache_size: the number of documents kept in the cache
+        """
+        self.es = es
+        self.index = index
+        self.source = source
+        self.batch_size = batch_size
+        self.cache_size = cache_size
+        self.lock = threading.Lock()
+        # values are the _source of the documents, None for the documents not found
+        self.cache: 'OrderedDict[str, Optional[Dict]]' = OrderedDict()
+        self.requests = 0
+
+    def prefetch(self, ids: Iterable[str]) -> None:
+        """
+        Resolve the ids not in the cache yet with as few _mget requests as possible
+        :param ids: the ids to be looked up soon
+        """
+        with self.lock:
+            wanted = list(OrderedDict.fromkeys(doc_id for doc_id in ids if doc_id not in self.cache))
+        for i in range(0, len(wanted), self.batch_size):
+            batch = wanted[i:i + self.batch_size]
+            response = self.es.mget(body={'ids': batch}, index=self.index, _source=self.source)
+            with self.lock:
+                self.requests += 1
+                for doc in response['docs']:
+                    self.store(doc['_id'], doc.get('_source', dict()) if doc.get('found') else None)
+
+    def get(self, doc_id: str) -> Optional[Dict]:
+        """
+        :param doc_id: the id of the document
+        :return: the document, None if not found
+        """
+        with self.lock:
+            if doc_id in self.cache:
+                self.cache.move_to_end(doc_id)
+                return self.cache[doc_id]
+        self.prefetch([doc_id])
+        with self.lock:
+            return self.cache.get(doc_id)
+
+    def exists(self, doc_id: str) -> bool:
+        return self.get(doc_id) is not None
+
+    def set(self, doc_id: str, doc: Optional[Dict]) -> None:
+        """
+        Record a document written (or deleted when doc is None) by the run, so later lookups see it
+        """
+        with self.lock:
+            self.store(doc_id, doc)
+
+    def store(self, doc_id: str, doc: Optional[Dict]) -> None:
+        self.cache[doc_id] = doc
+        self.cache.move_to_end(doc_id)
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
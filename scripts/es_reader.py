@@ -0,0 +1,413 @@
+"""
+Streaming readers of whole indices
+Hits are fetched page by page with point in time and search_after and yielded one by one, so the memory used does not
+depend on the size of the index and no search needs more than index.max_result_window hits. Clusters older than 7.10,
+which have no point in time API, and clusters older than 7.12, which cannot sort by _shard_doc, are read with the
+scroll API instead.
+Large indices could be read with several slices in parallel threads, the hits of all slices are streamed together
+"""
+import logging
+import queue
+import threading
+from typing import Dict, Iterator, List, Optional, Set, Tuple, Union
+from elasticsearch import helpers
+from elasticsearch.exceptions import TransportError
+
+# the number of hits fetched with one search request
+DEFAULT_PAGE_SIZE = 1000
+# how long the point in time (or the scroll context) is kept between two pages
+DEFAULT_KEEP_ALIVE = '2m'
+# the number of slices used to read the large indices, e.g. specimen and file
+DEFAULT_SLICES = 4
+
+logger = logging.getLogger('es_reader')
+
+
+class PointInTimeRejected(Exception):
+    """
+    Raised when the first page of a point in time is rejected, e.g. by clusters which cannot sort by _shard_doc
+    """
+
+
+def iterate_hits(es, index, query: Optional[Dict] = None, source: Union[List[str], bool, None] = None,
+                 page_size=DEFAULT_PAGE_SIZE, keep_alive=DEFAULT_KEEP_ALIVE, slices=1,
+                 docvalue_fields: Optional[List[str]] = None) -> Iterator[Dict]:
+    """
+    Yield all hits of the index matching the query, in no particular order
+    :param es: elasticsearch python library instance
+    :param index: the name of the index or the alias
+    :param query: optional query to filter the hits, all documents are returned by default
+    :param source: the fields to be returned in _source, False for ids only, None for the whole documents
+    :param page_size: the number of hits fetched with one request
+    :param keep_alive: how long the point in time is kept between two requests
+    :param slices: the number of slices read in parallel threads, 1 to read in the current thread
+    :param docvalue_fields: optional keyword fields returned in the fields of the hits from the doc values
+    :return: generator of the hits
+    """
+    try:
+        pit = {'id': es.open_point_in_time(index=index, keep_alive=keep_alive)['id']}
+    except (TransportError, AttributeError) as e:
+        logger.info(f"Point in time not available for {index}, fall back to scroll: {e}")
+        yield from scroll_slices(es, index, query, source, page_size, keep_alive, slices, docvalue_fields)
+        return
+    yielded = 0
+    try:
+        if slices <= 1:
+            readers = point_in_time_hits(es, pit, query, source, page_size, keep_alive, None, docvalue_fields)
+        else:
+            # each slice keeps the id it got back in its own dict, the id opened here is closed at the end
+            readers = merge_slices([point_in_time_hits(es, dict(pit), query, source, page_size, keep_alive,
+                                                       (i, slices), docvalue_fields) for i in range(slices)], page_size)
+        for hit in readers:
+            yielded += 1
+            yield hit
+        return
+    except PointInTimeRejected as e:
+        if yielded:
+            raise
+        logger.info(f"Point in time search rejected for {index}, fall back to scroll: {e.__cause__}")
+    finally:
+        try:
+            es.close_point_in_time(body={'id': pit['id']})
+        except TransportError as e:
+            logger.warning(f"Failed to close the point in time for {index}: {e}")
+    yield from scroll_slices(es, index, query, source, page_size, keep_alive, slices, docvalue_fields)
+
+
+def point_in_time_hits(es, pit: Dict, query: Optional[Dict] = None, source: Union[List[str], bool, None] = None,
+                       page_size=DEFAULT_PAGE_SIZE, keep_alive=DEFAULT_KEEP_ALIVE,
+                       slice_: Optional[Tuple[int, int]] = None,
+                       docvalue_fields: Optional[List[str]] = None) -> Iterator[Dict]:
+    """
+    Yield the hits of an opened point in time page by page with search_after
+    :param pit: holds the id of the point in time, updated with the id returned by the latest request
+    :param slice_: optional tuple of the slice id and the number of slices, to read only one slice
+    :raise PointInTimeRejected: if the first page is rejected, nothing has been yielded then
+    """
+    search_after = None
+    while True:
+        body = {
+            'size': page_size,
+            'pit': {'id': pit['id'], 'keep_alive': keep_alive},
+            # the cheapest sort which is unique within the point in time
+            'sort': [{'_shard_doc': 'asc'}],
+            'track_total_hits': False
+        }
+        if query:
+            body['query'] = query
+        if source is not None:
+            body['_source'] = source
+        if slice_:
+            body['slice'] = {'id': slice_[0], 'max': slice_[1]}
+        if docvalue_fields:
+            body['docvalue_fields'] = docvalue_fields
+        if search_after:
+            body['search_after'] = search_after
+        if search_after:
+            page = es.search(body=body)
+        else:
+            try:
+                page = es.search(body=body)
+            except TransportError as e:
+                raise PointInTimeRejected(f"first page of slice {slice_} rejected") from e
+        # the id of the point in time could change between requests
+        pit['id'] = page.get('pit_id', pit['id'])
+        hits = page['hits']['hits']
+        yield from hits
+        if len(hits) < page_size:
+            return
+        search_after = hits[-1]['sort']
+
+
+def sorted_hits(es, index, sort_field='_id', source: Union[List[str], bool, None] = False,
+                page_size=DEFAULT_PAGE_SIZE) -> Iterator[Dict]:
+    """
+    Yield all hits of the index ordered by a field with unique values with search_after, so two indices could be
+    walked side by side. Without a point in time the order stays correct but documents written during the read
+    may be missed
+    :param es: elasticsearch python library instance
+    :param index: the name of the index or the alias
+    :param sort_field: the field with unique values to order the hits by, default to be the document id
+    :param source: the fields to be returned in _source, default to be ids only, None for the whole documents
+    :param page_size: the number of hits per page
+    :return: generator of the hits in ascending order of the field
+    """
+    search_after = None
+    while True:
+        body = {'size': page_size, 'sort': [{sort_field: 'asc'}]}
+        if source is not None:
+            body['_source'] = source
+        if search_after:
+            body['search_after'] = search_after
+        hits = es.search(index=index, body=body)['hits']['hits']
+        yield from hits
+        if len(hits) < page_size:
+            return
+        search_after = hits[-1]['sort']
+
+
+def scroll_hits(es, index, query: Optional[Dict] = None, source: Union[List[str], bool, None] = None,
+                page_size=DEFAULT_PAGE_SIZE, keep_alive=DEFAULT_KEEP_ALIVE,
+                slice_: Optional[Tuple[int, int]] = None,
+                docvalue_fields: Optional[List[str]] = None) -> Iterator[Dict]:
+    """
+    Yield all hits of the index matching the query with the scroll API, parameters are the same as iterate_hits
+    :param slice_: optional tuple of the slice id and the number of slices, to read only one slice
+    """
+    body = dict()
+    if query:
+        body['query'] = query
+    if source is not None:
+        body['_source'] = source
+    if slice_:
+        body['slice'] = {'id': slice_[0], 'max': slice_[1]}
+    if docvalue_fields:
+        body['docvalue_fields'] = docvalue_fields
+    yield from helpers.scan(es, index=index, query=body, size=page_size, scroll=keep_alive)
+
+
+def scroll_slices(es, index, query: Optional[Dict] = None, source: Union[List[str], bool, None] = None,
+                  page_size=DEFAULT_PAGE_SIZE, keep_alive=DEFAULT_KEEP_ALIVE, slices=1,
+                  docvalue_fields: Optional[List[str]] = None) -> Iterator[Dict]:
+    """
+    Yield all hits of the index with the scroll API, read with several slices in parallel threads if asked for,
+    parameters are the same as iterate_hits
+    """
+    if slices <= 1:
+        yield from scroll_hits(es, index, query, source, page_size, keep_alive, None, docvalue_fields)
+    else:
+        yield from merge_slices([scroll_hits(es, index, query, source, page_size, keep_alive, (i, slices),
+                                             docvalue_fields) for i in range(slices)], page_size)
+
+
+def merge_slices(readers: List[Iterator[Dict]], page_size=DEFAULT_PAGE_SIZE) -> Iterator[Dict]:
+    """
+    Consume each reader in its own thread and yield the hits of all readers as they arrive
+    :param readers: the generators of the hits of each slice
+    :param page_size: the hits are passed between the threads in batches of this size
+    :return: generator of the hits
+    """
+    # a few batches per slice are buffered, the readers wait when the consumer is slower
+    batches = queue.Queue(maxsize=2 * len(readers))
+    stop = threading.Event()
+    finished = object()
+
+    def put(item) -> bool:
+        while not stop.is_set():
+            try:
+                batches.put(item, timeout=1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def read(reader) -> None:
+        try:
+            batch = list()
+            for hit in reader:
+                batch.append(hit)
+                if len(batch) >= page_size:
+                    if not put(batch):
+                        return
+                    batch = list()
+            if batch and not put(batch):
+                return
+            put(finished)
+        except Exception as e:
+            put(e)
+
+    threads = [threading.Thread(target=read, args=(reader,), daemon=True) for reader in readers]
+    for thread in threads:
+        thread.start()
+    try:
+        remaining = len(threads)
+        while remaining:
+            item = batches.get()
+            if item is finished:
+                remaining -= 1
+            elif isinstance(item, Exception):
+                raise item
+            else:
+                yield from item
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+
+class ReadSession:
+    """
+    Point in time contexts opened on several indices at the start of a stage and shared by all reads of the stage,
+    so the stage sees every index as it was at the same moment even if other jobs write in the meantime.
+    Indices on clusters without the point in time API are read with iterate_hits instead
+    """
+    def __init__(self, es, indices: List[str], keep_alive='30m'):
+        """
+        :param es: elasticsearch python library instance
+        :param indices: the names of the indices or aliases read in the stage
+        :param keep_alive: how long the point in time contexts are kept between two reads
+        """
+        self.es = es
+        self.indices = indices
+        self.keep_alive = keep_alive
+        # holds the latest id of the point in time of each index, None if point in time is not available
+        self.pits: Dict[str, Optional[Dict]] = dict()
+
+    def __enter__(self):
+        for index in self.indices:
+            try:
+                self.pits[index] = {'id': self.es.open_point_in_time(index=index, keep_alive=self.keep_alive)['id']}
+            except (TransportError, AttributeError) as e:
+                logger.info(f"Point in time not available for {index}, each read sees the latest data: {e}")
+                self.pits[index] = None
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def hits(self, index, query: Optional[Dict] = None, source: Union[List[str], bool, None] = None,
+             page_size=DEFAULT_PAGE_SIZE, slices=1) -> Iterator[Dict]:
+        """
+        Yield all hits of one index of the session matching the query, parameters are the same as iterate_hits
+        """
+        pit = self.pits[index]
+        if pit is None:
+            yield from iterate_hits(self.es, index, query, source, page_size, self.keep_alive, slices)
+            return
+        if slices <= 1:
+            readers = point_in_time_hits(self.es, pit, query, source, page_size, self.keep_alive)
+        else:
+            # each slice keeps the id it got back in its own dict, the id of the session is left as it is
+            readers = merge_slices([point_in_time_hits(self.es, dict(pit), query, source, page_size, self.keep_alive,
+                                                       (i, slices)) for i in range(slices)], page_size)
+        yielded = 0
+        try:
+            for hit in readers:
+                yielded += 1
+                yield hit
+            return
+        except PointInTimeRejected as e:
+            if yielded:
+                raise
+            logger.info(f"Point in time search rejected for {index}, fall back to scroll: {e.__cause__}")
+        yield from scroll_slices(self.es, index, query, source, page_size, self.keep_alive, slices)
+
+    def extend(self) -> None:
+        """
+        Extend the keep alive of all point in time contexts, to be called during long gaps between two reads
+        """
+        for pit in self.pits.values():
+            if pit is not None:
+                page = self.es.search(body={'size': 0, 'pit': {'id': pit['id'], 'keep_alive': self.keep_alive},
+                                            'track_total_hits': False})
+                pit['id'] = page.get('pit_id', pit['id'])
+
+    def close(self) -> None:
+        for index, pit in self.pits.items():
+            if pit is None:
+                continue
+            try:
+                self.es.close_point_in_time(body={'id': pit['id']})
+            except TransportError as e:
+                logger.warning(f"Failed to close the point in time for {index}: {e}")
+        self.pits = dict()
+
+
+def get_index_fingerprint(es, index, date_field='updateDate') -> Dict:
+    """
+    Get the values which change whenever documents are added to, removed from or updated in the index,
+    used to tell whether a local copy of the index is still valid
+    :param es: elasticsearch python library instance
+    :param index: the name of the index or the alias
+    :param date_field: the field holding the last update date of the documents, None for indices without it
+    :return: the number of documents, the latest update date and the sequence numbers of the concrete indices
+    """
+    body = {'size': 0, 'track_total_hits': True}
+    if date_field:
+        # the dates are mapped as keyword, on which Elasticsearch 7 does not allow the max aggregation,
+        # the dates are in the format of YYYY-MM-DD so the greatest term is the latest date
+        body['aggs'] = {'latest': {'terms': {'field': date_field, 'order': {'_key': 'desc'}, 'size': 1}}}
+    result = es.search(index=index, body=body)
+    total = result['hits']['total']
+    fingerprint = {
+        # hits.total is an object from Elasticsearch 7
+        'count': total['value'] if isinstance(total, dict) else total,
+        'latest': None
+    }
+    if date_field:
+        buckets = result['aggregations']['latest']['buckets']
+        fingerprint['latest'] = buckets[0]['key'] if buckets else None
+    # every write to a shard, including partial updates and deletes, increases the sequence number of the shard,
+    # which catches the updates changing neither the number of documents nor the update date
+    stats = es.indices.stats(index=index, metric='docs', level='shards')
+    fingerprint['seq_no'] = {
+        name: sum(copy['seq_no']['max_seq_no'] for copies in detail['shards'].values() for copy in copies
+                  if copy['routing']['primary'])
+        for name, detail in sorted(stats['indices'].items())
+    }
+    return fingerprint
+
+
+def iterate_field_values(es, index, fields: List[str], query: Optional[Dict] = None, page_size=DEFAULT_PAGE_SIZE,
+                         slices=1) -> Iterator[Tuple[str, Dict]]:
+    """
+    Yield the ids and a few keyword fields of the documents read from the doc values, _source is never loaded
+    :param es: elasticsearch python library instance
+    :param index: the name of the index or the alias
+    :param fields: the keyword fields wanted
+    :param query: optional query to filter the documents
+    :param page_size: the number of hits fetched with one request
+    :param slices: the number of slices read in parallel threads
+    :return: generator of tuples of the id and the values of the fields, a list for the fields with several values,
+    missing fields are left out
+    """
+    for hit in iterate_hits(es, index, query, False, page_size, slices=slices, docvalue_fields=fields):
+        values = dict()
+        for field, value in hit.get('fields', dict()).items():
+            values[field] = value[0] if len(value) == 1 else value
+        yield hit['_id'], values
+
+
+def iterate_composite(es, index, fields: List[str], query: Optional[Dict] = None, page_size=DEFAULT_PAGE_SIZE,
+                      missing=False) -> Iterator[Tuple[Dict, int]]:
+    """
+    Yield the distinct combinations of the values of keyword fields with a paginated composite aggregation
+    :param es: elasticsearch python library instance
+    :param index: the name of the index or the alias
+    :param fields: the keyword fields
+    :param query: optional query to filter the documents
+    :param page_size: the number of combinations fetched with one request
+    :param missing: whether to also return the combinations with missing fields as None
+    :return: generator of tuples of the combination, keyed by the fields, and the number of documents having it
+    """
+    sources = list()
+    for field in fields:
+        terms = {'field': field}
+        if missing:
+            terms['missing_bucket'] = True
+        sources.append({field: {'terms': terms}})
+    after = None
+    while True:
+        composite = {'size': page_size, 'sources': sources}
+        if after:
+            composite['after'] = after
+        body = {'size': 0, 'aggs': {'combinations': {'composite': composite}}}
+        if query:
+            body['query'] = query
+        result = es.search(index=index, body=body)['aggregations']['combinations']
+        for bucket in result['buckets']:
+            yield bucket['key'], bucket['doc_count']
+        after = result.get('after_key')
+        if not result['buckets'] or not after:
+            return
+
+
+def get_distinct_values(es, index, field: str, query: Optional[Dict] = None) -> Set:
+    """
+    :param es: elasticsearch python library instance
+    :param index: the name of the index or the alias
+    :param field: the keyword field
+    :param query: optional query to filter the documents
+    :return: the distinct values of the field
+    """
+    return {key[field] for key, _ in iterate_composite(es, index, [field], query)}
@@ -0,0 +1,183 @@
+"""
+Local store of the etags of the BioSamples records, kept in a SQLite database indexed by accession
+Each harvest of the etags (see get_all_etags.py) is recorded with its date. For every accession the store keeps the
+latest etag, when the accession was first and last seen and when its etag last changed, so the records changed since
+a given date are known without harvesting again. The accessions seen in the latest harvest form the current etags.
+The accessions whose etag could not be retrieved are recorded with the harvest and keep their previous etag, so a
+temporary failure of BioSamples does not make the records look withdrawn
+"""
+import sqlite3
+import threading
+from datetime import date
+from typing import Dict, Iterator, List, Optional, Tuple
+
+ETAG_STORE_FILE = 'etag_store.sqlite'
+DEFAULT_HARVESTS_TO_KEEP = 5
+
+
+class EtagStore:
+    def __init__(self, path=ETAG_STORE_FILE):
+        """
+        :param path: the location of the SQLite database, created if not existing
+        """
+        self.path = path
+        self.lock = threading.Lock()
+        # the store is shared by the threads fetching the records, all access goes through the lock
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute('CREATE TABLE IF NOT EXISTS etags (accession TEXT PRIMARY KEY, etag TEXT NOT NULL, '
+                                    'first_seen TEXT NOT NULL, last_seen TEXT NOT NULL, last_changed TEXT NOT NULL)')
+            self.connection.execute('CREATE INDEX IF NOT EXISTS etags_last_seen ON etags (last_seen)')
+            self.connection.execute('CREATE INDEX IF NOT EXISTS etags_last_changed ON etags (last_changed)')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS harvests (harvest_date TEXT PRIMARY KEY, '
+                                    'records INTEGER NOT NULL)')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS failures (accession TEXT NOT NULL, '
+                                    'harvest_date TEXT NOT NULL, status INTEGER, '
+                                    'PRIMARY KEY (harvest_date, accession))')
+        self.refresh()
+
+    def refresh(self) -> None:
+        """
+        Pick up the latest harvest, e.g. after get_all_etags.py recorded one in another process
+        """
+        self.latest = self.get_latest_harvest()
+
+    def record_harvest(self, etags: Dict[str, str], harvest_date: Optional[str] = None,
+                       failed: Optional[Dict[str, Optional[int]]] = None) -> Dict[str, int]:
+        """
+        Save the etags of one harvest, a second harvest on the same date replaces the first one
+        :param etags: the etags keyed by accession
+        :param harvest_date: the date of the harvest in the format of YYYY-MM-DD, default to be today
+        :param failed: the http status of the accessions whose etag could not be retrieved, None for connection errors
+        :return: the number of new, changed, unchanged and failed accessions
+        """
+        if harvest_date is None:
+            harvest_date = date.today().strftime('%Y-%m-%d')
+        if failed is None:
+            failed = dict()
+        counts = {'new': 0, 'changed': 0, 'unchanged': 0, 'failed': len(failed)}
+        with self.lock, self.connection:
+            self.connection.execute('DELETE FROM failures WHERE harvest_date = ?', (harvest_date,))
+            for accession, status in failed.items():
+                self.connection.execute('INSERT INTO failures VALUES (?, ?, ?)', (accession, harvest_date, status))
+                # still seen, with the etag retrieved before
+                self.connection.execute('UPDATE etags SET last_seen = ? WHERE accession = ?', (harvest_date, accession))
+            for accession, etag in etags.items():
+                row = self.connection.execute('SELECT etag FROM etags WHERE accession = ?', (accession,)).fetchone()
+                if row is None:
+                    counts['new'] += 1
+                    self.connection.execute('INSERT INTO etags VALUES (?, ?, ?, ?, ?)',
+                                            (accession, etag, harvest_date, harvest_date, harvest_date))
+                elif row[0] != etag:
+                    counts['changed'] += 1
+                    self.connection.execute('UPDATE etags SET etag = ?, last_seen = ?, last_changed = ? '
+                                            'WHERE accession = ?', (etag, harvest_date, harvest_date, accession))
+                else:
+                    counts['unchanged'] += 1
+                    self.connection.execute('UPDATE etags SET last_seen = ? WHERE accession = ?',
+                                            (harvest_date, accession))
+            self.connection.execute('INSERT OR REPLACE INTO harvests VALUES (?, ?)', (harvest_date, len(etags)))
+        self.refresh()
+        return counts
+
+    def get_latest_harvest(self) -> Optional[str]:
+        """
+        :return: the date of the latest harvest, None if no harvest recorded yet
+        """
+        with self.lock:
+            return self.connection.execute('SELECT MAX(harvest_date) FROM harvests').fetchone()[0]
+
+    def has_harvest(self, harvest_date: str) -> bool:
+        """
+        :param harvest_date: the date in the format of YYYY-MM-DD
+        :return: whether the etags have been harvested on the date
+        """
+        with self.lock:
+            return self.connection.execute('SELECT 1 FROM harvests WHERE harvest_date = ?',
+                                           (harvest_date,)).fetchone() is not None
+
+    def get_failed(self) -> Dict[str, Optional[int]]:
+        """
+        :return: the http status of the accessions whose etag could not be retrieved in the latest harvest
+        """
+        with self.lock:
+            return {row[0]: row[1] for row in self.connection.execute(
+                'SELECT accession, status FROM failures WHERE harvest_date = ?', (self.latest,))}
+
+    def get_previous_harvest(self) -> Optional[str]:
+        """
+        :return: the date of the harvest before the latest one, None if only one harvest recorded
+        """
+        harvests = self.get_harvests()
+        return harvests[1] if len(harvests) > 1 else None
+
+    def get_harvests(self) -> List[str]:
+        """
+        :return: the dates of all harvests kept, newest first
+        """
+        with self.lock:
+            return [row[0] for row in
+                    self.connection.execute('SELECT harvest_date FROM harvests ORDER BY harvest_date DESC')]
+
+    def get(self, accession: str) -> Optional[str]:
+        """
+        :param accession: the BioSamples accession
+        :return: the etag of the accession in the latest harvest, None if it was not in the latest harvest
+        """
+        with self.lock:
+            row = self.connection.execute('SELECT etag FROM etags WHERE accession = ? AND last_seen = ?',
+                                          (accession, self.latest)).fetchone()
+        return row[0] if row else None
+
+    def __getitem__(self, accession: str) -> str:
+        etag = self.get(accession)
+        if etag is None:
+            raise KeyError(accession)
+        return etag
+
+    def __contains__(self, accession: str) -> bool:
+        return self.get(accession) is not None
+
+    def __len__(self) -> int:
+        with self.lock:
+            return self.connection.execute('SELECT COUNT(*) FROM etags WHERE last_seen = ?',
+                                           (self.latest,)).fetchone()[0]
+
+    def items(self) -> Iterator[Tuple[str, str]]:
+        """
+        :return: generator of the accessions and etags of the latest harvest, in the order of the accessions
+        """
+        with self.lock:
+            rows = self.connection.execute('SELECT accession, etag FROM etags WHERE last_seen = ? '
+                                           'ORDER BY accession', (self.latest,)).fetchall()
+        yield from rows
+
+    def changed_since(self, since: str) -> List[str]:
+        """
+        :param since: the date in the format of YYYY-MM-DD
+        :return: the accessions of the latest harvest which are new or whose etag changed after the date
+        """
+        with self.lock:
+            return [row[0] for row in self.connection.execute(
+                'SELECT accession FROM etags WHERE last_changed > ? AND last_seen = ? ORDER BY accession',
+                (since, self.latest))]
+
+    def prune(self, harvests_to_keep=DEFAULT_HARVESTS_TO_KEEP) -> Dict[str, int]:
+        """
+        Forget the older harvests and the accessions not seen in any of the harvests kept
+        :param harvests_to_keep: the number of the latest harvests to keep
+        :return: the number of harvests and accessions removed
+        """
+        kept = self.get_harvests()[:harvests_to_keep]
+        if not kept:
+            return {'harvests': 0, 'accessions': 0}
+        oldest = kept[-1]
+        with self.lock, self.connection:
+            harvests = self.connection.execute('DELETE FROM harvests WHERE harvest_date < ?', (oldest,)).rowcount
+            self.connection.execute('DELETE FROM failures WHERE harvest_date < ?', (oldest,))
+            accessions = self.connection.execute('DELETE FROM etags WHERE last_seen < ?', (oldest,)).rowcount
+        return {'harvests': harvests, 'accessions': accessions}
+
+    def close(self) -> None:
+        with self.lock:
+            self.connection.close()
@@ -10,9 +10,13 @@ Using the example above, each individual sample between SAMN11119414-SAMN1111946
 import requests
 from elasticsearch import Elasticsearch
 import click
-from utils import write_system_log, get_line_number, remove_underscore_from_end_prefix, get_record_ids, \
-    get_record_details, insert_into_es
+from utils import write_system_log, get_line_number, remove_underscore_from_end_prefix, insert_into_es, \
+    write_metrics_summary
 from constants import STAGING_NODE1, DEFAULT_PREFIX, STANDARD_FAANG
+from dead_letter import DeadLetterQueue
+from bulk_indexer import update_documents
+from stale_documents import delete_stale_documents
+from es_reader import ReadSession, DEFAULT_SLICES
 from typing import Dict, Set, List
 
 
@@ -32,9 +36,12 @@ ARTICLE_MAPPING = {
     'isOpenAccess': 'isOpenAccess'
 }
 ARTICLE_BASIC_FIELDS = {'title', 'year', 'journal'}
+# the types of records read by the script, all read from the same point in time
+READ_TYPES = ['dataset', 'specimen', 'file', 'organism']
 
 to_es_flag = True
 es = None
+dead_letter = DeadLetterQueue()
 
 
 @click.command()
@@ -56,12 +63,18 @@ es = None
     help='Specify how to deal with the system log either writing to es or printing out. '
          'It only allows two values: true (to es) or false (print to the terminal)'
 )
-def main(es_hosts, es_index_prefix, to_es):
+@click.option(
+    '--clean_dry_run',
+    default="false",
+    help='Specify whether to only report the articles no longer linked to any dataset (true) or delete them (false)'
+)
+def main(es_hosts, es_index_prefix, to_es, clean_dry_run):
     """
     Main function that will import publications for all entities
     :param es_hosts: elasticsearch hosts where the data import into
     :param es_index_prefix: the index prefix points to a particular version of data
     :param to_es: determine whether to output log to Elasticsearch (True) or terminal (False, printing)
+    :param clean_dry_run: determine whether to only report (True) or delete (False) the obsolete articles
     :return:
     """
     global to_es_flag
@@ -72,6 +85,9 @@ def main(es_hosts, es_index_prefix, to_es):
     else:
         print('to_es parameter can only accept value of true or false')
         exit(1)
+    if clean_dry_run.lower() not in ('true', 'false'):
+        print('clean_dry_run parameter can only accept value of true or false')
+        exit(1)
 
     global es
     hosts = es_hosts.split(";")
@@ -82,17 +98,30 @@ def main(es_hosts, es_index_prefix, to_es):
 
     es_index_prefix = remove_underscore_from_end_prefix(es_index_prefix)
     write_system_log(es, SCRIPT_NAME, 'info', get_line_number(), f'Index: {es_index_prefix}_article', to_es_flag)
+    with ReadSession(es, [f'{es_index_prefix}_{record_type}' for record_type in READ_TYPES]) as session:
+        link_articles(session, es_index_prefix, clean_dry_run.lower() == 'true')
+
+    if dead_letter.count:
+        write_system_log(es, SCRIPT_NAME, 'warning', get_line_number(),
+                         f'{dead_letter.count} failed writes recorded in {dead_letter.path}', to_es_flag)
+    write_metrics_summary(es, SCRIPT_NAME, to_es_flag)
+    write_system_log(es, SCRIPT_NAME, 'info', get_line_number(), 'Finishing importing article', to_es_flag)
+
+
+def link_articles(session: ReadSession, es_index_prefix: str, clean_dry_run: bool) -> None:
+    """
+    Search the articles of all datasets, then write the articles and link them to the related records
+    :param session: the read session holding the point in time of all indices read
+    :param es_index_prefix: the index prefix points to a particular version of data
+    :param clean_dry_run: determine whether to only report (True) or delete (False) the obsolete articles
+    :return:
+    """
     # get existing dataset (to work out articles in file and specimen and existing specimen to calculate organism
-    datasets = get_record_details(hosts[0], es_index_prefix, 'dataset',
-                                  ['standardMet', 'secondaryProject', 'species',
-                                   'specimen.biosampleId', 'file.fileId'])
-    specimens = get_record_details(hosts[0], es_index_prefix, 'specimen', ['organism.biosampleId'])
-    # get existing articles
-    existing_articles = get_record_ids(hosts[0], es_index_prefix, 'article', only_faang=False)
+    datasets = get_records(session, f'{es_index_prefix}_dataset',
+                           ['standardMet', 'secondaryProject', 'species', 'specimen.biosampleId', 'file.fileId'])
+    specimens = get_records(session, f'{es_index_prefix}_specimen', ['organism.biosampleId'])
     write_system_log(es, SCRIPT_NAME, 'info', get_line_number(),
                      f'The number of existing datasets: {str(len(datasets))}', to_es_flag)
-    write_system_log(es, SCRIPT_NAME, 'info', get_line_number(),
-                     f'The number of existing articles: {str(len(existing_articles))}', to_es_flag)
     # detailed article information which is used to insert into article ES index, keys are article id
     article_details = dict()
     # basic article information which is used in related records, e.g. specimen, dataset etc, keys are article id
@@ -111,6 +140,8 @@ def main(es_hosts, es_index_prefix, to_es):
         if dataset_count % 200 == 0:
             write_system_log(es, SCRIPT_NAME, 'info', get_line_number(), f'Processed {dataset_count} datasets',
                              to_es_flag)
+            # searching the articles takes long, keep the point in time contexts open for the later reads
+            session.extend()
         # get dataset related publication using europe PMC search API
         url = f"https://www.ebi.ac.uk/europepmc/webservices/rest/search?query={dataset_id}&format=json"
         epmc_result = requests.get(url).json()
@@ -183,21 +214,21 @@ def main(es_hosts, es_index_prefix, to_es):
         es_article['relatedDatasets'] = es_datasets
         es_article['datasetSource'] = all_faang_datasets_flag
         es_article['secondaryProject'] = list(secondary_projects)
-        insert_into_es(es, es_index_prefix, 'article', article_id, es_article)
-        if article_id in existing_articles:
-            existing_articles.remove(article_id)
+        insert_into_es(es, es_index_prefix, 'article', article_id, es_article, dead_letter=dead_letter)
 
-    for not_needed_article_id in existing_articles:
-        es.delete(index=f'{es_index_prefix}_article', doc_type="_doc", id=not_needed_article_id)
+    # articles no longer found for any dataset
+    result = delete_stale_documents(es, f'{es_index_prefix}_article', article_details,
+                                    dry_run=clean_dry_run, dead_letter=dead_letter)
+    write_system_log(es, SCRIPT_NAME, 'info', get_line_number(), f'Obsolete articles: {result}', to_es_flag)
 
     write_system_log(es, SCRIPT_NAME, 'info', get_line_number(), 'Update articles within dataset index', to_es_flag)
     update_article_info(article_basics, article_for_datasets, es_index_prefix, 'dataset')
 
     write_system_log(es, SCRIPT_NAME, 'info', get_line_number(), 'Update articles within specimen index', to_es_flag)
-    # update specimen, 'specimen' 'biosampleId' are referenced to the parameters used in datasets = get_record_details
+    # update specimen, 'specimen' 'biosampleId' are referenced to the parameters used in datasets = get_records
     article_for_specimens: Dict[str, Set] = extract_article_from_related_entity(datasets, article_for_datasets,
                                                                                 'specimen', 'biosampleId')
-    specimen_with_publications = get_records_with_publications(hosts[0], es_index_prefix, 'specimen')
+    specimen_with_publications = get_records_with_publications(session, es_index_prefix, 'specimen')
     write_system_log(es, SCRIPT_NAME, 'info', get_line_number(), 'Start to update the specimen ES', to_es_flag)
     update_article_info(article_basics, article_for_specimens, es_index_prefix, 'specimen',
                         specimen_with_publications)
@@ -205,20 +236,18 @@ def main(es_hosts, es_index_prefix, to_es):
     write_system_log(es, SCRIPT_NAME, 'info', get_line_number(), 'Update articles within file index', to_es_flag)
     article_for_files: Dict[str, Set] = extract_article_from_related_entity(datasets, article_for_datasets,
                                                                             'file', 'fileId')
-    file_with_publications = get_records_with_publications(hosts[0], es_index_prefix, 'file')
+    file_with_publications = get_records_with_publications(session, es_index_prefix, 'file')
     write_system_log(es, SCRIPT_NAME, 'info', get_line_number(), 'Start to update the file ES', to_es_flag)
     update_article_info(article_basics, article_for_files, es_index_prefix, 'file', file_with_publications)
 
     write_system_log(es, SCRIPT_NAME, 'info', get_line_number(), 'Update articles within organism index', to_es_flag)
     article_for_organisms: Dict[str, Set] = extract_article_from_related_entity(specimens, article_for_specimens,
                                                                                 'organism', 'biosampleId')
-    organism_with_publications = get_records_with_publications(hosts[0], es_index_prefix, 'organism')
+    organism_with_publications = get_records_with_publications(session, es_index_prefix, 'organism')
     write_system_log(es, SCRIPT_NAME, 'info', get_line_number(), 'Start to update the organism ES', to_es_flag)
     update_article_info(article_basics, article_for_organisms, es_index_prefix, 'organism',
                         organism_with_publications)
 
-    write_system_log(es, SCRIPT_NAME, 'info', get_line_number(), 'Finishing importing article', to_es_flag)
-
 
 def extract_article_from_related_entity(source_data, source_article_data,
                                         relationship_key, relationship_secondary_key=''):
@@ -266,6 +295,8 @@ def update_article_info(article_basics, article_for_others, es_index_prefix, rec
     :param records_with_publication: the existing publication information within the records, optional
     :return:
     """
+    # the partial documents to be sent in bulk, keys are record ids
+    updates: Dict[str, Dict] = dict()
     for record_id in article_for_others:
         # compare the articles already linked to the record with the newly calculated one
         # if they are identical, that record does not need to be updated for article information
@@ -294,34 +325,39 @@ def update_article_info(article_basics, article_for_others, es_index_prefix, rec
             publications: List = list()
             for article_id in article_for_others[record_id]:
                 publications.append(article_basics[article_id])
-            body = {
-                "doc":
-                    {"paperPublished": "true",
-                     "publishedArticles": publications
-                     }
+            updates[record_id] = {
+                "paperPublished": "true",
+                "publishedArticles": publications
             }
-            try:
-                es.update(index=f'{es_index_prefix}_{record_type}', doc_type="_doc", id=record_id, body=body)
-            except ValueError:
-                print(f"Update goes wrong {record_id} in {record_type}")
-                continue
+    report = update_documents(es, f'{es_index_prefix}_{record_type}', updates, dead_letter=dead_letter)
+    write_system_log(es, SCRIPT_NAME, 'info', get_line_number(),
+                     f'Updated articles in {record_type}: {report}', to_es_flag)
 
 
-def get_records_with_publications(es_host: str, es_index_prefix: str, record_type: str):
+def get_records_with_publications(session: ReadSession, es_index_prefix: str, record_type: str):
     """
     Retrieve only records of specified type having publications
-    :param es_host: the Elastic Search server address
+    :param session: the read session holding the point in time of the index
     :param es_index_prefix: the Elastic Search index
     :param record_type: the type of the records
     :return: the records with publications
     """
-    records = get_record_details(es_host, es_index_prefix, record_type, ['paperPublished', 'publishedArticles'])
+    query = {'terms': {'paperPublished': ['true', 'yes']}}
+    return get_records(session, f'{es_index_prefix}_{record_type}', ['paperPublished', 'publishedArticles'], query)
+
+
+def get_records(session: ReadSession, index: str, return_fields: List, query=None) -> Dict:
+    """
+    Get the subset of record details
+    :param session: the read session holding the point in time of the index
+    :param index: the name of the index
+    :param return_fields: the list of fields containing the wanted information
+    :param query: optional query to filter the records
+    :return: a dict having record id as keys, and all field values as values
+    """
     results = dict()
-    for record_id in records.keys():
-        if 'paperPublished' in records[record_id]:
-            published = records[record_id]['paperPublished']
-            if published == 'true' or published == 'yes':
-                results[record_id] = records[record_id]
+    for hit in session.hits(index, query, return_fields, slices=DEFAULT_SLICES):
+        results[hit['_id']] = hit['_source']
     return results
 
 
@@ -10,11 +10,12 @@ Using the example above, each individual sample between SAMN11119414-SAMN1111946
 import os
 
 import requests
-import copy
 from elasticsearch import Elasticsearch
 from elasticsearch import RequestsHttpConnection
 from utils_fetch_articles import get_record_ids, get_record_details, insert_into_es
 from constants import STANDARD_FAANG
+from bulk_indexer import update_documents
+from record_counter import RECORD_COUNTER
 from typing import Dict, Set, List
 
 SCRIPT_NAME = 'fetch_article'
@@ -154,6 +155,7 @@ def main():
     for not_needed_article_id in existing_articles:
         es.delete(index='article', doc_type="_doc", id=not_needed_article_id)
         print(f"Deleted {not_needed_article_id} from article index")
+    RECORD_COUNTER.invalidate('article')
 
 
     print('Update articles within dataset index')
@@ -231,16 +233,12 @@ def update_article_info(article_basics, article_for_others, record_type,
     :param records_with_publication: the existing publication information within the records, optional
     :return:
     """
+    # the partial documents to be sent in bulk, keys are record ids
+    # not all bioSampleIds in dataset['specimen'] exist in the specimen index, updates of those are counted as missing
+    updates: Dict[str, Dict] = dict()
     for record_id in article_for_others:
         need_update = False
 
-        # Check if record exist first before updating
-        # For example, not all bioSampleIds in dataset['specimen'] exist in the specimen index
-        record_exists = es.search(index=record_type, q=f'_id:{record_id}', track_total_hits=True)
-        if int(record_exists['hits']['total']['value']) == 0:
-            print(f"{record_id} does not exist in index {record_type}")
-            continue
-
         # compare the articles already linked to the record with the newly calculated one
         # if they are identical, that record does not need to be updated for article information
         if records_with_publication and record_id in records_with_publication:
@@ -274,13 +272,13 @@ def update_article_info(article_basics, article_for_others, record_type,
                 article_source = article_basics[article_id]['source']
 
                 # no need to store source in ES
-                updated_article_basics = copy.deepcopy(article_basics)
-                updated_article_basics[article_id].pop('source', None)
+                article_basic = dict(article_basics[article_id])
+                article_basic.pop('source', None)
 
                 if article_source == 'PPR':
-                    preprints.append(updated_article_basics[article_id])
+                    preprints.append(article_basic)
                 else:
-                    publications.append(updated_article_basics[article_id])
+                    publications.append(article_basic)
 
             body = {}
 
@@ -292,13 +290,9 @@ def update_article_info(article_basics, article_for_others, record_type,
                 body.update({'preprintArticles': preprints})
                 print(f"Index: {record_type} -- Record Id: {record_id} -- PREPRINT Article: {article_for_others[record_id]}")
 
-
-            try:
-                es.update(index=record_type, id=record_id, doc=body)
-
-            except Exception as e:
-                print(f"Error when try to update {record_id} in index {record_type}: " + str(e.args))
-                continue
+            updates[record_id] = body
+    report = update_documents(es, record_type, updates, doc_type=None)
+    print(f"Updated articles in index {record_type}: {report}")
 
 def get_records_with_publications(es_host: str, record_type: str):
     """
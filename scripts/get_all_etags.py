@@ -1,10 +1,32 @@
+"""
+Retrieve the etags of all FAANG records in BioSamples and record them as today's harvest in the local etag store,
+see etag_store.py.
+The etags are read from the headers of HEAD requests, at most MAX_CONNECTIONS requests are sent at the same time
+and the failed requests are retried with exponential backoff and jitter, then once more one by one at the end
+"""
 import aiohttp
 import asyncio
+import random
+import time
 import requests
-from datetime import date
-ETAG = []
-ETAG_IDS = []
+from typing import Dict, List
+from etag_store import EtagStore
+
+# etags keyed by accession
+ETAGS: Dict[str, str] = dict()
+# the http status of the accessions which could not be retrieved, None for connection errors
+FAILED: Dict[str, object] = dict()
 ACCESSION_API = 'https://www.ebi.ac.uk/biosamples/accessions?filter=attr:project:FAANG&size=100000'
+# the representation of the records imported, with the FAANG DCC curation. The etags of all harvesters and of the
+# records stored in ES come from this url, so they could be compared with each other
+SAMPLE_API = 'https://www.ebi.ac.uk/biosamples/samples/{}.json?curationdomain=self.FAANG_DCC_curation'
+MAX_CONNECTIONS = 50
+MAX_RETRIES = 5
+MAX_BACKOFF = 30
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+REQUEST_TIMEOUT = 60
+PROGRESS_INTERVAL = 5000
+
 
 def main():
     biosample_ids = fetch_biosample_ids()
@@ -12,31 +34,90 @@ def main():
         print(f"The number of returned BioSamples accessions is {len(biosample_ids)}, "
               f"less than 5000 and very suspicious.\n"
               f"Please manually check {ACCESSION_API}")
+    started = time.time()
     asyncio.get_event_loop().run_until_complete(fetch_all_etags(biosample_ids))
-    if len(biosample_ids) != len(ETAG_IDS):
-        for my_id in biosample_ids:
-            if my_id not in ETAG_IDS:
-                resp = requests.get("http://www.ebi.ac.uk/biosamples/samples/{}".format(my_id)).headers
-                if 'ETag' in resp and resp['ETag']:
-                    ETAG.append("{}\t{}".format(my_id, resp['ETag']))
+    if FAILED:
+        retry_failed_etags()
+    print(f"Retrieved {len(ETAGS)} etags of {len(biosample_ids)} accessions in {time.time() - started:.0f} seconds")
+    if FAILED:
+        print(f"Failed to retrieve the etags of {len(FAILED)} accessions, e.g. {list(FAILED.items())[:10]}")
+    store = EtagStore()
+    # the failed accessions are kept with their previous etags, so the importer does not remove their records
+    counts = store.record_harvest(ETAGS, failed=FAILED)
+    store.close()
+    print(f"Recorded the etags into {store.path}: {counts['new']} new, {counts['changed']} changed, "
+          f"{counts['unchanged']} unchanged and {counts['failed']} failed accessions")
+
+
+async def fetch_all_etags(ids: List[str], max_connections=MAX_CONNECTIONS):
+    """
+    Retrieve the etags of the accessions, at most max_connections requests are sent at the same time
+    :param ids: the accessions
+    :param max_connections: the maximum number of concurrent requests
+    """
+    semaphore = asyncio.Semaphore(max_connections)
+    progress = {'done': 0, 'total': len(ids), 'started': time.time()}
+    connector = aiohttp.TCPConnector(limit=max_connections)
+    timeout = aiohttp.ClientTimeout(total=REQUEST_TIMEOUT)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        await asyncio.gather(*[fetch_etag(session, semaphore, my_id, progress) for my_id in set(ids)])
 
 
-async def fetch_all_etags(ids):
-    async with aiohttp.ClientSession() as session:
-        tasks = []
-        for my_id in ids:
-            task = asyncio.ensure_future(fetch_etag(session, my_id))
-            tasks.append(task)
-        await asyncio.gather(*tasks, return_exceptions=True)
+async def fetch_etag(session, semaphore, my_id: str, progress: Dict):
+    """
+    Retrieve the etag of one accession, the request is retried on connection errors and temporary failures
+    """
+    url = SAMPLE_API.format(my_id)
+    method = 'HEAD'
+    status = None
+    etag_value = None
+    attempt = 0
+    while attempt <= MAX_RETRIES:
+        if attempt:
+            # full jitter, so the retries of many accessions do not hit the server at the same moment
+            await asyncio.sleep(random.uniform(0, min(MAX_BACKOFF, 2 ** attempt)))
+        async with semaphore:
+            try:
+                async with session.request(method, url) as resp:
+                    status = resp.status
+                    etag_value = resp.headers.get('ETag')
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                status = None
+        if status == 405 and method == 'HEAD':
+            # not a failure, asked again right away with GET
+            method = 'GET'
+            continue
+        if status is not None and status not in RETRY_STATUSES:
+            break
+        attempt += 1
+    if status == 200 and etag_value:
+        ETAGS[my_id] = etag_value
+    else:
+        FAILED[my_id] = status
+    progress['done'] += 1
+    if progress['done'] % PROGRESS_INTERVAL == 0:
+        elapsed = time.time() - progress['started']
+        print(f"Processed {progress['done']} of {progress['total']} accessions in {elapsed:.0f} seconds, "
+              f"{progress['done'] / elapsed:.0f} per second")
 
 
-async def fetch_etag(session, my_id):
-    url = "http://www.ebi.ac.uk/biosamples/samples/{}".format(my_id)
-    resp = await session.get(url)
-    etag_value = resp.headers.get('ETag')
-    if etag_value:
-        ETAG.append("{}\t{}".format(my_id, etag_value))
-    ETAG_IDS.append(my_id)
+def retry_failed_etags():
+    """
+    Ask once more for the etags of the accessions which failed, one at a time once the concurrent requests are over,
+    the accessions still failing stay in FAILED and are recorded as such in the etag store
+    """
+    print(f"Retrying the etags of {len(FAILED)} accessions one by one")
+    with requests.Session() as session:
+        for my_id in sorted(FAILED.keys()):
+            try:
+                response = session.get(SAMPLE_API.format(my_id), timeout=REQUEST_TIMEOUT)
+            except requests.RequestException:
+                continue
+            if response.status_code == 200 and response.headers.get('ETag'):
+                ETAGS[my_id] = response.headers['ETag']
+                del FAILED[my_id]
+            else:
+                FAILED[my_id] = response.status_code
 
 
 def fetch_biosample_ids():
@@ -46,7 +127,3 @@ def fetch_biosample_ids():
 
 if __name__ == "__main__":
     main()
-    today = date.today().strftime('%Y-%m-%d')
-    with open("etag_list_{}.txt".format(today), 'w') as w:
-        for item in sorted(ETAG):
-            w.write(item + "\n")
@@ -2,10 +2,12 @@ import click
 from constants import STAGING_NODE1
 from elasticsearch import Elasticsearch
 from utils import remove_underscore_from_end_prefix, write_system_log, get_line_number, get_record_ids, \
-    convert_analysis, generate_ena_api_endpoint, process_validation_result
+    convert_analysis, generate_ena_api_endpoint, process_validation_result, ImportLogWriter, write_metrics_summary
 from misc import get_filename_from_url
 import requests
 import validate_analysis_record
+from bulk_indexer import BulkIndexer, DEFAULT_MAX_UNSEEN_RATIO
+from dead_letter import DeadLetterQueue
 
 SCRIPT_NAME = 'import_analysis'
 
@@ -31,13 +33,21 @@ RULESETS = ["FAANG Analyses", "FAANG Legacy Analyses"]
     help='Specify how to deal with the system log either writing to es or printing out. '
          'It only allows two values: true (to es) or false (print to the terminal)'
 )
+@click.option(
+    '--clean_dry_run',
+    default="true",
+    help='Specify whether to only report the documents not written during this run (true) '
+         f'or delete them (false), nothing is deleted when more than {DEFAULT_MAX_UNSEEN_RATIO:.0%} of the '
+         f'documents would go'
+)
 # TODO check single or double quotes
-def main(es_hosts, es_index_prefix, to_es: str):
+def main(es_hosts, es_index_prefix, to_es: str, clean_dry_run: str):
     """
     Main function that will import analysis data from ena
     :param es_hosts: elasticsearch hosts where the data import into
     :param es_index_prefix: the index prefix points to a particular version of data
     :param to_es: determine whether to output log to Elasticsearch (True) or terminal (False, printing)
+    :param clean_dry_run: determine whether to only report (True) or delete (False) the documents not written
     :return:
     """
     to_es_flag = True
@@ -48,6 +58,9 @@ def main(es_hosts, es_index_prefix, to_es: str):
     else:
         print('to_es parameter can only accept value of true or false')
         exit(1)
+    if clean_dry_run.lower() not in ('true', 'false'):
+        print('clean_dry_run parameter can only accept value of true or false')
+        exit(1)
 
     hosts = es_hosts.split(";")
     es = Elasticsearch(hosts)
@@ -105,7 +118,21 @@ def main(es_hosts, es_index_prefix, to_es: str):
     validator = validate_analysis_record.ValidateAnalysisRecord(analyses, RULESETS)
     validation_results = validator.validate()
     ruleset_version = validator.get_ruleset_version()
-    process_validation_result(analyses, es, es_index_prefix, validation_results, ruleset_version, RULESETS, to_es_flag)
+    with BulkIndexer(es, dead_letter=DeadLetterQueue()) as bulk_indexer:
+        # unchanged analyses are skipped, the legacy ones without project are managed by import_analysis_legacy
+        bulk_indexer.track_changes(f'{es_index_prefix}_analysis', {'exists': {'field': 'project'}})
+        log_writer = ImportLogWriter(bulk_indexer, es_index_prefix, SCRIPT_NAME)
+        process_validation_result(analyses, es, es_index_prefix, validation_results, ruleset_version, RULESETS,
+                                  to_es_flag, bulk_indexer, log_writer)
+        for index, unseen in bulk_indexer.delete_unseen(clean_dry_run.lower() == 'true').items():
+            if unseen['unseen']:
+                write_system_log(es, SCRIPT_NAME, 'warning', get_line_number(),
+                                 f"{unseen['unseen']} documents of {index} not written during the run, "
+                                 f"deleted: {unseen['deleted']}, e.g. {unseen['ids']}", to_es_flag)
+        log_writer.close()
+    write_system_log(es, SCRIPT_NAME, 'info', get_line_number(),
+                     f'Bulk indexing finished: {bulk_indexer.report()}', to_es_flag)
+    write_metrics_summary(es, SCRIPT_NAME, to_es_flag)
     write_system_log(es, SCRIPT_NAME, 'info', get_line_number(), 'Finish importing analysis', to_es_flag)
 
 
@@ -2,9 +2,11 @@ import click
 from constants import STAGING_NODE1
 from elasticsearch import Elasticsearch
 from utils import remove_underscore_from_end_prefix, write_system_log, get_line_number, get_record_ids, \
-    convert_analysis, generate_ena_api_endpoint, process_validation_result
+    convert_analysis, generate_ena_api_endpoint, process_validation_result, ImportLogWriter, write_metrics_summary
 import requests
 import validate_analysis_record
+from bulk_indexer import BulkIndexer
+from dead_letter import DeadLetterQueue
 
 SCRIPT_NAME = 'import_analysis_legacy'
 
@@ -135,7 +137,12 @@ def main(es_hosts, es_index_prefix, to_es: str):
     validator = validate_analysis_record.ValidateAnalysisRecord(analyses, RULESETS)
     validation_results = validator.validate()
     ruleset_version = validator.get_ruleset_version()
-    process_validation_result(analyses, es, es_index_prefix, validation_results, ruleset_version, RULESETS, to_es_flag)
+    with BulkIndexer(es, dead_letter=DeadLetterQueue()) as bulk_indexer:
+        log_writer = ImportLogWriter(bulk_indexer, es_index_prefix, SCRIPT_NAME)
+        process_validation_result(analyses, es, es_index_prefix, validation_results, ruleset_version, RULESETS,
+                                  to_es_flag, bulk_indexer, log_writer)
+        log_writer.close()
+    write_metrics_summary(es, SCRIPT_NAME, to_es_flag)
     write_system_log(es, SCRIPT_NAME, 'info', get_line_number(), 'Finish importing analysis legacy', to_es_flag)
 
 
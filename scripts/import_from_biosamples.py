@@ -1,16 +1,26 @@
 from elasticsearch import Elasticsearch
+from elasticsearch.exceptions import NotFoundError
 from datetime import datetime
 from utils import remove_underscore_from_end_prefix, insert_into_es, insert_es_log, \
-    write_system_log, get_line_number
-from get_all_etags import fetch_biosample_ids
+    write_system_log, get_line_number, ImportLogWriter, write_metrics_summary
+from get_all_etags import fetch_biosample_ids, SAMPLE_API, MAX_CONNECTIONS, REQUEST_TIMEOUT
+from etag_store import EtagStore
+from record_sync import RecordSynchroniser
+from bulk_indexer import ParallelBulkIndexer, DEFAULT_MAX_IN_FLIGHT
+from dead_letter import DeadLetterQueue
+from stale_documents import delete_stale_documents
+from es_reader import iterate_field_values
+from page_harvester import PageHarvester, DEFAULT_PAGES_IN_FLIGHT, create_session
 from columns import *
 from misc import *
-from typing import Dict
+from typing import Dict, List, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import validate_organism_record
 import validate_specimen_record
 import requests
 import json
 import sys
+import time
 import click
 import os
 import os.path
@@ -29,10 +39,20 @@ ORGANISM_REFERRED_BY_SPECIMEN = dict()
 ALL_DERIVED_SPECIMEN = dict()
 RULESETS = ["FAANG Samples", "FAANG Legacy Samples"]
 TOTAL_RECORDS_TO_UPDATE = 0
-ETAGS_CACHE = dict()
+# False when the harvest missed records, the records missing must not be deleted from ES
+HARVEST_COMPLETE = True
+# the etags harvested from BioSamples today, see etag_store.py
+ETAGS_CACHE = None
+# only the doc values of etag are returned, so large pages are cheap
+ETAG_PAGE_SIZE = 10000
+BIOSAMPLES_FAANG_URL = 'https://www.ebi.ac.uk/biosamples/samples?size=1000&filter=attr%3Aproject%3AFAANG'
 ERROR_ESSENTIAL_FILENAME = 'biosamples_without_essential_fields.txt'
+# shared by the threads downloading single records, failed requests are retried with backoff
+RECORD_SESSION = create_session(MAX_CONNECTIONS)
 known_missing_essential_records = set()
 to_es_flag = True
+bulk_indexer = None
+log_writer = None
 
 MATERIAL_TYPES = {
     "organism": "OBI_0100026",
@@ -65,21 +85,75 @@ ALL_MATERIAL_TYPES = dict()
     help='Specify how to deal with the system log either writing to es or printing out. '
          'It only allows two values: true (to es) or false (print to the terminal)'
 )
+@click.option(
+    '--summary_log',
+    default="false",
+    help='Specify whether to store only the aggregated import log counts for this run (true) '
+         'or one import log entry per record (false)'
+)
+@click.option(
+    '--clean_dry_run',
+    default="false",
+    help='Specify whether to only report the records no longer in BioSamples (true) or delete them (false)'
+)
+@click.option(
+    '--bulk_requests',
+    default=DEFAULT_MAX_IN_FLIGHT,
+    type=int,
+    help='Specify the maximum number of bulk requests sent to Elastic Search at the same time, default to be 4'
+)
+@click.option(
+    '--harvest_requests',
+    default=DEFAULT_PAGES_IN_FLIGHT,
+    type=int,
+    help='Specify the maximum number of BioSamples pages parsed ahead of the processing, default to be 4'
+)
+@click.option(
+    '--resume_dir',
+    default="",
+    help='Specify the folder keeping the downloaded BioSamples pages, so an interrupted import could be resumed. '
+         'If not provided, all pages are downloaded in every run'
+)
+@click.option(
+    '--conditional_get',
+    default="true",
+    help='Specify whether to update the records already imported with conditional requests (true) '
+         'or to compare the etags of all records first and then download the changed records (false)'
+)
+@click.option(
+    '--sync_requests',
+    default=MAX_CONNECTIONS,
+    type=int,
+    help=f'Specify the maximum number of records requested from BioSamples at the same time when updating '
+         f'the records already imported, default to be {MAX_CONNECTIONS}'
+)
 # TODO check single or double quotes
-def main(es_hosts, es_index_prefix, to_es: str):
+def main(es_hosts, es_index_prefix, to_es: str, summary_log: str, clean_dry_run: str, bulk_requests: int,
+         harvest_requests: int, resume_dir: str, conditional_get: str, sync_requests: int):
     """
     Main function that will import data from biosamples
     :param es_hosts: elasticsearch hosts where the data import into
     :param es_index_prefix: the index prefix points to a particular version of data
     :param to_es: determine whether to output log to Elasticsearch (True) or terminal (False, printing)
+    :param summary_log: determine whether to store only the aggregated import log (True) or per record (False)
+    :param clean_dry_run: determine whether to only report (True) or delete (False) the records not in BioSamples
+    :param bulk_requests: the maximum number of bulk requests sent at the same time
+    :param harvest_requests: the maximum number of BioSamples pages parsed ahead of the processing
+    :param resume_dir: the folder keeping the downloaded BioSamples pages
+    :param conditional_get: determine whether to update the records with conditional requests (True) or compare the
+    etags first (False)
+    :param sync_requests: the maximum number of records requested at the same time when updating the records
     :return:
     """
     global ETAGS_CACHE
     global ALL_MATERIAL_TYPES
     global to_es_flag
+    global bulk_indexer
+    global log_writer
     # initialize ES first as needed to do logging
     hosts = es_hosts.split(";")
     es = Elasticsearch(hosts)
+    bulk_indexer = ParallelBulkIndexer(es, max_in_flight=bulk_requests, dead_letter=DeadLetterQueue())
 
     if to_es.lower() == 'false':
         to_es_flag = False
@@ -88,25 +162,17 @@ def main(es_hosts, es_index_prefix, to_es: str):
     else:
         print('to_es parameter can only accept value of true or false')
         exit(1)
+    if summary_log.lower() not in ('true', 'false'):
+        print('summary_log parameter can only accept value of true or false')
+        exit(1)
+    if clean_dry_run.lower() not in ('true', 'false'):
+        print('clean_dry_run parameter can only accept value of true or false')
+        exit(1)
+    if conditional_get.lower() not in ('true', 'false'):
+        print('conditional_get parameter can only accept value of true or false')
+        exit(1)
 
-    today = datetime.now().strftime('%Y-%m-%d')
-    cache_filename = f'etag_list_{today}.txt'
-    if not os.path.isfile(cache_filename):
-        write_system_log(es, 'import_biosamples', 'info', get_line_number(),
-                         'Could not find today etag cache file. Generating', to_es_flag)
-        code_dir = os.path.dirname(os.path.abspath(sys.argv[0]))
-        etag_script_file = f'{code_dir}{os.sep}get_all_etags.py'
-        os.system(f'python3 {etag_script_file}')
-    try:
-        with open(cache_filename, 'r') as f:
-            for line in f:
-                line = line.rstrip()
-                data = line.split("\t")
-                ETAGS_CACHE[data[0]] = data[1]
-    except FileNotFoundError:
-        write_system_log(es, 'import_biosamples', 'error', get_line_number(),
-                         f'Could not find the local etag cache file etag_list_{today}.txt', to_es_flag)
-        sys.exit(1)
+    ETAGS_CACHE = EtagStore()
     try:
         with open(ERROR_ESSENTIAL_FILENAME, 'r') as f:
             for line in f:
@@ -157,12 +223,13 @@ def main(es_hosts, es_index_prefix, to_es: str):
     if es_index_prefix:
         write_system_log(es, 'import_biosamples', 'info', get_line_number(),
                          f'Index_prefix: {es_index_prefix}', to_es_flag)
+    log_writer = ImportLogWriter(bulk_indexer, es_index_prefix, 'import_biosamples', summary_log.lower() == 'true')
 
     ruleset_version = validate_organism_record.ValidateOrganismRecord.get_ruleset_version()
     write_system_log(es, 'import_biosamples', 'info', get_line_number(), 'The program starts', to_es_flag)
     write_system_log(es, 'import_biosamples', 'info', get_line_number(),
                      f'Current ruleset version is {ruleset_version}', to_es_flag)
-    etags_es: Dict[str, str] = get_existing_etags(hosts[0], es, es_index_prefix)
+    etags_es: Dict[str, str] = get_existing_etags(es, es_index_prefix)
 
     write_system_log(es, 'import_biosamples', 'info', get_line_number(),
                      f"There are {len(etags_es)} records with etags_es in ES", to_es_flag)
@@ -172,16 +239,25 @@ def main(es_hosts, es_index_prefix, to_es: str):
 
     # when more than half BioSamples records not already stored in ES, take the batch import route
     # otherwise compare each record's etag to decide
-    if len(etags_es) == 0 or len(fetch_biosample_ids())/len(etags_es) > 2:
+    biosample_ids = fetch_biosample_ids()
+    if len(etags_es) == 0 or len(biosample_ids)/len(etags_es) > 2:
         write_system_log(es, 'import_biosamples', 'info', get_line_number(), 'By project route', to_es_flag)
-        fetch_records_by_project(es, es_index_prefix)
+        harvest_etags(es)
+        fetch_records_by_project(es, es_index_prefix, harvest_requests, resume_dir)
+    elif conditional_get.lower() == 'true':
+        write_system_log(es, 'import_biosamples', 'info', get_line_number(), 'By conditional request route',
+                         to_es_flag)
+        fetch_records_by_conditional_get(etags_es, biosample_ids, es, es_index_prefix, sync_requests)
     else:
         write_system_log(es, 'import_biosamples', 'info', get_line_number(), 'By individual route', to_es_flag)
-        fetch_records_by_project_via_etag(etags_es, es, es_index_prefix)
+        harvest_etags(es)
+        fetch_records_by_project_via_etag(etags_es, es, es_index_prefix, sync_requests)
 
     if TOTAL_RECORDS_TO_UPDATE == 0:
         write_system_log(es, 'import_biosamples', 'critical', get_line_number(),
                          'Did not obtain any records which need to be updated from BioSamples', to_es_flag)
+        finish_bulk_writes(es)
+        write_metrics_summary(es, 'import_biosamples', to_es_flag)
         sys.exit(0)
 
     # the order of importation could not be changed due to derive from
@@ -203,6 +279,7 @@ def main(es_hosts, es_index_prefix, to_es: str):
 
     write_system_log(es, 'import_biosamples', 'info', get_line_number(), 'Indexing cell line starts', to_es_flag)
     process_cell_lines(es, es_index_prefix)
+    finish_bulk_writes(es)
 
     all_organism_list = list(ORGANISM.keys())
     organism_referred_list = list(ORGANISM_REFERRED_BY_SPECIMEN.keys())
@@ -223,82 +300,230 @@ def main(es_hosts, es_index_prefix, to_es: str):
         if union[acc]['count'] == 1:
             write_system_log(es, 'import_biosamples', 'warning', get_line_number(),
                              f"{acc} only in source {union[acc]['source']}", to_es_flag)
-    clean_elasticsearch(f'{es_index_prefix}_specimen', es)
-    clean_elasticsearch(f'{es_index_prefix}_organism', es)
+    if HARVEST_COMPLETE:
+        clean_elasticsearch(f'{es_index_prefix}_specimen', es, clean_dry_run.lower() == 'true')
+        clean_elasticsearch(f'{es_index_prefix}_organism', es, clean_dry_run.lower() == 'true')
+    else:
+        write_system_log(es, 'import_biosamples', 'error', get_line_number(),
+                         'Skip cleaning ES as the BioSamples harvest is incomplete', to_es_flag)
+    write_metrics_summary(es, 'import_biosamples', to_es_flag)
     write_system_log(es, 'import_biosamples', 'info', get_line_number(), 'Program ends', to_es_flag)
 
 
-def get_existing_etags(host: str, es, es_index_prefix) -> Dict[str, str]:
+def finish_bulk_writes(es) -> None:
     """
-    Function gets etags from organisms and specimens in elastic search
-    :return: list of etags
+    Send the collected import log entries and all queued documents into Elasticsearch
+    :param es: elasticsearch object
+    """
+    log_writer.close()
+    bulk_indexer.close()
+    write_system_log(es, 'import_biosamples', 'info', get_line_number(),
+                     f'Import log counts: {log_writer.get_counts()}, duplicated entries: {log_writer.duplicates}',
+                     to_es_flag)
+    write_system_log(es, 'import_biosamples', 'info', get_line_number(),
+                     f'Bulk indexing finished: {bulk_indexer.report()}', to_es_flag)
+
+
+def get_existing_etags(es, es_index_prefix) -> Dict[str, str]:
+    """
+    Function gets etags from organisms and specimens in elastic search, the two indices are read concurrently
+    :return: dict of etags, keys are biosample ids
     """
-    if not host.endswith(":9200"):
-        host = host + ":9200"
     results = dict()
-    for item in ("organism", "specimen"):
-        url = f'http://{host}/{es_index_prefix}_{item}/_search?_source=biosampleId,etag&sort=biosampleId&size=100000'
-        response = requests.get(url).json()
-        try:
-            for result in response['hits']['hits']:
-                if 'etag' in result['_source']:
-                    results[result['_source']['biosampleId']] = result['_source']['etag']
-        except KeyError:
-            write_system_log(es, 'import_biosamples', 'error', get_line_number(),
-                             f'Failing to get hits from result {url}', to_es_flag)
-            exit()
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        futures = {executor.submit(get_etags, es, f'{es_index_prefix}_{item}'): item
+                   for item in ("organism", "specimen")}
+        for future in as_completed(futures):
+            item = futures[future]
+            try:
+                etags, duration = future.result()
+            except NotFoundError:
+                write_system_log(es, 'import_biosamples', 'warning', get_line_number(),
+                                 f'Index {es_index_prefix}_{item} not found, all {item} records will be imported',
+                                 to_es_flag)
+                continue
+            results.update(etags)
+            write_system_log(es, 'import_biosamples', 'info', get_line_number(),
+                             f'Retrieved {len(etags)} etags from {es_index_prefix}_{item} in {duration:.1f} seconds',
+                             to_es_flag)
     return results
 
 
-def fetch_records_by_project_via_etag(etags, es, es_index_prefix):
-    global TOTAL_RECORDS_TO_UPDATE
-    counts = dict()
+def get_etags(es, index) -> Tuple[Dict[str, str], float]:
+    """
+    Read the etags of one index page by page, only the doc values of etag are transferred
+    :param es: elasticsearch python library instance
+    :param index: the name of the index
+    :return: dict of etags keyed by biosample ids which are the document ids, and the number of seconds taken
+    """
+    started = time.time()
+    etags = dict()
+    for biosample_id, values in iterate_field_values(es, index, ['etag'], {'exists': {'field': 'etag'}},
+                                                     page_size=ETAG_PAGE_SIZE):
+        etags[biosample_id] = values['etag']
+    return etags, time.time() - started
+
+
+def harvest_etags(es) -> None:
+    """
+    Make sure the etags of all BioSamples records have been harvested today, the harvest takes a while
+    :param es: elasticsearch python library instance, for logging
+    """
     today = datetime.now().strftime('%Y-%m-%d')
-    with open("etag_list_{}.txt".format(today), 'r') as f:
-        for line in f:
-            line = line.rstrip()
-            data = line.split("\t")
-            # etag in ES matches the live version, no change
-            if data[0] in etags and etags[data[0]] and etags[data[0]] == data[1]:
-                INDEXED_SAMPLES[data[0]] = 1
+    if not ETAGS_CACHE.has_harvest(today):
+        write_system_log(es, 'import_biosamples', 'info', get_line_number(),
+                         'Could not find the etags harvested today. Generating', to_es_flag)
+        code_dir = os.path.dirname(os.path.abspath(sys.argv[0]))
+        etag_script_file = f'{code_dir}{os.sep}get_all_etags.py'
+        os.system(f'python3 {etag_script_file}')
+        ETAGS_CACHE.refresh()
+    if not ETAGS_CACHE.has_harvest(today):
+        write_system_log(es, 'import_biosamples', 'error', get_line_number(),
+                         f'Could not find the etags harvested today in {ETAGS_CACHE.path}', to_es_flag)
+        sys.exit(1)
+    log_changes_since_previous_harvest(es)
+
+
+def log_changes_since_previous_harvest(es) -> None:
+    previous = ETAGS_CACHE.get_previous_harvest()
+    if previous:
+        write_system_log(es, 'import_biosamples', 'info', get_line_number(),
+                         f'{len(ETAGS_CACHE.changed_since(previous))} BioSamples records are new or changed since '
+                         f'the harvest of {previous}', to_es_flag)
+
+
+def fetch_records_by_project_via_etag(etags, es, es_index_prefix, max_workers=MAX_CONNECTIONS):
+    """
+    Download the records whose etag in ES differs from the harvested one, by a pool of threads.
+    The records are classified as soon as they arrive while the others are still being downloaded
+    :param etags: dict of etags in ES keyed by biosample ids
+    :param max_workers: the maximum number of records downloaded at the same time
+    """
+    changed = dict()
+    for accession, etag in ETAGS_CACHE.items():
+        # etag in ES matches the live version, no change
+        if accession in etags and etags[accession] and etags[accession] == etag:
+            INDEXED_SAMPLES[accession] = 1
+        else:
+            changed[accession] = etag
+    write_system_log(es, 'import_biosamples', 'info', get_line_number(),
+                     f'{len(changed)} records have different etags from the ones in ES', to_es_flag)
+    counts = dict()
+    failed = dict()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(fetch_single_record, accession): accession for accession in changed}
+        for future in as_completed(futures):
+            accession = futures[future]
+            try:
+                single = future.result()
+            except (requests.RequestException, ValueError, KeyError) as e:
+                # e.g. connection errors and error responses without the record, the stored copy is kept
+                failed[accession] = repr(e)
+                if accession in etags:
+                    INDEXED_SAMPLES[accession] = 1
                 continue
-            else:
-                single = unify_field_names(fetch_single_record(data[0]))
-                single['etag'] = data[1]
-                if not check_is_faang(single):
-                    sample_type = determine_sample_type(single)
-                    insert_es_log(es, es_index_prefix, sample_type, single['accession'], 'error', 'no project=FAANG')
-                    continue
-                material = single['characteristics']['Material'][0]['text']
-                if material in ALL_MATERIAL_TYPES and material != ALL_MATERIAL_TYPES[material]:
-                    material = ALL_MATERIAL_TYPES[material]
-                    single['characteristics']['Material'][0]['text'] = material
-                    single['characteristics']['Material'][0]['ontologyTerms'][0] = MATERIAL_TYPES[material]
-                if material == 'organism':
-                    ORGANISM[data[0]] = single
-                    # this may seem to be duplicate, however necessary: any unrecognized material type will be stored
-                    # in counts, but will not be loaded into ES and need to inform FAANG DCC
-                    TOTAL_RECORDS_TO_UPDATE += 1
-                elif material == 'specimen from organism':
-                    SPECIMEN_FROM_ORGANISM[data[0]] = single
-                    TOTAL_RECORDS_TO_UPDATE += 1
-                elif material == 'cell specimen':
-                    CELL_SPECIMEN[data[0]] = single
-                    TOTAL_RECORDS_TO_UPDATE += 1
-                elif material == 'cell culture':
-                    CELL_CULTURE[data[0]] = single
-                    TOTAL_RECORDS_TO_UPDATE += 1
-                elif material == 'cell line':
-                    CELL_LINE[data[0]] = single
-                    TOTAL_RECORDS_TO_UPDATE += 1
-                elif material == 'pool of specimens':
-                    POOL_SPECIMEN[data[0]] = single
-                    TOTAL_RECORDS_TO_UPDATE += 1
-                else:
-                    insert_es_log(es, es_index_prefix, 'sample', data[0], 'error',
-                                  f'not recognized material type {material}')
-                counts.setdefault(material, 0)
-                counts[material] += 1
+            single['etag'] = changed[accession]
+            classify_record(es, es_index_prefix, accession, single, counts)
+    if failed:
+        write_system_log(es, 'import_biosamples', 'warning', get_line_number(),
+                         f'Failed to retrieve {len(failed)} records, e.g. {list(failed.items())[:10]}', to_es_flag)
+    # the accessions whose etag could not be retrieved are still in BioSamples, the stored copies are kept
+    failed_etags = ETAGS_CACHE.get_failed()
+    for accession in failed_etags:
+        if accession in etags:
+            INDEXED_SAMPLES[accession] = 1
+    if failed_etags:
+        write_system_log(es, 'import_biosamples', 'warning', get_line_number(),
+                         f'The etags of {len(failed_etags)} records could not be retrieved, '
+                         f'the stored copies are kept', to_es_flag)
+    report_records_to_update(es, counts)
+
+
+def fetch_records_by_conditional_get(etags, biosample_ids, es, es_index_prefix, max_connections=MAX_CONNECTIONS):
+    """
+    Request every BioSamples record conditionally on the etag stored in ES, only the changed records are downloaded.
+    The current etags are recorded as today's harvest, so no separate etag harvest is needed
+    :param etags: dict of etags in ES keyed by biosample ids
+    :param biosample_ids: the accessions of all FAANG records in BioSamples
+    :param max_connections: the maximum number of requests sent at the same time
+    """
+    synchroniser = RecordSynchroniser(etags, max_connections)
+    synchroniser.run(biosample_ids)
+    stats = synchroniser.stats
+    write_system_log(es, 'import_biosamples', 'info', get_line_number(),
+                     f"Synchronised {len(set(biosample_ids))} records with {stats['requests']} requests in "
+                     f"{stats['seconds']} seconds: {stats['not_modified']} not modified, {stats['modified']} modified "
+                     f"({stats['bytes']} bytes downloaded) and {stats['failed']} failed. "
+                     f"Saved {stats['requests_saved']} requests and {stats['bytes_saved']} bytes compared with "
+                     f"comparing the etags first", to_es_flag)
+    if synchroniser.failed:
+        # the stored copies of the records which could not be checked are kept
+        for accession in synchroniser.failed:
+            if accession in etags:
+                INDEXED_SAMPLES[accession] = 1
+        write_system_log(es, 'import_biosamples', 'warning', get_line_number(),
+                         f'Failed to synchronise {len(synchroniser.failed)} records, '
+                         f'e.g. {list(synchroniser.failed.items())[:10]}', to_es_flag)
+    ETAGS_CACHE.record_harvest(synchroniser.current_etags, failed=synchroniser.failed)
+    log_changes_since_previous_harvest(es)
+    for accession in synchroniser.unchanged:
+        INDEXED_SAMPLES[accession] = 1
+    counts = dict()
+    for accession, record in synchroniser.records.items():
+        single = unify_field_names(record)
+        classify_record(es, es_index_prefix, accession, single, counts)
+    report_records_to_update(es, counts)
+
+
+def classify_record(es, es_index_prefix, accession, single, counts: Dict[str, int]) -> None:
+    """
+    Keep one record needing update according to its material type
+    :param accession: the accession of the record
+    :param single: the record
+    :param counts: the number of records of each material type, updated in place
+    """
+    global TOTAL_RECORDS_TO_UPDATE
+    if not check_is_faang(single):
+        sample_type = determine_sample_type(single)
+        insert_es_log(es, es_index_prefix, sample_type, single['accession'], 'error', 'no project=FAANG',
+                      log_writer)
+        return
+    material = single['characteristics']['Material'][0]['text']
+    if material in ALL_MATERIAL_TYPES and material != ALL_MATERIAL_TYPES[material]:
+        material = ALL_MATERIAL_TYPES[material]
+        single['characteristics']['Material'][0]['text'] = material
+        single['characteristics']['Material'][0]['ontologyTerms'][0] = MATERIAL_TYPES[material]
+    if material == 'organism':
+        ORGANISM[accession] = single
+        # this may seem to be duplicate, however necessary: any unrecognized material type will be stored
+        # in counts, but will not be loaded into ES and need to inform FAANG DCC
+        TOTAL_RECORDS_TO_UPDATE += 1
+    elif material == 'specimen from organism':
+        SPECIMEN_FROM_ORGANISM[accession] = single
+        TOTAL_RECORDS_TO_UPDATE += 1
+    elif material == 'cell specimen':
+        CELL_SPECIMEN[accession] = single
+        TOTAL_RECORDS_TO_UPDATE += 1
+    elif material == 'cell culture':
+        CELL_CULTURE[accession] = single
+        TOTAL_RECORDS_TO_UPDATE += 1
+    elif material == 'cell line':
+        CELL_LINE[accession] = single
+        TOTAL_RECORDS_TO_UPDATE += 1
+    elif material == 'pool of specimens':
+        POOL_SPECIMEN[accession] = single
+        TOTAL_RECORDS_TO_UPDATE += 1
+    else:
+        insert_es_log(es, es_index_prefix, 'sample', accession, 'error',
+                      f'not recognized material type {material}', log_writer)
+    counts.setdefault(material, 0)
+    counts[material] += 1
+
+
+def report_records_to_update(es, counts: Dict[str, int]) -> None:
+    """
+    Log the number of records needing update of each material type, exit when there is none
+    """
     if TOTAL_RECORDS_TO_UPDATE == 0:
         write_system_log(es, 'import_biosamples', 'info', get_line_number(),
                          'All records have not been modified since last importation.', to_es_flag)
@@ -306,6 +531,8 @@ def fetch_records_by_project_via_etag(etags, es, es_index_prefix):
         if counts:
             write_system_log(es, 'import_biosamples', 'warning', get_line_number(),
                              f'Some records with wrong material type have been found: ({counts})', to_es_flag)
+        finish_bulk_writes(es)
+        write_metrics_summary(es, 'import_biosamples', to_es_flag)
         sys.exit(0)
     for k, v in counts.items():
         write_system_log(es, 'import_biosamples', 'info', get_line_number(),
@@ -352,67 +579,64 @@ def find_essential_fields(biosample: Dict) -> bool:
     return True
 
 
-def fetch_records_by_project(es, es_index_prefix):
+def fetch_records_by_project(es, es_index_prefix, max_in_flight=DEFAULT_PAGES_IN_FLIGHT, resume_dir=None):
     """
-    Get all FAANG-labelled sample records from BioSamples using the API
+    Get all FAANG-labelled sample records from BioSamples using the API, the next page is downloaded and several
+    pages are parsed while the records of the pages already downloaded are processed
+    :param es: elasticsearch python library instance
+    :param es_index_prefix: the index prefix points to a particular version of data
+    :param max_in_flight: the maximum number of pages parsed ahead of the processing
+    :param resume_dir: optional folder keeping the downloaded pages to resume an interrupted harvest
     :return:
     """
     global TOTAL_RECORDS_TO_UPDATE
-    biosamples = list()
+    global HARVEST_COMPLETE
     counts = dict()
 
-    url = 'https://www.ebi.ac.uk/biosamples/samples?size=1000&filter=attr%3Aproject%3AFAANG'
     write_system_log(es, 'import_biosamples', 'info', get_line_number(),
                      f'Size of local etag cache: {str(len(ETAGS_CACHE))}', to_es_flag)
-    while url:
-        write_system_log(es, 'import_biosamples', 'info', get_line_number(), f'Fetching data from {url}', to_es_flag)
-        response = requests.get(url).json()
-        for biosample in response['_embedded']['samples']:
-            if biosample['accession'] in known_missing_essential_records:
+    harvester = PageHarvester(BIOSAMPLES_FAANG_URL, parse_biosamples_page, max_in_flight, resume_dir)
+    for page_number, (biosamples, without_essential_fields) in harvester.pages():
+        if page_number % 10 == 0:
+            write_system_log(es, 'import_biosamples', 'info', get_line_number(),
+                             f'Processing page {page_number} of {BIOSAMPLES_FAANG_URL}', to_es_flag)
+        for biosample in without_essential_fields:
+            with open(ERROR_ESSENTIAL_FILENAME, 'a') as w:
+                w.write(f"{biosample['accession']}\n")
+                sample_type = determine_sample_type(biosample)
+                insert_es_log(es, es_index_prefix, sample_type, biosample['accession'], 'error',
+                              'missing essential fields', log_writer)
+                # to activate cronjob email notification
+                print(f"{biosample['accession']} does not have essential fields\n")
+
+        for biosample in biosamples:
+            # None for the accessions whose etag could not be retrieved, they are compared again in the next run
+            biosample['etag'] = ETAGS_CACHE.get(biosample['accession'])
+            if not check_is_faang(biosample):
+                sample_type = determine_sample_type(biosample)
+                insert_es_log(es, es_index_prefix, sample_type, biosample['accession'], 'error', 'no project=FAANG',
+                              log_writer)
                 continue
-            biosample = unify_field_names(biosample)
-            if find_essential_fields(biosample):
-                biosample['etag'] = ETAGS_CACHE[biosample['accession']]
-                biosamples.append(biosample)
-            else:
-                with open(ERROR_ESSENTIAL_FILENAME , 'a') as w:
-                    w.write(f"{biosample['accession']}\n")
-                    sample_type = determine_sample_type(biosample)
-                    insert_es_log(es, es_index_prefix, sample_type, biosample['accession'], 'error',
-                                  'missing essential fields')
-                    # to activate cronjob email notification
-                    print(f"{biosample['accession']} does not have essential fields\n")
-
-        if 'next' in response['_links']:
-            url = response['_links']['next']['href']
-        else:
-            url = ''
-
-    for i, biosample in enumerate(biosamples):
-        if not check_is_faang(biosample):
-            sample_type = determine_sample_type(biosample)
-            insert_es_log(es, es_index_prefix, sample_type, biosample['accession'], 'error', 'no project=FAANG')
-            continue
-        material = biosample['characteristics']['Material'][0]['text']
-        if material in ALL_MATERIAL_TYPES and material != ALL_MATERIAL_TYPES[material]:
-            material = ALL_MATERIAL_TYPES[material]
-            biosample['characteristics']['Material'][0]['text'] = material
-            biosample['characteristics']['Material'][0]['ontologyTerms'][0] = MATERIAL_TYPES[material]
-        if material == 'organism':
-            biosample = deal_with_decimal_degrees(biosample)
-            ORGANISM[biosample['accession']] = biosample
-        elif material == 'specimen from organism':
-            SPECIMEN_FROM_ORGANISM[biosample['accession']] = biosample
-        elif material == 'cell specimen':
-            CELL_SPECIMEN[biosample['accession']] = biosample
-        elif material == 'cell culture':
-            CELL_CULTURE[biosample['accession']] = biosample
-        elif material == 'cell line':
-            CELL_LINE[biosample['accession']] = biosample
-        elif material == 'pool of specimens':
-            POOL_SPECIMEN[biosample['accession']] = biosample
-        counts.setdefault(material, 0)
-        counts[material] += 1
+            material = biosample['characteristics']['Material'][0]['text']
+            if material in ALL_MATERIAL_TYPES and material != ALL_MATERIAL_TYPES[material]:
+                material = ALL_MATERIAL_TYPES[material]
+                biosample['characteristics']['Material'][0]['text'] = material
+                biosample['characteristics']['Material'][0]['ontologyTerms'][0] = MATERIAL_TYPES[material]
+            if material == 'organism':
+                biosample = deal_with_decimal_degrees(biosample)
+                ORGANISM[biosample['accession']] = biosample
+            elif material == 'specimen from organism':
+                SPECIMEN_FROM_ORGANISM[biosample['accession']] = biosample
+            elif material == 'cell specimen':
+                CELL_SPECIMEN[biosample['accession']] = biosample
+            elif material == 'cell culture':
+                CELL_CULTURE[biosample['accession']] = biosample
+            elif material == 'cell line':
+                CELL_LINE[biosample['accession']] = biosample
+            elif material == 'pool of specimens':
+                POOL_SPECIMEN[biosample['accession']] = biosample
+            counts.setdefault(material, 0)
+            counts[material] += 1
     for k, v in counts.items():
         TOTAL_RECORDS_TO_UPDATE += v
         write_system_log(es, 'import_biosamples', 'info', get_line_number(),
@@ -422,6 +646,32 @@ def fetch_records_by_project(es, es_index_prefix):
     write_system_log(es, 'import_biosamples', 'info', get_line_number(),
                      f'The total number of records to be updated is {TOTAL_RECORDS_TO_UPDATE}', to_es_flag)
     # logger.info(f"The sum is {TOTAL_RECORDS_TO_UPDATE}")
+    write_system_log(es, 'import_biosamples', 'info', get_line_number(),
+                     f'BioSamples pages harvested: {harvester.stats}', to_es_flag)
+    if not harvester.is_complete():
+        HARVEST_COMPLETE = False
+        write_system_log(es, 'import_biosamples', 'error', get_line_number(),
+                         f"Harvested {harvester.stats['records']} records of {harvester.stats['expected']} announced "
+                         f"by BioSamples", to_es_flag)
+
+
+def parse_biosamples_page(page: Dict) -> Tuple[List[Dict], List[Dict]]:
+    """
+    Normalise the records of one page of BioSamples, called in the thread which downloaded the page
+    :param page: the JSON of the page
+    :return: the records having the essential fields and the records without them
+    """
+    biosamples = list()
+    without_essential_fields = list()
+    for biosample in page.get('_embedded', dict()).get('samples', list()):
+        if biosample['accession'] in known_missing_essential_records:
+            continue
+        biosample = unify_field_names(biosample)
+        if find_essential_fields(biosample):
+            biosamples.append(biosample)
+        else:
+            without_essential_fields.append(biosample)
+    return biosamples, without_essential_fields
 
 
 def determine_sample_type(biosample):
@@ -448,12 +698,25 @@ def fetch_single_record(biosample_id):
     :param biosample_id: accession id or record to return
     :return: json file of sample with biosampleId
     """
-    url = f"https://www.ebi.ac.uk/biosamples/samples/{biosample_id}.json?curationdomain=self.FAANG_DCC_curation"
-    result = unify_field_names(requests.get(url).json())
-    result['etag'] = ETAGS_CACHE[biosample_id]
+    response = RECORD_SESSION.get(SAMPLE_API.format(biosample_id), timeout=REQUEST_TIMEOUT)
+    result = unify_field_names(response.json())
+    result['etag'] = get_etag(biosample_id, response)
     return result
 
 
+def get_etag(biosample_id, response) -> Optional[str]:
+    """
+    :param biosample_id: the accession of the record
+    :param response: the response of the request retrieving the record
+    :return: the etag of the response, which is of the same url as the harvested etags, or the harvested etag if the
+    response has none. Records referred to but not labelled as FAANG are not harvested at all
+    """
+    etag = response.headers.get('ETag')
+    if not etag and ETAGS_CACHE is not None:
+        etag = ETAGS_CACHE.get(biosample_id)
+    return etag
+
+
 def check_is_faang(item):
     """
     Function checks that record belongs to FAANG project
@@ -479,10 +742,9 @@ def deal_with_decimal_degrees(item):
         try:
             if item['characteristics']['birth location latitude'][0]['unit'] == 'decimal degree' or \
                     item['characteristics']['birth location longitude'][0]['unit'] == 'decimal degree':
-                url = "https://www.ebi.ac.uk/biosamples/samples/{}.json?curationdomain=self.FAANG_DCC_curation".format(
-                    item['accession'])
-                biosample = requests.get(url).json()
-                biosample['etag'] = ETAGS_CACHE[biosample['accession']]
+                response = RECORD_SESSION.get(SAMPLE_API.format(item['accession']), timeout=REQUEST_TIMEOUT)
+                biosample = response.json()
+                biosample['etag'] = get_etag(biosample['accession'], response)
                 return biosample
             else:
                 return item
@@ -666,7 +928,7 @@ def add_organism(es, es_index_prefix, specimen_accession, organism_accession):
             add_organism_info_for_specimen(organism_accession, fetch_single_record(organism_accession))
     except:
         insert_es_log(es,es_index_prefix, 'specimen', specimen_accession, 'error',
-                      f"No animal information for given organism accession {organism_accession}")
+                      f"No animal information for given organism accession {organism_accession}", log_writer)
         print(f"Encounter error when trying to retrieve animal information by accesion {organism_accession} "
               f"for specimen {specimen_accession}")
         return False
@@ -1251,25 +1513,23 @@ def import_into_es(data, index_prefix, my_type, es):
                                       f"{validation_results[ruleset]['detail'][biosample_id]['message']}")
                 break
         body = json.dumps(es_doc)
-        insert_es_log(es, index_prefix, my_type, biosample_id, status, ";".join(error_messages))
-        insert_into_es(es, index_prefix, my_type, biosample_id, body)
+        insert_es_log(es, index_prefix, my_type, biosample_id, status, ";".join(error_messages), log_writer)
+        insert_into_es(es, index_prefix, my_type, biosample_id, body, bulk_indexer)
 
 
-def clean_elasticsearch(index, es):
+def clean_elasticsearch(index, es, dry_run=False):
     """
     This function will delete all records that do not exist in biosamples anymore
     :param index: name of index to check
     :param es: elasticsearch object
+    :param dry_run: only report the records to be deleted
     """
-    data = es.search(index=index, size=100000, _source="_id,standardMet")
-    for hit in data['hits']['hits']:
-        if hit['_id'] not in INDEXED_SAMPLES:
-            # Legacy (basic) data imported in import_from_ena_legacy, not here, so could not be cleaned
-            to_be_cleaned = True
-            if 'standardMet' in hit['_source'] and hit['_source']['standardMet'] == constants.STANDARD_BASIC:
-                to_be_cleaned = False
-            if to_be_cleaned:
-                es.delete(index=index, doc_type='_doc', id=hit['_id'])
+    # Legacy (basic) data imported in import_from_ena_legacy, not here, so could not be cleaned
+    legacy_query = {'term': {'standardMet': constants.STANDARD_BASIC}}
+    result = delete_stale_documents(es, index, INDEXED_SAMPLES, legacy_query, dry_run,
+                                    dead_letter=bulk_indexer.dead_letter)
+    write_system_log(es, 'import_biosamples', 'info', get_line_number(),
+                     f'Records not in BioSamples anymore: {result}', to_es_flag)
 
 
 if __name__ == "__main__":
@@ -8,7 +8,8 @@ import click
 from constants import TECHNOLOGIES, STANDARDS, STAGING_NODE1, STANDARD_LEGACY, STANDARD_FAANG
 from elasticsearch import Elasticsearch
 from utils import determine_file_and_source, check_existsence, remove_underscore_from_end_prefix, \
-    write_system_log, insert_into_es, generate_ena_api_endpoint, insert_es_log, get_line_number
+    write_system_log, insert_into_es, generate_ena_api_endpoint, insert_es_log, get_line_number, ImportLogWriter, \
+    write_metrics_summary
 import validate_experiment_record
 import validate_record
 import sys
@@ -16,6 +17,9 @@ import json
 import requests
 import re
 from misc import convert_readable, get_filename_from_url
+from bulk_indexer import ParallelBulkIndexer, DEFAULT_MAX_IN_FLIGHT, DEFAULT_MAX_UNSEEN_RATIO
+from dead_letter import DeadLetterQueue
+from specimen_store import SpecimenStore
 
 RULESETS = ["FAANG Experiments", "FAANG Legacy Experiments"]
 
@@ -43,19 +47,50 @@ alias_cache = dict()
     help='Specify how to deal with the system log either writing to es or printing out. '
          'It only allows two values: true (to es) or false (print to the terminal)'
 )
+@click.option(
+    '--summary_log',
+    default="false",
+    help='Specify whether to store only the aggregated import log counts for this run (true) '
+         'or one import log entry per record (false)'
+)
+@click.option(
+    '--bulk_requests',
+    default=DEFAULT_MAX_IN_FLIGHT,
+    type=int,
+    help='Specify the maximum number of bulk requests sent to Elastic Search at the same time, default to be 4'
+)
+@click.option(
+    '--cache_dir',
+    default="",
+    help='Specify a folder to keep a local copy of the specimen records, which is reused by later runs '
+         'as long as the specimen index is unchanged. If not provided, then the records are always read from ES'
+)
+@click.option(
+    '--clean_dry_run',
+    default="true",
+    help='Specify whether to only report the documents not written during this run (true) '
+         f'or delete them (false), nothing is deleted when more than {DEFAULT_MAX_UNSEEN_RATIO:.0%} of the '
+         f'documents would go'
+)
 # TODO check single or double quotes
-def main(es_hosts: str, es_index_prefix: str, to_es: str):
+def main(es_hosts: str, es_index_prefix: str, to_es: str, summary_log: str, bulk_requests: int, cache_dir: str,
+         clean_dry_run: str):
     """
     Main function that will import data from ena
     :param es_hosts: elasticsearch hosts where the data import into
     :param es_index_prefix: the index prefix points to a particular version of data
     :param to_es: determine whether to output log to Elasticsearch (True) or terminal (False, printing)
+    :param summary_log: determine whether to store only the aggregated import log (True) or per record (False)
+    :param bulk_requests: the maximum number of bulk requests sent at the same time
+    :param cache_dir: the folder to keep the local copy of the specimen records, empty to disable the local copy
+    :param clean_dry_run: determine whether to only report (True) or delete (False) the documents not written
     :return:
     """
     global to_es_flag
     # initialize ES first as needed to do logging
     hosts = es_hosts.split(";")
     es = Elasticsearch(hosts)
+    bulk_indexer = ParallelBulkIndexer(es, max_in_flight=bulk_requests, dead_letter=DeadLetterQueue())
 
     if to_es.lower() == 'false':
         to_es_flag = False
@@ -64,6 +99,12 @@ def main(es_hosts: str, es_index_prefix: str, to_es: str):
     else:
         print('to_es parameter can only accept value of true or false')
         exit(1)
+    if summary_log.lower() not in ('true', 'false'):
+        print('summary_log parameter can only accept value of true or false')
+        exit(1)
+    if clean_dry_run.lower() not in ('true', 'false'):
+        print('clean_dry_run parameter can only accept value of true or false')
+        exit(1)
 
     write_system_log(es, 'import_ena', 'info', get_line_number(), 'Command line parameters', to_es_flag)
     write_system_log(es, 'import_ena', 'info', get_line_number(), f'Hosts: {str(hosts)}', to_es_flag)
@@ -71,10 +112,16 @@ def main(es_hosts: str, es_index_prefix: str, to_es: str):
     es_index_prefix = remove_underscore_from_end_prefix(es_index_prefix)
     if es_index_prefix:
         write_system_log(es, 'import_ena', 'info', get_line_number(), f'Index prefix: {es_index_prefix}', to_es_flag)
+    log_writer = ImportLogWriter(bulk_indexer, es_index_prefix, 'import_ena', summary_log.lower() == 'true')
+    # unchanged documents are skipped, only documents from the FAANG data portal are tracked here
+    # as the legacy ones in the same indices are managed by import_from_ena_legacy
+    bulk_indexer.track_changes(f'{es_index_prefix}_experiment', {'exists': {'field': 'project'}})
+    bulk_indexer.track_changes(f'{es_index_prefix}_file', {'exists': {'field': 'secondaryProject'}})
+    bulk_indexer.track_changes(f'{es_index_prefix}_dataset', {'exists': {'field': 'secondaryProject'}})
 
     write_system_log(es, 'import_ena', 'info', get_line_number(), f'Get current specimens stored in the corresponding '
                                                                   f'ES index {es_index_prefix}_specimen', to_es_flag)
-    biosample_ids = get_all_specimen_ids(hosts[0], es_index_prefix)
+    biosample_ids = get_all_specimen_ids(hosts[0], es_index_prefix, cache_dir)
 
     if not biosample_ids:
         write_system_log(es, 'import_ena', 'error', get_line_number(),
@@ -361,7 +408,7 @@ def main(es_hosts: str, es_index_prefix: str, to_es: str):
                         if not converted_control_experiment:
                             msg = f'given control experiment value {original_control_experiment} could not ' \
                                   f'be found with the same study {dataset_id} for experiment {exp_id}'
-                            insert_es_log(es, es_index_prefix, 'experiment', exp_id, 'error', msg)
+                            insert_es_log(es, es_index_prefix, 'experiment', exp_id, 'error', msg, log_writer)
                             write_system_log(es, 'import_ena', 'error', get_line_number(), msg, to_es_flag)
                             continue
                         section_info['controlExperiment'] = converted_control_experiment
@@ -581,7 +628,7 @@ def main(es_hosts: str, es_index_prefix: str, to_es: str):
                 if exp_es['standardMet'] == STANDARD_FAANG:
                     exp_es['versionLastStandardMet'] = ruleset_version
                 body = json.dumps(exp_es)
-                insert_into_es(es, es_index_prefix, 'experiment', exp_id, body)
+                insert_into_es(es, es_index_prefix, 'experiment', exp_id, body, bulk_indexer)
 
                 status = validation_results[ruleset]['detail'][exp_id]['status']
                 error_messages.append(f"{status}\t{ruleset}\t"
@@ -589,7 +636,8 @@ def main(es_hosts: str, es_index_prefix: str, to_es: str):
 
                 # index into ES so break the loop
                 break
-        insert_es_log(es, es_index_prefix, 'experiment', exp_id, status, ";".join(error_messages))
+        insert_es_log(es, es_index_prefix, 'experiment', exp_id, status, ";".join(error_messages),
+                      log_writer)
 
     write_system_log(es, 'import_ena', 'info', get_line_number(), 'Start to import Files', to_es_flag)
     for file_id in files_dict.keys():
@@ -600,7 +648,7 @@ def main(es_hosts: str, es_index_prefix: str, to_es: str):
             continue
         es_file_doc['experiment']['standardMet'] = exp_validation[exp_id]
         body = json.dumps(es_file_doc)
-        insert_into_es(es, es_index_prefix, 'file', file_id, body)
+        insert_into_es(es, es_index_prefix, 'file', file_id, body, bulk_indexer)
         indexed_files[file_id] = 1
 
     write_system_log(es, 'import_ena', 'info', get_line_number(), 'Start to import Datasets', to_es_flag)
@@ -632,7 +680,7 @@ def main(es_hosts: str, es_index_prefix: str, to_es: str):
                 missing_specimens = datasets_missing_specimens[dataset_id]
                 msg = msg + "; specimens " + ",".join(missing_specimens) + " missing"
                 datasets_missing_specimens.pop(dataset_id)
-            insert_es_log(es, es_index_prefix, 'dataset', dataset_id, 'warning', msg)
+            insert_es_log(es, es_index_prefix, 'dataset', dataset_id, 'warning', msg, log_writer)
             write_system_log(es, 'import_ena', 'warning', get_line_number(),
                              f'dataset {dataset_id} has no valid experiments, skipped.', to_es_flag)
             continue
@@ -669,7 +717,7 @@ def main(es_hosts: str, es_index_prefix: str, to_es: str):
         es_doc_dataset['secondaryProject'] = list(datasets['tmp'][dataset_id]['secondaryProject'].keys())
         es_doc_dataset['archive'] = sorted(list(datasets['tmp'][dataset_id]['archive'].keys()))
         body = json.dumps(es_doc_dataset)
-        insert_into_es(es, es_index_prefix, 'dataset', dataset_id, body)
+        insert_into_es(es, es_index_prefix, 'dataset', dataset_id, body, bulk_indexer)
     with open('ena_not_in_biosample.txt', 'a') as w:
         for study in new_errors:
             tmp = new_errors[study]
@@ -677,14 +725,27 @@ def main(es_hosts: str, es_index_prefix: str, to_es: str):
                 write_system_log(es, 'import_ena', 'warning', get_line_number(),
                                  f'{biosample} from {study} does not exist in BioSamples at the moment', to_es_flag)
                 insert_es_log(es, es_index_prefix, 'specimen', biosample, 'warning',
-                              f'referenced in {study} but not found in BioSamples')
+                              f'referenced in {study} but not found in BioSamples', log_writer)
                 w.write(f"{study}\t{biosample}\n")
 
     for dataset_id in datasets_missing_specimens:
         missing_specimens = datasets_missing_specimens[dataset_id]
         msg = "specimens " + ",".join(missing_specimens) + " missing"
-        insert_es_log(es, es_index_prefix, 'dataset', dataset_id, 'warning', msg)
+        insert_es_log(es, es_index_prefix, 'dataset', dataset_id, 'warning', msg, log_writer)
 
+    for index, unseen in bulk_indexer.delete_unseen(clean_dry_run.lower() == 'true').items():
+        if unseen['unseen']:
+            write_system_log(es, 'import_ena', 'warning', get_line_number(),
+                             f"{unseen['unseen']} documents of {index} not written during the run, "
+                             f"deleted: {unseen['deleted']}, e.g. {unseen['ids']}", to_es_flag)
+    log_writer.close()
+    bulk_indexer.close()
+    write_system_log(es, 'import_ena', 'info', get_line_number(),
+                     f'Import log counts: {log_writer.get_counts()}, duplicated entries: {log_writer.duplicates}',
+                     to_es_flag)
+    write_system_log(es, 'import_ena', 'info', get_line_number(),
+                     f'Bulk indexing finished: {bulk_indexer.report()}', to_es_flag)
+    write_metrics_summary(es, 'import_ena', to_es_flag)
     write_system_log(es, 'import_ena', 'info', get_line_number(), 'Finish importing ena', to_es_flag)
 
 
@@ -701,18 +762,18 @@ def get_ena_data(es):
     return response
 
 
-def get_all_specimen_ids(host, es_index_prefix):
+def get_all_specimen_ids(host, es_index_prefix, cache_dir=None) -> SpecimenStore:
     """
-    This function return dict with all information from the corresponding specimens
-    :return: A dict with keys as BioSamples id and values as the data stored in ES
+    This function return the fields needed by the import from the corresponding specimens
+    :param host: the Elastic Search server address
+    :param es_index_prefix: the index prefix points to a particular version of data
+    :param cache_dir: optional folder to keep the local copy of the specimen records
+    :return: A dict-like store with keys as BioSamples id and values as the specimen records
     """
     if not host.endswith(":9200"):
         host = host + ":9200"
-    results = dict()
-    url = f'http://{host}/{es_index_prefix}_specimen/_search?size=100000'
-    response = requests.get(url).json()
-    for item in response['hits']['hits']:
-        results[item['_id']] = item['_source']
+    results = SpecimenStore()
+    results.load(Elasticsearch(host), f'{es_index_prefix}_specimen', cache_dir)
     return results
 
 
@@ -10,18 +10,23 @@ from elasticsearch import Elasticsearch
 import constants
 from typing import Set, Dict, List
 from utils import determine_file_and_source, check_existsence, remove_underscore_from_end_prefix, \
-    write_system_log, get_line_number, insert_into_es, get_record_ids, generate_ena_api_endpoint
+    write_system_log, get_line_number, insert_into_es, get_record_ids, generate_ena_api_endpoint, write_metrics_summary
 import re
 import validate_experiment_record
 import sys
 import json
 import requests
 from misc import convert_readable, parse_date
+from bulk_indexer import ParallelBulkIndexer, DEFAULT_MAX_IN_FLIGHT, DEFAULT_MAX_UNSEEN_RATIO
+from dead_letter import DeadLetterQueue
+from specimen_store import SpecimenStore
+from elasticsearch.exceptions import TransportError
 
 SCRIPT_NAME = 'import_ena_legacy'
 
 to_es_flag = True
 es = None
+bulk_indexer = None
 
 # in FAANG ruleset each technology has mandatory fields in the corresponding section, which is not expected in the
 # general ENA datasets, so only validate against Legacy standard
@@ -29,8 +34,8 @@ RULESETS = ["FAANG Legacy Experiments"]
 
 SPECIES_TAXONOMY_LIST = list(SPECIES_DICT.keys())
 
-# holds all sample records from ES
-BIOSAMPLES_RECORDS = dict()
+# holds the fields needed from all sample records from ES
+BIOSAMPLES_RECORDS = SpecimenStore()
 # holds the material information for all records encountered (retrieve_biosample_record function)
 # keys are biosamples accessions and values are dicts which have three sub keys
 # confirmed (boolean), material (dict), accession (str)
@@ -61,22 +66,21 @@ FIELD_LIST = [
 ]
 
 
-def get_biosamples_records_from_es(host, es_index_prefix, es_type):
+def get_biosamples_records_from_es(host, es_index_prefix, es_type, cache_dir=None):
     """
-    Get existing biosample records from elastic search
+    Get the fields needed from existing biosample records from elastic search
     :param host: elasticsearch python instance
     :param es_index_prefix: the name of the index set
     :param es_type: type of record, either organism or specimen
+    :param cache_dir: optional folder to keep the local copy of the records
     """
-    global BIOSAMPLES_RECORDS
-    url = f'http://{host}/{es_index_prefix}_{es_type}/_search?size=100000'
-    response = requests.get(url).json()
-    if 'hits' not in response:
+    index = f'{es_index_prefix}_{es_type}'
+    try:
+        BIOSAMPLES_RECORDS.load(Elasticsearch(host), index, cache_dir)
+    except TransportError as e:
         write_system_log(es, SCRIPT_NAME, 'error', get_line_number(),
-                         f'No data retrieved from {url}, please double check whether the URL is correct', to_es_flag)
-        return
-    for item in response['hits']['hits']:
-        BIOSAMPLES_RECORDS[item['_id']] = item['_source']
+                         f'No data retrieved from {index}, please double check whether the index exists: {e}',
+                         to_es_flag)
 
 
 def retrieve_biosamples_record(es_index_prefix, biosample_id):
@@ -313,7 +317,7 @@ def retrieve_biosamples_record(es_index_prefix, biosample_id):
 
     # expected to fail validation (Legacy basic), so no need to carry out
     body = json.dumps(es_doc)
-    insert_into_es(es, es_index_prefix, es_type, biosample_id, body)
+    insert_into_es(es, es_index_prefix, es_type, biosample_id, body, bulk_indexer)
 
     BIOSAMPLES_RECORDS[biosample_id] = es_doc
     return status
@@ -386,12 +390,34 @@ def get_field_name(data, original_key, alternative_value):
     help='Specify how to deal with the system log either writing to es or printing out. '
          'It only allows two values: true (to es) or false (print to the terminal)'
 )
-def main(es_hosts, es_index_prefix, to_es: str):
+@click.option(
+    '--bulk_requests',
+    default=DEFAULT_MAX_IN_FLIGHT,
+    type=int,
+    help='Specify the maximum number of bulk requests sent to Elastic Search at the same time, default to be 4'
+)
+@click.option(
+    '--cache_dir',
+    default="",
+    help='Specify a folder to keep a local copy of the organism and specimen records, which is reused by later runs '
+         'as long as the indices are unchanged. If not provided, then the records are always read from ES'
+)
+@click.option(
+    '--clean_dry_run',
+    default="true",
+    help='Specify whether to only report the documents not written during this run (true) '
+         f'or delete them (false), nothing is deleted when more than {DEFAULT_MAX_UNSEEN_RATIO:.0%} of the '
+         f'documents would go'
+)
+def main(es_hosts, es_index_prefix, to_es: str, bulk_requests: int, cache_dir: str, clean_dry_run: str):
     """
     Main function that will import legacy data (not FAANG labelled) from ena
     :param es_hosts: elasticsearch hosts where the data import into
     :param es_index_prefix: the index prefix points to a particular version of data
     :param to_es: determine whether to output log to Elasticsearch (True) or terminal (False, printing)
+    :param bulk_requests: the maximum number of bulk requests sent at the same time
+    :param cache_dir: the folder to keep the local copy of the sample records, empty to disable the local copy
+    :param clean_dry_run: determine whether to only report (True) or delete (False) the documents not written
     """
     global to_es_flag
     if to_es.lower() == 'false':
@@ -401,19 +427,32 @@ def main(es_hosts, es_index_prefix, to_es: str):
     else:
         print('to_es parameter can only accept value of true or false')
         exit(1)
+    if clean_dry_run.lower() not in ('true', 'false'):
+        print('clean_dry_run parameter can only accept value of true or false')
+        exit(1)
 
     global es
+    global bulk_indexer
     hosts = es_hosts.split(";")
     es = Elasticsearch(hosts)
+    bulk_indexer = ParallelBulkIndexer(es, max_in_flight=bulk_requests, dead_letter=DeadLetterQueue())
     write_system_log(es, SCRIPT_NAME, 'info', get_line_number(), 'Start importing ena legacy', to_es_flag)
     write_system_log(es, SCRIPT_NAME, 'info', get_line_number(), 'Command line parameters', to_es_flag)
     write_system_log(es, SCRIPT_NAME, 'info', get_line_number(), f'Hosts: {str(hosts)}', to_es_flag)
     es_index_prefix = remove_underscore_from_end_prefix(es_index_prefix)
     if es_index_prefix:
         write_system_log(es, SCRIPT_NAME, 'info', get_line_number(), f'Index_prefix: {es_index_prefix}', to_es_flag)
-
-    get_biosamples_records_from_es(hosts[0], es_index_prefix, 'organism')
-    get_biosamples_records_from_es(hosts[0], es_index_prefix, 'specimen')
+    # unchanged documents are skipped, only legacy documents are tracked here
+    # as the ones from the FAANG data portal in the same indices are managed by import_from_ena
+    bulk_indexer.track_changes(f'{es_index_prefix}_experiment',
+                               {'bool': {'must_not': {'exists': {'field': 'project'}}}})
+    bulk_indexer.track_changes(f'{es_index_prefix}_file',
+                               {'bool': {'must_not': {'exists': {'field': 'secondaryProject'}}}})
+    bulk_indexer.track_changes(f'{es_index_prefix}_dataset',
+                               {'bool': {'must_not': {'exists': {'field': 'secondaryProject'}}}})
+
+    get_biosamples_records_from_es(hosts[0], es_index_prefix, 'organism', cache_dir)
+    get_biosamples_records_from_es(hosts[0], es_index_prefix, 'specimen', cache_dir)
     write_system_log(es, SCRIPT_NAME, 'info', get_line_number(),
                      f'There are {len(BIOSAMPLES_RECORDS)} sample records in the ES', to_es_flag)
     if not BIOSAMPLES_RECORDS:
@@ -514,6 +553,8 @@ def main(es_hosts, es_index_prefix, to_es: str):
                 sizes = record[f"{file_type}_bytes"].split(";")
             except KeyError:
                 print(f"category {category} record {record}")
+                bulk_indexer.close()
+                write_metrics_summary(es, SCRIPT_NAME, to_es_flag)
                 exit()
 
             if len(files) != len(sizes):
@@ -637,6 +678,8 @@ def main(es_hosts, es_index_prefix, to_es: str):
 
     if not datasets:
         write_system_log(es, SCRIPT_NAME, 'info', get_line_number(), 'No datasets have been found', to_es_flag)
+        bulk_indexer.close()
+        write_metrics_summary(es, SCRIPT_NAME, to_es_flag)
         exit()
 
     write_system_log(es, SCRIPT_NAME, 'info', get_line_number(), 'The dataset list:', to_es_flag)
@@ -669,7 +712,7 @@ def main(es_hosts, es_index_prefix, to_es: str):
                 exp_validation[exp_id] = STANDARDS[ruleset]
                 exp_es['standardMet'] = STANDARDS[ruleset]
                 body = json.dumps(exp_es)
-                insert_into_es(es, es_index_prefix, 'experiment', exp_id, body)
+                insert_into_es(es, es_index_prefix, 'experiment', exp_id, body, bulk_indexer)
                 # index into ES so break the loop
                 break
     write_system_log(es, SCRIPT_NAME, 'info', get_line_number(), 'finishing indexing experiments', to_es_flag)
@@ -683,7 +726,7 @@ def main(es_hosts, es_index_prefix, to_es: str):
             continue
         es_file_doc['experiment']['standardMet'] = exp_validation[exp_id]
         body = json.dumps(es_file_doc)
-        insert_into_es(es, es_index_prefix, 'file', file_id, body)
+        insert_into_es(es, es_index_prefix, 'file', file_id, body, bulk_indexer)
         indexed_files[file_id] = 1
     write_system_log(es, SCRIPT_NAME, 'info', get_line_number(), 'finishing indexing files', to_es_flag)
 
@@ -717,7 +760,7 @@ def main(es_hosts, es_index_prefix, to_es: str):
         specimen_set = datasets['tmp'][dataset_id]['specimen']
         species = dict()
         specimens_list = list()
-        for specimen in specimen_set:
+        for specimen in sorted(specimen_set):
             if specimen not in BIOSAMPLES_RECORDS:
                 write_system_log(es, SCRIPT_NAME, 'warning', get_line_number(),
                                  f'BioSamples record {specimen} required by dataset {dataset_id} could not be found',
@@ -749,12 +792,21 @@ def main(es_hosts, es_index_prefix, to_es: str):
         es_doc_dataset['experiment'] = list(only_valid_exps.values())
         es_doc_dataset['assayType'] = list(experiment_type.keys())
         es_doc_dataset['tech'] = list(tech_type.keys())
-        es_doc_dataset['instrument'] = list(datasets['tmp'][dataset_id]['instrument'])
+        es_doc_dataset['instrument'] = sorted(list(datasets['tmp'][dataset_id]['instrument']))
         es_doc_dataset['archive'] = sorted(list(datasets['tmp'][dataset_id]['archive']))
         body = json.dumps(es_doc_dataset)
-        insert_into_es(es, es_index_prefix, 'dataset', dataset_id, body)
+        insert_into_es(es, es_index_prefix, 'dataset', dataset_id, body, bulk_indexer)
+    for index, unseen in bulk_indexer.delete_unseen(clean_dry_run.lower() == 'true').items():
+        if unseen['unseen']:
+            write_system_log(es, SCRIPT_NAME, 'warning', get_line_number(),
+                             f"{unseen['unseen']} documents of {index} not written during the run, "
+                             f"deleted: {unseen['deleted']}, e.g. {unseen['ids']}", to_es_flag)
+    bulk_indexer.close()
     write_system_log(es, SCRIPT_NAME, 'warning', get_line_number(),
                      f'finishing indexing datasets', to_es_flag)
+    write_system_log(es, SCRIPT_NAME, 'info', get_line_number(),
+                     f'Bulk indexing finished: {bulk_indexer.report()}', to_es_flag)
+    write_metrics_summary(es, SCRIPT_NAME, to_es_flag)
     write_system_log(es, SCRIPT_NAME, 'info', get_line_number(), 'Finish importing ena legacy', to_es_flag)
 
 
@@ -3,6 +3,7 @@ import requests
 from bs4 import BeautifulSoup
 from elasticsearch import Elasticsearch, RequestsHttpConnection
 from constants import *
+from document_lookup import DocumentLookup
 
 ES_USER = os.getenv('ES_USER')
 ES_PASSWORD = os.getenv('ES_PASSWORD')
@@ -25,11 +26,16 @@ protocols_url = {
 for index in protocols_url:
     count = 0
     urls = protocols_url[index]
+    lookup = DocumentLookup(es, index)
     for url in urls:
         r = requests.get(url)
         html_text = r.text
         soup = BeautifulSoup(html_text, 'html.parser')
-        for link in soup.find_all('a'):
+        links = soup.find_all('a')
+        if index == 'protocol_samples' or index == 'protocol_analysis':
+            # check the existence of all protocols of the page with a few _mget requests
+            lookup.prefetch(requests.utils.unquote(link.get('href')) for link in links if link.get('href') != '../')
+        for link in links:
             protocol_file = link.get('href')
             if protocol_file != '../':
                 key = requests.utils.unquote(protocol_file)
@@ -40,7 +46,7 @@ for index in protocols_url:
                 else:
                     protocol_name = requests.utils.unquote(" ".join(parsed[1:-1]))
                 if index == 'protocol_samples' or index == 'protocol_analysis':
-                    if not es.exists(index, id=key):
+                    if not lookup.exists(key):
                         count += 1
                         # Parsing university name
                         if parsed[0] == 'WUR':
@@ -63,6 +69,7 @@ for index in protocols_url:
                         elif index == 'protocol_analysis':
                             protocol_data["analyses"] = []
                         es.create(index, id=key, body=protocol_data)
+                        lookup.set(key, protocol_data)
                 else:
                     r = requests.get(f"https://api.faang.org/data/protocol_files/_search/?search={protocol_file}").json()
                     if (r['hits']['total']['value'] == 0):
@@ -7,6 +7,7 @@ import os
 import click
 from elasticsearch import Elasticsearch
 from constants import TYPES
+from build_profile import BuildProfile
 
 
 # use click library to get command line parameters
@@ -27,7 +28,13 @@ from constants import TYPES
     default='',
     help='Indicate the type of data to be initialized only'
 )
-def main(es_host, es_index_prefix, delete_only, target_type) -> None:
+@click.option(
+    '--build_profile',
+    default=False,
+    help='Indicate whether to apply the bulk-build settings (no refresh, no replicas) to the created indices, '
+         'run build_profile.py after all imports finish to restore the production settings'
+)
+def main(es_host, es_index_prefix, delete_only, target_type, build_profile) -> None:
     """
     Script to initialize/delete a build of indices determined by parameter es_index_prefix on Elastic Search server
     if parameter delete_only is true, only delete any existing indices matching the prefix pattern,
@@ -37,6 +44,7 @@ def main(es_host, es_index_prefix, delete_only, target_type) -> None:
     :param es_host: Elastic search host
     :param es_index_prefix: 
     :param delete_only: indicates whether it just deletes existing indices (True) or initialize as well (False)
+    :param build_profile: indicates whether to apply the bulk-build settings to the created indices
     :return:
     """
     # check mandatory parameter
@@ -72,6 +80,10 @@ def main(es_host, es_index_prefix, delete_only, target_type) -> None:
         os.system(cmd)
         print()
 
+    if build_profile and not delete_only:
+        types = [target_type] if target_type else TYPES
+        BuildProfile(es, es_index_prefix, types).start()
+
 
 if __name__ == "__main__":
     main()
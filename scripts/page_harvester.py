@@ -0,0 +1,165 @@
+"""
+Harvest a paged listing of the BioSamples API, e.g. all samples labelled with project FAANG
+The pages are followed through the next link of each page, the cursor keeps the listing stable while it is harvested,
+so the pages are downloaded one after the other. The next page is downloaded while the pages already downloaded are
+parsed by a pool of threads and the parsed pages are handed over in their order.
+Optionally each downloaded page is kept in a folder for the listing and the day, so an interrupted harvest could be
+resumed from the pages already downloaded. The folder is removed once the harvest finished, the folders of the other
+days are removed when a harvest starts
+"""
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from collections import deque
+from datetime import date
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterator, Optional, Tuple
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+DEFAULT_PAGES_IN_FLIGHT = 4
+DEFAULT_TIMEOUT = 300
+DEFAULT_MAX_RETRIES = 3
+
+
+def create_session(pool_size=DEFAULT_PAGES_IN_FLIGHT, max_retries=DEFAULT_MAX_RETRIES) -> requests.Session:
+    """
+    :param pool_size: the number of connections kept open to each host
+    :param max_retries: the number of retries of the failed requests, with exponential backoff
+    :return: the HTTP session
+    """
+    session = requests.Session()
+    retry = Retry(total=max_retries, backoff_factor=1, status_forcelist=(429, 500, 502, 503, 504))
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+class PageHarvester:
+    def __init__(self, url, parse: Optional[Callable[[Dict], object]] = None, max_in_flight=DEFAULT_PAGES_IN_FLIGHT,
+                 resume_dir: Optional[str] = None, session: Optional[requests.Session] = None,
+                 timeout=DEFAULT_TIMEOUT):
+        """
+        :param url: the url of the first page of the listing, the other pages are reached by the next links
+        :param parse: called with the JSON of each page in a worker thread, default to return the JSON as is
+        :param max_in_flight: the maximum number of pages being parsed or waiting to be handed over
+        :param resume_dir: optional folder to keep the downloaded pages in
+        :param session: the HTTP session, a pooled session is created by default
+        :param timeout: the number of seconds to wait for one page
+        """
+        self.url = url
+        self.parse = parse if parse else lambda page: page
+        self.max_in_flight = max_in_flight
+        self.resume_dir = resume_dir
+        self.session = session if session else create_session(max_in_flight)
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        # the number of records announced by the first page and the number of records in all pages downloaded
+        self.stats = {'pages': 0, 'resumed': 0, 'expected': None, 'records': 0, 'seconds': 0.0}
+
+    def pages(self) -> Iterator[Tuple[int, object]]:
+        """
+        :return: generator of tuples of the page number and the parsed page, in the order of the pages
+        """
+        started = time.time()
+        self.remove_old_spools()
+        # one thread downloads the next page while the others parse
+        executor = ThreadPoolExecutor(max_workers=self.max_in_flight + 1)
+        futures = deque()
+        page_number = 0
+        download = executor.submit(self.load, page_number, self.url)
+        try:
+            while download is not None or futures:
+                if futures and (download is None or futures[0][1].done() or len(futures) >= self.max_in_flight):
+                    number, future = futures.popleft()
+                    yield number, future.result()
+                    continue
+                page = download.result()
+                futures.append((page_number, executor.submit(self.parse, page)))
+                next_url = page.get('_links', {}).get('next', {}).get('href')
+                page_number += 1
+                download = executor.submit(self.load, page_number, next_url) if next_url else None
+        finally:
+            if download is not None:
+                download.cancel()
+            for _, future in futures:
+                future.cancel()
+            executor.shutdown(wait=True)
+        self.stats['seconds'] = round(time.time() - started, 1)
+        self.clear()
+
+    def is_complete(self) -> bool:
+        """
+        :return: whether the pages harvested hold at least the number of records announced by the first page
+        """
+        return self.stats['expected'] is None or self.stats['records'] >= self.stats['expected']
+
+    def load(self, page_number: int, url: str) -> Dict:
+        """
+        Download one page, or read it from the resume folder if downloaded before
+        :param page_number: the number of the page, starting from 0
+        :param url: the url of the page
+        :return: the JSON of the page
+        """
+        path = self.get_page_path(page_number)
+        if path and os.path.exists(path):
+            with gzip.open(path, 'rt') as f:
+                page = json.load(f)
+            with self.lock:
+                self.stats['resumed'] += 1
+        else:
+            response = self.session.get(url, timeout=self.timeout)
+            response.raise_for_status()
+            page = response.json()
+            if path:
+                with gzip.open(f'{path}.tmp', 'wt') as f:
+                    json.dump(page, f)
+                os.replace(f'{path}.tmp', path)
+        with self.lock:
+            self.stats['pages'] += 1
+            self.stats['records'] += sum(len(records) for records in page.get('_embedded', {}).values())
+            if page_number == 0:
+                self.stats['expected'] = page.get('page', {}).get('totalElements')
+        return page
+
+    def get_spool_dir(self) -> Optional[str]:
+        """
+        :return: the folder keeping the pages of the listing downloaded today, None if the pages are not kept
+        """
+        if not self.resume_dir:
+            return None
+        key = hashlib.sha1(self.url.encode()).hexdigest()[:12]
+        return os.path.join(self.resume_dir, f"pages_{key}_{date.today().strftime('%Y-%m-%d')}")
+
+    def get_page_path(self, page_number: int) -> Optional[str]:
+        spool_dir = self.get_spool_dir()
+        if not spool_dir:
+            return None
+        os.makedirs(spool_dir, exist_ok=True)
+        return os.path.join(spool_dir, f'page_{page_number}.json.gz')
+
+    def remove_old_spools(self) -> None:
+        """
+        Remove the pages of the listing downloaded on the other days, the listing could have changed since
+        """
+        spool_dir = self.get_spool_dir()
+        if not spool_dir or not os.path.isdir(self.resume_dir):
+            return
+        prefix = os.path.basename(spool_dir).rsplit('_', 1)[0]
+        for folder in os.listdir(self.resume_dir):
+            if folder.startswith(f'{prefix}_') and folder != os.path.basename(spool_dir):
+                shutil.rmtree(os.path.join(self.resume_dir, folder), ignore_errors=True)
+
+    def clear(self) -> None:
+        """
+        Remove the downloaded pages once the harvest finished, the next harvest starts from scratch
+        """
+        spool_dir = self.get_spool_dir()
+        if spool_dir and os.path.isdir(spool_dir):
+            shutil.rmtree(spool_dir, ignore_errors=True)
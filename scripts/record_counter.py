@@ -0,0 +1,95 @@
+"""
+Count the records of the indices with the _count API, which returns the same response from Elasticsearch 6 and 7
+and from the on-prem and the elastic cloud clusters, unlike hits.total of _search which became an object in
+Elasticsearch 7. The counts are kept for the lifetime of the run, so repeated questions cost one request.
+The counts are forgotten whenever documents are written into the index, also when they were counted through an alias
+"""
+import json
+import threading
+from typing import Dict, Optional, Set
+from constants import STANDARD_FAANG
+from es_reader import DEFAULT_PAGE_SIZE, DEFAULT_SLICES
+
+# the query selecting the records meeting the FAANG standard
+FAANG_QUERY = {'term': {'standardMet': STANDARD_FAANG}}
+
+
+class RecordCounter:
+    """
+    Thread-safe cache of the record counts, keyed by the cluster, the index and the query
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts: Dict[tuple, int] = dict()
+        # the concrete indices behind the name of each count, so writing into an index forgets the counts of its aliases
+        self.indices: Dict[tuple, Set[str]] = dict()
+        self.requests = 0
+
+    def count(self, es, index, query: Optional[Dict] = None) -> int:
+        """
+        :param es: elasticsearch python library instance
+        :param index: the name of the index or the alias
+        :param query: optional query to count only the matching records
+        :return: the number of records
+        """
+        key = (get_cluster_key(es), index, json.dumps(query, sort_keys=True))
+        with self.lock:
+            if key in self.counts:
+                return self.counts[key]
+        body = {'query': query} if query else None
+        count = es.count(index=index, body=body)['count']
+        indices = resolve_indices(es, index)
+        with self.lock:
+            self.counts[key] = count
+            self.indices[key] = indices
+            self.requests += 1
+        return count
+
+    def invalidate(self, index=None) -> None:
+        """
+        Forget the counts after records were written
+        :param index: the index whose counts are forgotten together with the counts of its aliases,
+        None to forget all counts
+        """
+        with self.lock:
+            if index is None:
+                self.counts.clear()
+                self.indices.clear()
+                return
+            for key in [key for key in self.counts if key[1] == index or index in self.indices.get(key, ())]:
+                del self.counts[key]
+                self.indices.pop(key, None)
+
+
+def resolve_indices(es, index) -> Set[str]:
+    """
+    :param es: elasticsearch python library instance
+    :param index: the name of the index or the alias
+    :return: the name together with the concrete indices it points to
+    """
+    return set(es.indices.get_alias(index=index).keys()) | {index}
+
+
+def get_cluster_key(es) -> str:
+    """
+    :param es: elasticsearch python library instance
+    :return: the hosts the instance connects to, so different instances of the same cluster share the counts
+    """
+    hosts = getattr(getattr(es, 'transport', None), 'hosts', None)
+    if hosts is None:
+        return str(id(es))
+    return json.dumps(hosts, sort_keys=True, default=str)
+
+
+def get_slices(count: int, page_size=DEFAULT_PAGE_SIZE, max_slices=DEFAULT_SLICES) -> int:
+    """
+    :param count: the number of records to be read
+    :param page_size: the number of hits per page
+    :param max_slices: the number of slices used for large indices
+    :return: the number of slices worth using, small indices are read in one slice
+    """
+    return max(1, min(max_slices, -(-count // page_size)))
+
+
+# shared by all scripts of the run
+RECORD_COUNTER = RecordCounter()
@@ -0,0 +1,104 @@
+"""
+Synchronise the local copies of the BioSamples records in one pass
+Each record is requested with a conditional GET carrying the etag of the local copy in If-None-Match: BioSamples
+answers 304 without body for the unchanged records and the record with its new etag for the others. Retrieving all
+etags first (get_all_etags.py) and then downloading the changed records costs two requests per changed record,
+here every record costs one request
+"""
+import aiohttp
+import asyncio
+import json
+import random
+import time
+from typing import Dict, Iterable, List, Optional
+from get_all_etags import SAMPLE_API, MAX_CONNECTIONS, MAX_RETRIES, MAX_BACKOFF, RETRY_STATUSES, \
+    REQUEST_TIMEOUT, PROGRESS_INTERVAL
+
+# the same url as the etag harvest, the etags recorded by both are comparable
+RECORD_API = SAMPLE_API
+
+
+class RecordSynchroniser:
+    def __init__(self, etags: Dict[str, str], max_connections=MAX_CONNECTIONS, url=RECORD_API):
+        """
+        :param etags: the etags of the local copies keyed by accession
+        :param max_connections: the maximum number of concurrent requests
+        :param url: the url of one record, formatted with the accession
+        """
+        self.etags = etags
+        self.max_connections = max_connections
+        self.url = url
+        # the records new or changed since the local copies, keyed by accession
+        self.records: Dict[str, Dict] = dict()
+        # the current etags of all accessions synchronised
+        self.current_etags: Dict[str, str] = dict()
+        self.unchanged: List[str] = list()
+        # the http status of the accessions which could not be synchronised, None for connection errors
+        self.failed: Dict[str, Optional[int]] = dict()
+        self.stats = {'requests': 0, 'not_modified': 0, 'modified': 0, 'failed': 0, 'bytes': 0,
+                      'requests_saved': 0, 'bytes_saved': 0, 'seconds': 0.0}
+
+    def run(self, ids: Iterable[str]) -> None:
+        """
+        Synchronise the records of the accessions, the results are kept in records, unchanged and failed
+        :param ids: the accessions
+        """
+        started = time.time()
+        asyncio.get_event_loop().run_until_complete(self.fetch_all(sorted(set(ids))))
+        self.stats['seconds'] = round(time.time() - started, 1)
+
+    async def fetch_all(self, ids: List[str]) -> None:
+        semaphore = asyncio.Semaphore(self.max_connections)
+        progress = {'done': 0, 'total': len(ids), 'started': time.time()}
+        connector = aiohttp.TCPConnector(limit=self.max_connections)
+        timeout = aiohttp.ClientTimeout(total=REQUEST_TIMEOUT)
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            await asyncio.gather(*[self.fetch_record(session, semaphore, my_id, progress) for my_id in ids])
+
+    async def fetch_record(self, session, semaphore, my_id: str, progress: Dict) -> None:
+        """
+        Synchronise one record, the request is retried on connection errors and temporary failures
+        """
+        headers = {'If-None-Match': self.etags[my_id]} if self.etags.get(my_id) else dict()
+        status = None
+        for attempt in range(MAX_RETRIES + 1):
+            if attempt:
+                # full jitter, so the retries of many accessions do not hit the server at the same moment
+                await asyncio.sleep(random.uniform(0, min(MAX_BACKOFF, 2 ** attempt)))
+            async with semaphore:
+                try:
+                    async with session.request('GET', self.url.format(my_id), headers=headers) as resp:
+                        status = resp.status
+                        self.stats['requests'] += 1
+                        if status == 200:
+                            body = await resp.read()
+                            etag = resp.headers.get('ETag')
+                            header_size = sum(len(key) + len(value) + 4 for key, value in resp.raw_headers)
+                except (aiohttp.ClientError, asyncio.TimeoutError):
+                    status = None
+                    continue
+            if status not in RETRY_STATUSES:
+                break
+        if status == 304:
+            self.unchanged.append(my_id)
+            self.current_etags[my_id] = self.etags[my_id]
+            self.stats['not_modified'] += 1
+        elif status == 200:
+            record = json.loads(body)
+            record['etag'] = etag
+            self.records[my_id] = record
+            if etag:
+                self.current_etags[my_id] = etag
+            self.stats['modified'] += 1
+            self.stats['bytes'] += len(body)
+            # the two-pass flow sends a HEAD request before downloading a changed record
+            self.stats['requests_saved'] += 1
+            self.stats['bytes_saved'] += header_size
+        else:
+            self.failed[my_id] = status
+            self.stats['failed'] += 1
+        progress['done'] += 1
+        if progress['done'] % PROGRESS_INTERVAL == 0:
+            elapsed = time.time() - progress['started']
+            print(f"Synchronised {progress['done']} of {progress['total']} records in {elapsed:.0f} seconds, "
+                  f"{progress['done'] / elapsed:.0f} per second")
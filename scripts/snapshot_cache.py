@@ -0,0 +1,213 @@
+"""
+Local snapshots of Elasticsearch indices shared by the scripts of one pipeline run
+The first script reading an index exports it into a folder holding one gzipped column file per top level field,
+later scripts read only the columns they need. A snapshot is used as long as the number of documents, the latest
+updateDate and the sequence numbers of the shards of the index are unchanged, otherwise it is exported again.
+Each export goes into its own folder named after the fingerprint, so concurrent scripts never replace a snapshot
+being read by another one.
+Snapshots are enabled by setting the environment variable ES_SNAPSHOT_DIR to the folder keeping them
+"""
+import gzip
+import hashlib
+import json
+import logging
+import os
+import shutil
+import uuid
+from typing import Dict, Iterator, List, Optional, Union
+from es_reader import iterate_hits, get_index_fingerprint, DEFAULT_PAGE_SIZE, DEFAULT_SLICES
+
+SNAPSHOT_DIR = os.getenv('ES_SNAPSHOT_DIR', '')
+ID_COLUMN = '_id'
+META_FILE = 'meta.json'
+# the line of the column files for the documents without the field, fields stored as null are written as null
+MISSING = "\n"
+# changed whenever the layout of the column files changes, so older snapshots are exported again
+SNAPSHOT_FORMAT = 2
+# the number of the latest snapshots kept for each index, older ones could still be read by a running script
+SNAPSHOTS_TO_KEEP = 2
+
+logger = logging.getLogger('snapshot_cache')
+
+
+class IndexSnapshot:
+    def __init__(self, es, index, snapshot_dir=SNAPSHOT_DIR):
+        """
+        :param es: elasticsearch python library instance
+        :param index: the name of the index or the alias, e.g. faang_build_1_specimen
+        :param snapshot_dir: the folder keeping the snapshots
+        """
+        self.es = es
+        self.index = index
+        self.path = os.path.join(snapshot_dir, index)
+
+    def get_fingerprint(self) -> Dict:
+        """
+        :return: the fingerprint of the index, including the concrete index names in case an alias is used
+        """
+        fingerprint = get_index_fingerprint(self.es, self.index)
+        fingerprint['indices'] = sorted(self.es.indices.get_alias(index=self.index).keys())
+        return fingerprint
+
+    def get_version_path(self, fingerprint: Dict) -> str:
+        """
+        :return: the folder of the snapshot taken with the fingerprint
+        """
+        key = {'fingerprint': fingerprint, 'format': SNAPSHOT_FORMAT}
+        digest = hashlib.sha1(json.dumps(key, sort_keys=True).encode()).hexdigest()[:16]
+        return os.path.join(self.path, digest)
+
+    def is_valid(self, fingerprint: Dict) -> bool:
+        # the metadata is written last, so its presence means a complete snapshot
+        return os.path.exists(os.path.join(self.get_version_path(fingerprint), META_FILE))
+
+    def export(self, fingerprint: Dict, page_size=DEFAULT_PAGE_SIZE) -> None:
+        """
+        Stream all documents of the index into the column files. The snapshot is written into a temporary folder
+        which is renamed to the folder of the fingerprint at the end, so readers never see a partially written snapshot
+        :param fingerprint: the fingerprint of the index taken before the export
+        :param page_size: the number of hits per page
+        """
+        version_path = self.get_version_path(fingerprint)
+        tmp_path = f'{version_path}.{uuid.uuid4().hex}.tmp'
+        os.makedirs(tmp_path)
+        columns = dict()
+        count = 0
+        try:
+            ids = gzip.open(os.path.join(tmp_path, f'{ID_COLUMN}.gz'), 'wt')
+            for hit in iterate_hits(self.es, self.index, page_size=page_size, slices=DEFAULT_SLICES):
+                ids.write(hit['_id'] + "\n")
+                for field, value in hit['_source'].items():
+                    if field not in columns:
+                        columns[field] = gzip.open(os.path.join(tmp_path, f'{field}.gz'), 'wt')
+                        # the documents before the first one having the field
+                        columns[field].write(MISSING * count)
+                    columns[field].write(json.dumps(value, separators=(',', ':')) + "\n")
+                count += 1
+                # documents without the field
+                for field, column in columns.items():
+                    if field not in hit['_source']:
+                        column.write(MISSING)
+            ids.close()
+            for column in columns.values():
+                column.close()
+            with open(os.path.join(tmp_path, META_FILE), 'w') as f:
+                json.dump({'fingerprint': fingerprint, 'count': count, 'columns': sorted(columns.keys())}, f)
+            try:
+                os.rename(tmp_path, version_path)
+            except OSError:
+                # another script exported the same snapshot in the meantime
+                shutil.rmtree(tmp_path, ignore_errors=True)
+        except Exception:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            raise
+        logger.info(f"Exported {count} documents of {self.index} into {version_path}")
+        self.remove_old_versions()
+
+    def remove_old_versions(self) -> None:
+        """
+        Remove the snapshots older than the latest SNAPSHOTS_TO_KEEP, the temporary folders being written are kept
+        """
+        versions = [os.path.join(self.path, name) for name in os.listdir(self.path) if not name.endswith('.tmp')]
+        versions.sort(key=os.path.getmtime, reverse=True)
+        for path in versions[SNAPSHOTS_TO_KEEP:]:
+            shutil.rmtree(path, ignore_errors=True)
+
+    def iterate(self, fingerprint: Dict, source: Union[List[str], bool, None] = None) -> Iterator[Dict]:
+        """
+        Read the snapshot with the field projection
+        :param fingerprint: the fingerprint of the snapshot
+        :param source: the fields to be returned in _source, False for ids only, None for the whole documents
+        :return: generator of hits in the same format as the search API
+        """
+        path = self.get_version_path(fingerprint)
+        with open(os.path.join(path, META_FILE)) as f:
+            available = json.load(f)['columns']
+        if source is None:
+            fields = available
+        elif source is False:
+            fields = list()
+        else:
+            fields = source
+        paths = {field: field.split('.') for field in fields}
+        # only the columns of the top level fields used by the projection are opened
+        needed = sorted({parts[0] for parts in paths.values() if parts[0] in available})
+        files = [gzip.open(os.path.join(path, f'{field}.gz'), 'rt') for field in needed]
+        try:
+            with gzip.open(os.path.join(path, f'{ID_COLUMN}.gz'), 'rt') as ids:
+                for line in ids:
+                    doc = dict()
+                    for field, column in zip(needed, files):
+                        encoded = column.readline()
+                        if encoded != MISSING:
+                            doc[field] = json.loads(encoded)
+                    yield {'_id': line.rstrip("\n"), '_source': project(doc, list(paths.values()))}
+        finally:
+            for column in files:
+                column.close()
+
+
+def project(doc: Dict, paths: List[List[str]]) -> Dict:
+    """
+    Keep only the given fields of the document, nested fields are given as paths and
+    are applied to each element of lists, the same way as _source filtering of Elasticsearch
+    :param doc: the document
+    :param paths: the fields to keep, each split into its parts, e.g. ['organism', 'biosampleId']
+    :return: the projected document
+    """
+    result = dict()
+    for parts in paths:
+        if parts[0] not in doc:
+            continue
+        value = doc[parts[0]]
+        if len(parts) == 1:
+            result[parts[0]] = value
+        elif isinstance(value, dict):
+            projected = project(value, [parts[1:]])
+            if projected:
+                result[parts[0]] = merge(result.get(parts[0]), projected)
+        elif isinstance(value, list):
+            projected = [project(item, [parts[1:]]) if isinstance(item, dict) else {} for item in value]
+            existing = result.get(parts[0])
+            if existing is not None:
+                projected = [merge(old, new) for old, new in zip(existing, projected)]
+            result[parts[0]] = projected
+    return result
+
+
+def merge(existing: Optional[Dict], new: Dict) -> Dict:
+    """
+    Merge two projections of the same object
+    """
+    if not existing:
+        return new
+    merged = dict(existing)
+    for key, value in new.items():
+        if key in merged and isinstance(merged[key], dict) and isinstance(value, dict):
+            merged[key] = merge(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
+
+
+def read_index(es, index, source: Union[List[str], bool, None] = None, query: Optional[Dict] = None,
+               snapshot_dir=SNAPSHOT_DIR, page_size=DEFAULT_PAGE_SIZE, slices=DEFAULT_SLICES) -> Iterator[Dict]:
+    """
+    Yield all hits of the index, from the local snapshot if snapshots are enabled
+    :param es: elasticsearch python library instance
+    :param index: the name of the index or the alias
+    :param source: the fields to be returned in _source, False for ids only, None for the whole documents
+    :param query: optional query to filter the hits, filtered reads always go to Elasticsearch
+    :param snapshot_dir: the folder keeping the snapshots, empty to read from Elasticsearch
+    :param page_size: the number of hits per page when reading from Elasticsearch
+    :param slices: the number of slices when reading from Elasticsearch
+    :return: generator of the hits
+    """
+    if not snapshot_dir or query:
+        yield from iterate_hits(es, index, query, source, page_size=page_size, slices=slices)
+        return
+    snapshot = IndexSnapshot(es, index, snapshot_dir)
+    fingerprint = snapshot.get_fingerprint()
+    if not snapshot.is_valid(fingerprint):
+        snapshot.export(fingerprint, page_size)
+    yield from snapshot.iterate(fingerprint, source)
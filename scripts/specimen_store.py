@@ -0,0 +1,180 @@
+"""
+Compact lookup of the specimen (and organism) records needed by the ENA import scripts
+Only the projected fields are loaded, each record is a slot-based object, and the ontology values shared by many
+records (material, cell type, species, sex, breed) are kept only once with interned strings.
+The loaded records could be saved into a local file, which is used instead of reading the index again
+as long as the number of documents and the latest update date of the index are unchanged
+"""
+import json
+import os
+import pickle
+import sys
+from typing import Dict, Iterator, Optional
+from es_reader import get_index_fingerprint, DEFAULT_SLICES
+from snapshot_cache import read_index
+
+# the fields needed to build the experiment, file and dataset documents
+SPECIMEN_FIELDS = ['biosampleId', 'material', 'cellType', 'organism.biosampleId', 'organism.organism',
+                   'organism.sex', 'organism.breed']
+
+
+class SlotRecord:
+    """
+    Base class of the records, supports the read-only dict operations used by the import scripts
+    so a record could be used where the _source dict was used before
+    """
+    __slots__ = ()
+
+    def __getitem__(self, key):
+        value = getattr(self, key, None) if key in self.__slots__ else None
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        return key in self.__slots__ and getattr(self, key) is not None
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def __getstate__(self):
+        return tuple(getattr(self, key) for key in self.__slots__)
+
+    def __setstate__(self, state):
+        for key, value in zip(self.__slots__, state):
+            setattr(self, key, value)
+
+
+class OrganismRecord(SlotRecord):
+    __slots__ = ('biosampleId', 'organism', 'sex', 'breed')
+
+    def __init__(self, biosampleId=None, organism=None, sex=None, breed=None):
+        self.biosampleId = biosampleId
+        self.organism = organism
+        self.sex = sex
+        self.breed = breed
+
+
+class SpecimenRecord(SlotRecord):
+    __slots__ = ('biosampleId', 'material', 'cellType', 'organism')
+
+    def __init__(self, biosampleId=None, material=None, cellType=None, organism=None):
+        self.biosampleId = biosampleId
+        self.material = material
+        self.cellType = cellType
+        self.organism = organism
+
+
+class SpecimenStore:
+    """
+    Dict-like collection of the records, keys are BioSamples ids
+    """
+    def __init__(self):
+        self.records: Dict[str, SpecimenRecord] = dict()
+        # the fingerprints of the indices loaded into the store, keys are index names
+        self.fingerprints: Dict[str, Dict] = dict()
+        # one instance of each distinct value, keys are the serialized values
+        self.values: Dict[str, object] = dict()
+
+    def __contains__(self, biosample_id) -> bool:
+        return biosample_id in self.records
+
+    def __getitem__(self, biosample_id) -> SpecimenRecord:
+        return self.records[biosample_id]
+
+    def __setitem__(self, biosample_id, doc: Dict) -> None:
+        self.add(biosample_id, doc)
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.records)
+
+    def keys(self):
+        return self.records.keys()
+
+    def add(self, biosample_id, doc: Dict) -> None:
+        """
+        Add one record, fields outside of the projection are ignored
+        :param biosample_id: the BioSamples id of the record
+        :param doc: the record as stored in Elasticsearch
+        """
+        organism = doc.get('organism')
+        # for specimen records the organism field describes the organism the specimen was taken from, while for
+        # organism records it is the species, which is not needed here
+        if isinstance(organism, dict) and ('biosampleId' in organism or 'organism' in organism):
+            organism = OrganismRecord(self.share(organism.get('biosampleId')), self.share(organism.get('organism')),
+                                      self.share(organism.get('sex')), self.share(organism.get('breed')))
+        else:
+            organism = OrganismRecord()
+        self.records[sys.intern(biosample_id)] = SpecimenRecord(
+            self.share(doc.get('biosampleId')), self.share(doc.get('material')), self.share(doc.get('cellType')),
+            organism)
+
+    def share(self, value):
+        """
+        :param value: one field value
+        :return: the instance of the value shared by all records, strings are interned
+        """
+        if value is None:
+            return None
+        if isinstance(value, str):
+            return sys.intern(value)
+        key = json.dumps(value, sort_keys=True)
+        if key not in self.values:
+            self.values[key] = intern_strings(value)
+        return self.values[key]
+
+    def load(self, es, index, cache_dir: Optional[str] = None, slices=DEFAULT_SLICES) -> bool:
+        """
+        Load the records of one index with the field projection
+        :param es: elasticsearch python library instance
+        :param index: the name of the index
+        :param cache_dir: optional folder to keep a local copy of the records, used when the index is unchanged
+        :param slices: the number of slices used to read the index
+        :return: True if the records were loaded from the local copy
+        """
+        fingerprint = get_index_fingerprint(es, index) if cache_dir else None
+        if cache_dir:
+            path = os.path.join(cache_dir, f'{index}.specimens.pickle')
+            if os.path.exists(path):
+                with open(path, 'rb') as f:
+                    cached = pickle.load(f)
+                if cached.fingerprints.get(index) == fingerprint:
+                    self.records.update(cached.records)
+                    self.fingerprints[index] = fingerprint
+                    return True
+        loaded = SpecimenStore()
+        for hit in read_index(es, index, source=SPECIMEN_FIELDS, slices=slices):
+            loaded.add(hit['_id'], hit['_source'])
+        loaded.fingerprints[index] = fingerprint
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+            with open(path, 'wb') as f:
+                pickle.dump(loaded, f, protocol=pickle.HIGHEST_PROTOCOL)
+        self.records.update(loaded.records)
+        self.fingerprints[index] = fingerprint
+        return False
+
+    def __getstate__(self):
+        return {'records': self.records, 'fingerprints': self.fingerprints}
+
+    def __setstate__(self, state):
+        self.records = state['records']
+        self.fingerprints = state['fingerprints']
+        self.values = dict()
+
+
+def intern_strings(value):
+    """
+    :param value: a value made of dicts, lists and scalars
+    :return: the same value with all strings, including the keys, interned
+    """
+    if isinstance(value, str):
+        return sys.intern(value)
+    if isinstance(value, dict):
+        return {sys.intern(k): intern_strings(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [intern_strings(v) for v in value]
+    return value
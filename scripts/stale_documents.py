@@ -0,0 +1,55 @@
+"""
+Remove the documents which were not written during an import run
+The ids are streamed from the index, compared with the ids indexed in the run and the stale ones are deleted with
+_bulk requests. In dry-run mode nothing is deleted, only the report of the stale documents is returned
+"""
+from typing import Container, Dict, List
+from es_reader import iterate_hits
+from bulk_indexer import ParallelBulkIndexer, REPORTED_IDS_LIMIT
+
+
+def find_stale_ids(es, index, indexed_ids: Container[str], exempt_query=None) -> List[str]:
+    """
+    Scroll through all ids of the index and return the ones not indexed in this run
+    :param es: elasticsearch python library instance
+    :param index: the name of the index
+    :param indexed_ids: the ids of the documents indexed in this run
+    :param exempt_query: optional query matching the documents which must not be removed,
+    e.g. the ones managed by another import script
+    :return: the ids of the stale documents
+    """
+    query = {'bool': {'must_not': [exempt_query]}} if exempt_query else None
+    stale = list()
+    for hit in iterate_hits(es, index, query, source=False, page_size=5000):
+        if hit['_id'] not in indexed_ids:
+            stale.append(hit['_id'])
+    return stale
+
+
+def delete_stale_documents(es, index, indexed_ids: Container[str], exempt_query=None, dry_run=False,
+                           **kwargs) -> Dict:
+    """
+    Delete the documents of the index which were not indexed in this run
+    :param es: elasticsearch python library instance
+    :param index: the name of the index
+    :param indexed_ids: the ids of the documents indexed in this run
+    :param exempt_query: optional query matching the documents which must not be removed
+    :param dry_run: only report the stale documents without deleting them
+    :param kwargs: other parameters of ParallelBulkIndexer, e.g. doc_type and dead_letter
+    :return: the number of stale documents, the first of their ids and for real runs the bulk report
+    """
+    stale = find_stale_ids(es, index, indexed_ids, exempt_query)
+    result = {
+        'index': index,
+        'stale': len(stale),
+        'ids': stale[:REPORTED_IDS_LIMIT],
+        'dry_run': dry_run
+    }
+    if dry_run or not stale:
+        return result
+    with ParallelBulkIndexer(es, **kwargs) as bulk_indexer:
+        for doc_id in stale:
+            bulk_indexer.delete(index, doc_id)
+    result['deleted'] = bulk_indexer.succeeded
+    result['failed'] = len(bulk_indexer.errors)
+    return result
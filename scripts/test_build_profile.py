@@ -0,0 +1,72 @@
+import os
+import tempfile
+import unittest
+from build_profile import BuildProfile
+
+
+class FakeIndicesClient:
+    def __init__(self, settings):
+        """
+        :param settings: the explicit settings of the indices, keyed by index names
+        """
+        self.settings = settings
+        self.put = list()
+
+    def exists(self, index):
+        return index in self.settings
+
+    def get_settings(self, index, name, **kwargs):
+        if name == 'index.creation_date':
+            return {index: {'settings': {'index': {'creation_date': '0'}}} for index in index.split(',')}
+        return {index: {'settings': {key: value for key, value in self.settings[index].items() if key in name},
+                        'defaults': {'index.refresh_interval': '1s', 'index.number_of_replicas': '1'}}
+                for index in index.split(',')}
+
+    def put_settings(self, index, body):
+        self.put.append((index, body['index']))
+        for name in index.split(','):
+            self.settings[name].update({f'index.{key}': value for key, value in body['index'].items()})
+
+    def refresh(self, index):
+        pass
+
+    def forcemerge(self, index, **kwargs):
+        pass
+
+
+class FakeCluster:
+    def health(self, **kwargs):
+        return {'status': 'green'}
+
+
+class FakeElasticsearch:
+    def __init__(self, settings):
+        self.indices = FakeIndicesClient(settings)
+        self.cluster = FakeCluster()
+
+
+class TestBuildProfile(unittest.TestCase):
+    def test_settings_restored(self):
+        es = FakeElasticsearch({'faang_build_1_file': {'index.refresh_interval': '30s'},
+                                'faang_build_1_specimen': {'index.number_of_replicas': '2'}})
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as folder:
+            os.chdir(folder)
+            try:
+                profile = BuildProfile(es, 'faang_build_1_', ['file', 'specimen', 'dataset'])
+                profile.start()
+                # a second start does not capture the bulk-build settings
+                profile.start()
+                self.assertEqual(es.indices.settings['faang_build_1_file']['index.refresh_interval'], '-1')
+                profile.finish()
+                self.assertFalse(os.path.exists(profile.state_file))
+            finally:
+                os.chdir(cwd)
+        self.assertDictEqual(es.indices.settings['faang_build_1_file'],
+                             {'index.refresh_interval': '30s', 'index.number_of_replicas': '1'})
+        self.assertDictEqual(es.indices.settings['faang_build_1_specimen'],
+                             {'index.refresh_interval': '1s', 'index.number_of_replicas': '2'})
+
+
+if __name__ == '__main__':
+    unittest.main()
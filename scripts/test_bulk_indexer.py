@@ -0,0 +1,231 @@
+import json
+import unittest
+from elasticsearch.serializer import JSONSerializer
+from write_metrics import WriteMetrics
+from record_counter import RecordCounter
+from bulk_indexer import BulkIndexer, ParallelBulkIndexer, compute_content_hash, update_documents
+
+
+class FakeTransport:
+    serializer = JSONSerializer()
+
+
+class FakeIndicesClient:
+    def __init__(self):
+        self.refreshed = list()
+
+    def refresh(self, index):
+        self.refreshed.append(index)
+
+    def get_alias(self, index):
+        return {index: {'aliases': {}}}
+
+
+class FakeElasticsearch:
+    """
+    Mimic the bulk and scroll endpoints, documents with id starting with 'bad' are rejected
+    and documents with id starting with 'missing' do not exist for updates
+    """
+    def __init__(self, existing=None, overloaded=0):
+        """
+        :param existing: the hits returned by searches
+        :param overloaded: the number of _bulk requests whose actions are all rejected with 429
+        """
+        self.transport = FakeTransport()
+        self.indices = FakeIndicesClient()
+        self.overloaded = overloaded
+        self.requests = list()
+        self.existing = existing if existing else list()
+        # the ids of the documents written into each index
+        self.documents = dict()
+
+    def bulk(self, body, **kwargs):
+        lines = body.strip().split("\n")
+        self.requests.append(lines)
+        items = list()
+        for line in lines:
+            action = json.loads(line)
+            op_type = list(action.keys())[0]
+            if len(action) != 1 or op_type not in ('index', 'delete', 'update'):
+                continue
+            detail = action[op_type]
+            if len(self.requests) <= self.overloaded:
+                detail['status'] = 429
+                detail['error'] = {'type': 'es_rejected_execution_exception'}
+            elif op_type == 'update' and detail['_id'].startswith('missing'):
+                detail['status'] = 404
+                detail['error'] = {'type': 'document_missing_exception'}
+            elif detail['_id'].startswith('bad'):
+                detail['status'] = 400
+                detail['error'] = {'type': 'mapper_parsing_exception'}
+            else:
+                detail['status'] = 200
+                if op_type == 'index':
+                    self.documents.setdefault(detail['_index'], set()).add(detail['_id'])
+                elif op_type == 'delete':
+                    self.documents.get(detail['_index'], set()).discard(detail['_id'])
+            items.append({op_type: detail})
+        return {'errors': False, 'items': items}
+
+    def search(self, **kwargs):
+        return {'_scroll_id': 'scroll', '_shards': {'total': 1, 'successful': 1}, 'hits': {'hits': self.existing}}
+
+    def scroll(self, **kwargs):
+        return {'_scroll_id': 'scroll', '_shards': {'total': 1, 'successful': 1}, 'hits': {'hits': []}}
+
+    def clear_scroll(self, **kwargs):
+        pass
+
+    def count(self, index, body=None):
+        return {'count': len(self.documents.get(index, ()))}
+
+
+class TestBulkIndexer(unittest.TestCase):
+    def test_chunk_by_count(self):
+        es = FakeElasticsearch()
+        indexer = BulkIndexer(es, chunk_size=2)
+        for i in range(5):
+            indexer.index('faang_build_1_file', f'file{i}', {'name': f'file{i}'})
+        # two full chunks sent automatically, the last document waits in the buffer
+        self.assertEqual(len(es.requests), 2)
+        self.assertListEqual(es.indices.refreshed, [])
+        indexer.close()
+        self.assertEqual(len(es.requests), 3)
+        self.assertDictEqual(indexer.report(), {'succeeded': 5, 'failed': 0})
+        # the written indices are refreshed once all documents are sent
+        self.assertListEqual(es.indices.refreshed, ['faang_build_1_file'])
+
+    def test_chunk_by_bytes(self):
+        es = FakeElasticsearch()
+        indexer = BulkIndexer(es, chunk_size=100, max_chunk_bytes=50)
+        indexer.index('faang_build_1_file', 'file1', json.dumps({'name': 'x' * 60}))
+        self.assertEqual(len(es.requests), 1)
+
+    def test_errors_reported(self):
+        es = FakeElasticsearch()
+        with BulkIndexer(es) as indexer:
+            indexer.index('faang_build_1_specimen', 'SAMEA1', {'biosampleId': 'SAMEA1'})
+            indexer.index('faang_build_1_specimen', 'bad1', {'biosampleId': 'bad1'})
+        self.assertDictEqual(indexer.report(), {'succeeded': 1, 'failed': 1})
+        self.assertEqual(indexer.errors[0]['id'], 'bad1')
+        self.assertEqual(indexer.errors[0]['status'], 400)
+        self.assertEqual(indexer.errors[0]['index'], 'faang_build_1_specimen')
+
+    def test_compute_content_hash(self):
+        doc = {'accession': 'ERX1', 'assayType': 'ATAC-seq'}
+        reordered = {'assayType': 'ATAC-seq', 'accession': 'ERX1'}
+        self.assertEqual(compute_content_hash(doc), compute_content_hash(reordered))
+        reordered['contentHash'] = compute_content_hash(doc)
+        self.assertEqual(compute_content_hash(doc), compute_content_hash(reordered))
+        self.assertNotEqual(compute_content_hash(doc), compute_content_hash({'accession': 'ERX1'}))
+
+    def test_track_changes(self):
+        unchanged = {'accession': 'ERX1', 'assayType': 'ATAC-seq'}
+        existing = [
+            {'_id': 'ERX1', '_source': {'contentHash': compute_content_hash(unchanged)}},
+            {'_id': 'ERX2', '_source': {'contentHash': 'outdated'}},
+            {'_id': 'ERX3', '_source': {}}
+        ]
+        es = FakeElasticsearch(existing)
+        indexer = BulkIndexer(es)
+        indexer.track_changes('faang_build_1_experiment')
+        indexer.index('faang_build_1_experiment', 'ERX1', json.dumps(unchanged))
+        indexer.index('faang_build_1_experiment', 'ERX2', {'accession': 'ERX2', 'assayType': 'Hi-C'})
+        indexer.index('faang_build_1_experiment', 'ERX4', {'accession': 'ERX4', 'assayType': 'Hi-C'})
+        self.assertDictEqual(indexer.delete_unseen(dry_run=False, max_ratio=0.5),
+                             {'faang_build_1_experiment': {'unseen': 1, 'ids': ['ERX3'], 'deleted': True}})
+        indexer.close()
+        self.assertDictEqual(indexer.report()['changes']['faang_build_1_experiment'],
+                             {'written': 2, 'skipped': 1, 'deleted': 1})
+        self.assertEqual(indexer.report()['succeeded'], 3)
+        written = json.loads(es.requests[0][1])
+        self.assertEqual(written['contentHash'], compute_content_hash(written))
+
+    def test_delete_unseen_guarded(self):
+        existing = [{'_id': f'ERX{i}', '_source': {'contentHash': 'outdated'}} for i in range(10)]
+        es = FakeElasticsearch(existing)
+        indexer = BulkIndexer(es)
+        indexer.track_changes('faang_build_1_experiment')
+        for i in range(9):
+            indexer.index('faang_build_1_experiment', f'ERX{i}', {'accession': f'ERX{i}'})
+        # only reported by default
+        self.assertDictEqual(indexer.delete_unseen(),
+                             {'faang_build_1_experiment': {'unseen': 1, 'ids': ['ERX9'], 'deleted': False}})
+        # refused when more of the tracked documents would go
+        self.assertFalse(indexer.delete_unseen(dry_run=False, max_ratio=0.05)['faang_build_1_experiment']['deleted'])
+        indexer.close()
+        self.assertEqual(indexer.report()['changes']['faang_build_1_experiment']['deleted'], 0)
+        self.assertEqual(indexer.report()['succeeded'], 9)
+
+    def test_parallel_retry_on_rejection(self):
+        es = FakeElasticsearch(overloaded=1)
+        indexer = ParallelBulkIndexer(es, max_in_flight=1, chunk_size=4, min_chunk_size=1, initial_backoff=0)
+        for i in range(4):
+            indexer.index('faang_build_1_file', f'file{i}', {'name': f'file{i}'})
+        indexer.close()
+        report = indexer.report()
+        self.assertEqual(report['succeeded'], 4)
+        self.assertEqual(report['failed'], 0)
+        self.assertEqual(report['throughput']['requests'], 3)
+        self.assertEqual(report['throughput']['rejections'], 4)
+        self.assertEqual(report['throughput']['retries'], 4)
+        # the rejected actions are sent again in chunks of the halved chunk size
+        self.assertListEqual([len(lines) // 2 for lines in es.requests], [4, 2, 2])
+        # halved on the rejection, then grown by one step after each successful retry
+        self.assertEqual(report['throughput']['chunk_size'], 4)
+
+    def test_parallel_gives_up_after_max_retries(self):
+        es = FakeElasticsearch(overloaded=10)
+        indexer = ParallelBulkIndexer(es, max_retries=2, initial_backoff=0)
+        indexer.index('faang_build_1_file', 'file1', {'name': 'file1'})
+        indexer.close()
+        self.assertEqual(len(es.requests), 3)
+        self.assertEqual(indexer.errors[0]['status'], 429)
+
+    def test_update_documents(self):
+        es = FakeElasticsearch()
+        docs = {
+            'SAMEA1': {'paperPublished': 'true'},
+            'missing1': {'paperPublished': 'true'}
+        }
+        report = update_documents(es, 'faang_build_1_specimen', docs)
+        self.assertEqual(report['succeeded'], 1)
+        self.assertEqual(report['failed'], 0)
+        self.assertEqual(report['missing'], 1)
+        self.assertDictEqual(json.loads(es.requests[0][1]), {'doc': {'paperPublished': 'true'}})
+        report = update_documents(es, 'faang_build_1_specimen', docs, doc_as_upsert=True)
+        self.assertEqual(report['failed'], 1)
+        self.assertDictEqual(json.loads(es.requests[1][1]), {'doc': {'paperPublished': 'true'}, 'doc_as_upsert': True})
+
+    def test_record_counts_invalidated(self):
+        es = FakeElasticsearch()
+        counter = RecordCounter()
+        self.assertEqual(counter.count(es, 'faang_build_1_specimen'), 0)
+        self.assertEqual(counter.count(es, 'faang_build_1_organism'), 0)
+        with BulkIndexer(es, record_counter=counter) as indexer:
+            indexer.index('faang_build_1_specimen', 'SAMEA1', {'accession': 'SAMEA1'})
+            indexer.index('faang_build_1_specimen', 'SAMEA2', {'accession': 'SAMEA2'})
+        # counted again after the writes, the counts of the other indices are kept
+        self.assertEqual(counter.count(es, 'faang_build_1_specimen'), 2)
+        self.assertEqual(counter.count(es, 'faang_build_1_organism'), 0)
+        self.assertEqual(counter.requests, 3)
+
+    def test_write_metrics(self):
+        es = FakeElasticsearch()
+        metrics = WriteMetrics()
+        with BulkIndexer(es, metrics=metrics) as indexer:
+            indexer.index('faang_build_1_file', 'file1', '{"name":"file1"}')
+            indexer.index('faang_build_1_file', 'bad1', '{"name":"bad1"}')
+            indexer.delete('faang_build_1_dataset', 'PRJEB1')
+        summary = metrics.summary()
+        self.assertDictEqual(summary['totals'], {'requests': 2, 'documents': 3, 'bytes': 31, 'errors': 1,
+                                                 'retries': 0,
+                                                 'documents_per_second': summary['totals']['documents_per_second']})
+        file_metrics = summary['indices']['faang_build_1_file']
+        self.assertEqual(file_metrics['documents'], 2)
+        self.assertEqual(file_metrics['errors'], 1)
+        self.assertEqual(sum(file_metrics['latency_ms']['histogram']), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
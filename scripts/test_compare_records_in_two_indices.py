@@ -0,0 +1,53 @@
+import unittest
+from compare_records_in_two_indices import compare_indices, ONLY_IN_1, ONLY_IN_2, CONTENT_DIFFERS
+
+
+class FakeSortedElasticsearch:
+    """
+    Mimic the search API sorted by _id with search_after
+    """
+    def __init__(self, indices):
+        """
+        :param indices: the documents of each index keyed by id
+        """
+        self.indices = indices
+        self.searches = list()
+
+    def search(self, index, body):
+        self.searches.append(body)
+        ids = sorted(doc_id for doc_id in self.indices[index] if not body.get('search_after')
+                     or doc_id > body['search_after'][0])
+        hits = list()
+        for doc_id in ids[:body['size']]:
+            hit = {'_id': doc_id, 'sort': [doc_id]}
+            if body.get('_source') is not False:
+                hit['_source'] = self.indices[index][doc_id]
+            hits.append(hit)
+        return {'hits': {'hits': hits}}
+
+
+class TestCompareRecords(unittest.TestCase):
+    def test_compare_indices(self):
+        es = FakeSortedElasticsearch({
+            'faang_build_1_dataset': {f'PRJEB{i}': {'title': str(i)} for i in range(0, 2000, 2)},
+            'faang_build_2_dataset': {f'PRJEB{i}': {'title': str(i)} for i in range(0, 2000, 3)}
+        })
+        differences = list()
+        counts = compare_indices(es, 'faang_build_1_dataset', 'faang_build_2_dataset',
+                                 on_difference=lambda status, record_id: differences.append((status, record_id)))
+        self.assertDictEqual(counts, {ONLY_IN_1: 666, ONLY_IN_2: 333, CONTENT_DIFFERS: 0, 'identical': 334})
+        self.assertIn((ONLY_IN_1, 'PRJEB2'), differences)
+        self.assertIn((ONLY_IN_2, 'PRJEB3'), differences)
+        self.assertFalse(es.searches[0]['_source'])
+
+    def test_compare_content(self):
+        es = FakeSortedElasticsearch({
+            'faang_build_1_file': {'ERR1': {'name': 'a'}, 'ERR2': {'name': 'b', 'contentHash': 'old'}},
+            'faang_build_2_file': {'ERR1': {'name': 'changed'}, 'ERR2': {'name': 'b'}}
+        })
+        counts = compare_indices(es, 'faang_build_1_file', 'faang_build_2_file', compare_content=True)
+        self.assertDictEqual(counts, {ONLY_IN_1: 0, ONLY_IN_2: 0, CONTENT_DIFFERS: 1, 'identical': 1})
+
+
+if __name__ == '__main__':
+    unittest.main()
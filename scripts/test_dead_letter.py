@@ -0,0 +1,54 @@
+import json
+import os
+import tempfile
+import unittest
+from bulk_indexer import BulkIndexer
+from dead_letter import DeadLetterQueue, read_entries, replay
+from test_bulk_indexer import FakeElasticsearch
+
+
+class TestDeadLetter(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, 'dead_letter.jsonl')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_failed_actions_recorded(self):
+        es = FakeElasticsearch(overloaded=1)
+        dead_letter = DeadLetterQueue(self.path)
+        with BulkIndexer(es, dead_letter=dead_letter) as indexer:
+            indexer.index('faang_build_1_file', 'file1', {'name': 'file1'})
+            indexer.update('faang_build_1_dataset', 'PRJEB1', {'doc': {'paperPublished': 'true'}})
+            indexer.delete('faang_build_1_article', 'PMC1')
+        self.assertEqual(indexer.report()['dead_letters'], 3)
+        entries = list(read_entries(self.path))
+        self.assertDictEqual(entries[0], {'op_type': 'index', 'index': 'faang_build_1_file', 'id': 'file1',
+                                          'body': {'name': 'file1'}})
+        self.assertDictEqual(entries[1]['body'], {'doc': {'paperPublished': 'true'}})
+        self.assertIsNone(entries[2]['body'])
+
+    def test_replay_selected_indices(self):
+        dead_letter = DeadLetterQueue(self.path)
+        dead_letter.append('faang_build_1_file', 'file1', {'name': 'file1'})
+        dead_letter.append('faang_build_1_file', 'bad1', {'name': 'bad1'})
+        dead_letter.append('faang_build_1_dataset', 'PRJEB1', {'accession': 'PRJEB1'})
+        es = FakeElasticsearch()
+        result = replay(es, self.path, {'faang_build_1_file'})
+        self.assertDictEqual(result, {'replayed': 2, 'failed': 1, 'kept': 1})
+        self.assertEqual(json.loads(es.requests[0][0])['index']['_id'], 'file1')
+        # the entry failing again and the one not selected are left in the file
+        self.assertListEqual([entry['id'] for entry in read_entries(self.path)], ['bad1', 'PRJEB1'])
+
+    def test_replay_ignores_leftover_file(self):
+        # left by an interrupted replay
+        DeadLetterQueue(f'{self.path}.tmp').append('faang_build_1_file', 'old1', {'name': 'old1'})
+        DeadLetterQueue(self.path).append('faang_build_1_file', 'bad1', {'name': 'bad1'})
+        result = replay(FakeElasticsearch(), self.path)
+        self.assertDictEqual(result, {'replayed': 1, 'failed': 1, 'kept': 0})
+        self.assertListEqual([entry['id'] for entry in read_entries(self.path)], ['bad1'])
+
+
+if __name__ == '__main__':
+    unittest.main()
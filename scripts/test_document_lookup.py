@@ -0,0 +1,46 @@
+import unittest
+from document_lookup import DocumentLookup
+
+
+class FakeMgetElasticsearch:
+    def __init__(self, existing):
+        """
+        :param existing: the ids of the existing documents
+        """
+        self.existing = existing
+        self.requests = list()
+
+    def mget(self, body, index, **kwargs):
+        self.requests.append(body['ids'])
+        return {'docs': [{'_index': index, '_id': doc_id, 'found': doc_id in self.existing}
+                         for doc_id in body['ids']]}
+
+
+class TestDocumentLookup(unittest.TestCase):
+    def test_batched_lookup(self):
+        es = FakeMgetElasticsearch({'protocol1', 'protocol3'})
+        lookup = DocumentLookup(es, 'protocol_samples', batch_size=2)
+        lookup.prefetch(['protocol1', 'protocol2', 'protocol3', 'protocol1'])
+        self.assertEqual(len(es.requests), 2)
+        self.assertTrue(lookup.exists('protocol1'))
+        self.assertFalse(lookup.exists('protocol2'))
+        self.assertTrue(lookup.exists('protocol3'))
+        self.assertEqual(len(es.requests), 2)
+        # written by the run
+        lookup.set('protocol2', dict())
+        self.assertTrue(lookup.exists('protocol2'))
+        self.assertFalse(lookup.exists('protocol4'))
+        self.assertListEqual(es.requests[-1], ['protocol4'])
+
+    def test_cache_size(self):
+        es = FakeMgetElasticsearch({'protocol1'})
+        lookup = DocumentLookup(es, 'protocol_samples', cache_size=2)
+        lookup.prefetch(['protocol1', 'protocol2'])
+        lookup.get('protocol1')
+        lookup.get('protocol3')
+        # the least recently used protocol2 was evicted
+        self.assertListEqual(list(lookup.cache.keys()), ['protocol1', 'protocol3'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,139 @@
+import unittest
+from elasticsearch.exceptions import TransportError
+from es_reader import iterate_hits, iterate_field_values, get_distinct_values, ReadSession
+from test_bulk_indexer import FakeElasticsearch
+
+
+class FakePointInTimeElasticsearch:
+    """
+    Mimic the point in time and search_after API over a list of document ids
+    """
+    def __init__(self, ids):
+        self.ids = ids
+        self.searches = list()
+        self.closed = list()
+
+    def open_point_in_time(self, index, keep_alive):
+        return {'id': f'{index}_pit1'}
+
+    def search(self, body):
+        self.searches.append(body)
+        ids = self.ids
+        if 'slice' in body:
+            ids = [doc_id for i, doc_id in enumerate(ids) if i % body['slice']['max'] == body['slice']['id']]
+        start = body['search_after'][0] if 'search_after' in body else 0
+        hits = [{'_id': doc_id, '_source': {}, 'sort': [start + i + 1]}
+                for i, doc_id in enumerate(ids[start:start + body['size']])]
+        for hit in hits:
+            if 'docvalue_fields' in body:
+                hit['fields'] = {'biosampleId': [hit['_id']], 'etag': ['a', 'b'] if hit['_id'].endswith('1') else ['a']}
+        return {'pit_id': body['pit']['id'].replace('pit1', 'pit2'), 'hits': {'hits': hits}}
+
+    def close_point_in_time(self, body):
+        self.closed.append(body['id'])
+
+
+class FakeNoShardDocElasticsearch(FakeElasticsearch):
+    """
+    Mimic Elasticsearch 7.10 and 7.11, which open points in time but cannot sort by _shard_doc
+    """
+    def __init__(self, existing):
+        super().__init__(existing)
+        self.closed = list()
+
+    def open_point_in_time(self, index, keep_alive):
+        return {'id': f'{index}_pit1'}
+
+    def close_point_in_time(self, body):
+        self.closed.append(body['id'])
+
+    def search(self, **kwargs):
+        if 'pit' in kwargs.get('body', dict()):
+            raise TransportError(400, 'search_phase_execution_exception', 'No mapping found for [_shard_doc]')
+        return super().search(**kwargs)
+
+
+class TestEsReader(unittest.TestCase):
+    def test_point_in_time(self):
+        es = FakePointInTimeElasticsearch([f'SAMEA{i}' for i in range(5)])
+        hits = list(iterate_hits(es, 'faang_build_1_specimen', source=['standardMet'], page_size=2))
+        self.assertListEqual([hit['_id'] for hit in hits], [f'SAMEA{i}' for i in range(5)])
+        self.assertEqual(len(es.searches), 3)
+        self.assertEqual(es.searches[1]['pit']['id'], 'faang_build_1_specimen_pit2')
+        self.assertListEqual(es.searches[0]['_source'], ['standardMet'])
+        self.assertListEqual(es.closed, ['faang_build_1_specimen_pit2'])
+
+    def test_slices(self):
+        ids = [f'SAMEA{i}' for i in range(25)]
+        es = FakePointInTimeElasticsearch(ids)
+        hits = list(iterate_hits(es, 'faang_build_1_specimen', page_size=2, slices=4))
+        self.assertCountEqual([hit['_id'] for hit in hits], ids)
+        self.assertSetEqual({search['slice']['id'] for search in es.searches}, {0, 1, 2, 3})
+        # the id opened is closed, not the one returned to whichever slice finished last
+        self.assertListEqual(es.closed, ['faang_build_1_specimen_pit1'])
+
+    def test_read_session(self):
+        es = FakePointInTimeElasticsearch([f'SAMEA{i}' for i in range(5)])
+        with ReadSession(es, ['faang_build_1_specimen', 'faang_build_1_organism']) as session:
+            self.assertEqual(len(list(session.hits('faang_build_1_specimen', page_size=2))), 5)
+            self.assertEqual(len(list(session.hits('faang_build_1_specimen', slices=2))), 5)
+            session.extend()
+            self.assertEqual(len(list(session.hits('faang_build_1_organism'))), 5)
+            # the point in time contexts are reused until the session is closed
+            self.assertListEqual(es.closed, [])
+        self.assertSetEqual({search['pit']['id'] for search in es.searches},
+                            {'faang_build_1_specimen_pit1', 'faang_build_1_specimen_pit2',
+                             'faang_build_1_organism_pit1', 'faang_build_1_organism_pit2'})
+        self.assertListEqual(es.closed, ['faang_build_1_specimen_pit2', 'faang_build_1_organism_pit2'])
+
+    def test_scroll_fallback(self):
+        es = FakeElasticsearch([{'_id': 'SAMEA1', '_source': {}}])
+        self.assertListEqual([hit['_id'] for hit in iterate_hits(es, 'faang_build_1_specimen')], ['SAMEA1'])
+
+    def test_shard_doc_fallback(self):
+        es = FakeNoShardDocElasticsearch([{'_id': 'SAMEA1', '_source': {}}])
+        for slices in (1, 2):
+            hits = iterate_hits(es, 'faang_build_1_specimen', slices=slices)
+            self.assertListEqual([hit['_id'] for hit in hits], ['SAMEA1'] * slices)
+        self.assertListEqual(es.closed, ['faang_build_1_specimen_pit1'] * 2)
+        with ReadSession(es, ['faang_build_1_specimen']) as session:
+            self.assertListEqual([hit['_id'] for hit in session.hits('faang_build_1_specimen')], ['SAMEA1'])
+
+    def test_field_values(self):
+        es = FakePointInTimeElasticsearch(['SAMEA0', 'SAMEA1'])
+        values = dict(iterate_field_values(es, 'faang_build_1_specimen', ['biosampleId', 'etag']))
+        self.assertDictEqual(values, {'SAMEA0': {'biosampleId': 'SAMEA0', 'etag': 'a'},
+                                      'SAMEA1': {'biosampleId': 'SAMEA1', 'etag': ['a', 'b']}})
+        self.assertFalse(es.searches[0]['_source'])
+
+    def test_distinct_values(self):
+        es = FakeCompositeElasticsearch(['FAANG', 'Legacy (basic)', 'Legacy (full)'])
+        self.assertSetEqual(get_distinct_values(es, 'faang_build_1_dataset', 'standardMet'),
+                            {'FAANG', 'Legacy (basic)', 'Legacy (full)'})
+        self.assertEqual(len(es.searches), 3)
+        self.assertDictEqual(es.searches[1]['aggs']['combinations']['composite']['after'],
+                             {'standardMet': 'Legacy (basic)'})
+
+
+class FakeCompositeElasticsearch:
+    """
+    Mimic the composite aggregation over the values of one field, returning two values per page
+    """
+    def __init__(self, values):
+        self.values = values
+        self.searches = list()
+
+    def search(self, index, body):
+        self.searches.append(body)
+        composite = body['aggs']['combinations']['composite']
+        field = list(composite['sources'][0].keys())[0]
+        after = composite.get('after', {}).get(field)
+        values = [value for value in self.values if after is None or value > after][:2]
+        result = {'buckets': [{'key': {field: value}, 'doc_count': 1} for value in values]}
+        if values:
+            result['after_key'] = {field: values[-1]}
+        return {'aggregations': {'combinations': result}}
+
+
+if __name__ == '__main__':
+    unittest.main()
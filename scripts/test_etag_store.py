@@ -0,0 +1,60 @@
+import os
+import tempfile
+import unittest
+from etag_store import EtagStore
+
+
+class TestEtagStore(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.store = EtagStore(os.path.join(self.folder.name, 'etags.sqlite'))
+
+    def tearDown(self):
+        self.store.close()
+        self.folder.cleanup()
+
+    def test_harvests(self):
+        self.assertIsNone(self.store.get_latest_harvest())
+        self.assertEqual(len(self.store), 0)
+        counts = self.store.record_harvest({'SAMEA1': 'a', 'SAMEA2': 'b'}, '2023-01-01')
+        self.assertDictEqual(counts, {'new': 2, 'changed': 0, 'unchanged': 0, 'failed': 0})
+        counts = self.store.record_harvest({'SAMEA1': 'a', 'SAMEA2': 'c', 'SAMEA3': 'd'}, '2023-01-02')
+        self.assertDictEqual(counts, {'new': 1, 'changed': 1, 'unchanged': 1, 'failed': 0})
+        self.assertTrue(self.store.has_harvest('2023-01-01'))
+        self.assertFalse(self.store.has_harvest('2023-01-03'))
+        self.assertEqual(self.store.get_previous_harvest(), '2023-01-01')
+        self.assertEqual(self.store['SAMEA2'], 'c')
+        self.assertIn('SAMEA3', self.store)
+        self.assertListEqual(list(self.store.items()), [('SAMEA1', 'a'), ('SAMEA2', 'c'), ('SAMEA3', 'd')])
+        self.assertListEqual(self.store.changed_since('2023-01-01'), ['SAMEA2', 'SAMEA3'])
+
+    def test_accessions_not_in_latest_harvest(self):
+        self.store.record_harvest({'SAMEA1': 'a', 'SAMEA2': 'b'}, '2023-01-01')
+        self.store.record_harvest({'SAMEA1': 'a'}, '2023-01-02')
+        self.assertEqual(len(self.store), 1)
+        self.assertNotIn('SAMEA2', self.store)
+        with self.assertRaises(KeyError):
+            self.store['SAMEA2']
+
+    def test_failed_accessions(self):
+        self.store.record_harvest({'SAMEA1': 'a', 'SAMEA2': 'b'}, '2023-01-01')
+        counts = self.store.record_harvest({'SAMEA1': 'a'}, '2023-01-02', failed={'SAMEA2': 503, 'SAMEA3': None})
+        self.assertEqual(counts['failed'], 2)
+        # the accession failed keeps the etag retrieved before
+        self.assertEqual(self.store['SAMEA2'], 'b')
+        self.assertListEqual(list(self.store.items()), [('SAMEA1', 'a'), ('SAMEA2', 'b')])
+        self.assertDictEqual(self.store.get_failed(), {'SAMEA2': 503, 'SAMEA3': None})
+        self.store.record_harvest({'SAMEA1': 'a', 'SAMEA2': 'b', 'SAMEA3': 'c'}, '2023-01-03')
+        self.assertDictEqual(self.store.get_failed(), dict())
+
+    def test_prune(self):
+        self.store.record_harvest({'SAMEA1': 'a', 'SAMEA2': 'b'}, '2023-01-01')
+        self.store.record_harvest({'SAMEA1': 'a'}, '2023-01-02')
+        self.store.record_harvest({'SAMEA1': 'b'}, '2023-01-03')
+        self.assertDictEqual(self.store.prune(2), {'harvests': 1, 'accessions': 1})
+        self.assertListEqual(self.store.get_harvests(), ['2023-01-03', '2023-01-02'])
+        self.assertDictEqual(self.store.prune(2), {'harvests': 0, 'accessions': 0})
+        # reopened, the latest harvest is read from the file
+        reopened = EtagStore(self.store.path)
+        self.assertEqual(reopened['SAMEA1'], 'b')
+        reopened.close()
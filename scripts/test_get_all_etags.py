@@ -0,0 +1,68 @@
+import asyncio
+import unittest
+from unittest import mock
+import get_all_etags
+
+
+class FakeResponse:
+    def __init__(self, status, etag):
+        self.status = status
+        self.headers = {'ETag': etag} if etag else dict()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        pass
+
+
+class FakeSession:
+    """
+    The first request of SAMEA2 is rejected with 503, HEAD requests of SAMEA3 are not allowed
+    """
+    def __init__(self):
+        self.requests = list()
+
+    def request(self, method, url):
+        my_id = url.split('/')[-1].split('.')[0]
+        self.requests.append((method, my_id))
+        if my_id == 'SAMEA2' and len(self.requests) <= 2:
+            return FakeResponse(503, None)
+        if my_id == 'SAMEA3' and method == 'HEAD':
+            return FakeResponse(405, None)
+        if my_id == 'SAMEA4':
+            return FakeResponse(404, None)
+        return FakeResponse(200, f'"{my_id}-etag"')
+
+
+class TestGetAllEtags(unittest.TestCase):
+    def test_fetch_etag(self):
+        session = FakeSession()
+        progress = {'done': 0, 'total': 4, 'started': 0}
+
+        async def fetch_all():
+            semaphore = asyncio.Semaphore(2)
+            for my_id in ('SAMEA1', 'SAMEA2', 'SAMEA3', 'SAMEA4'):
+                await get_all_etags.fetch_etag(session, semaphore, my_id, progress)
+
+        async def sleep(seconds):
+            pass
+
+        with mock.patch.object(get_all_etags, 'MAX_BACKOFF', 0), \
+                mock.patch.object(get_all_etags.asyncio, 'sleep', side_effect=sleep) as slept, \
+                mock.patch.dict(get_all_etags.ETAGS, clear=True), mock.patch.dict(get_all_etags.FAILED, clear=True):
+            asyncio.get_event_loop().run_until_complete(fetch_all())
+            self.assertDictEqual(get_all_etags.ETAGS, {'SAMEA1': '"SAMEA1-etag"', 'SAMEA2': '"SAMEA2-etag"',
+                                                       'SAMEA3': '"SAMEA3-etag"'})
+            self.assertDictEqual(get_all_etags.FAILED, {'SAMEA4': 404})
+            # only the 503 of SAMEA2 is retried after a backoff
+            self.assertEqual(slept.call_count, 1)
+        self.assertEqual(progress['done'], 4)
+        # the GET request follows the rejected HEAD request without waiting for a retry
+        self.assertEqual([request for request in session.requests if request[1] == 'SAMEA3'],
+                         [('HEAD', 'SAMEA3'), ('GET', 'SAMEA3')])
+        self.assertEqual(session.requests.count(('HEAD', 'SAMEA4')), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+import os
+import tempfile
+import unittest
+from page_harvester import PageHarvester
+
+LISTING_URL = 'https://www.ebi.ac.uk/biosamples/samples?size=2'
+
+
+class FakeResponse:
+    def __init__(self, page):
+        self.page = page
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self.page
+
+
+class FakeSession:
+    """
+    Mimic a listing of BioSamples with two samples per page, the pages are linked by a cursor
+    """
+    def __init__(self, total_pages, failing_page=None, total_elements=None):
+        self.total_pages = total_pages
+        self.failing_page = failing_page
+        self.total_elements = total_pages * 2 if total_elements is None else total_elements
+        self.requested = list()
+
+    def get(self, url, timeout):
+        number = int(url.split('cursor=')[1]) if 'cursor=' in url else 0
+        self.requested.append(number)
+        if number == self.failing_page:
+            raise ConnectionError(f'page {number} failed')
+        samples = [{'accession': f'SAMEA{number * 2 + i}'} for i in range(2)]
+        page = {'_embedded': {'samples': samples}, '_links': {},
+                'page': {'size': 2, 'totalElements': self.total_elements}}
+        if number + 1 < self.total_pages:
+            page['_links']['next'] = {'href': f'{LISTING_URL}&cursor={number + 1}'}
+        return FakeResponse(page)
+
+
+def get_accessions(page):
+    return [sample['accession'] for sample in page['_embedded']['samples']]
+
+
+class TestPageHarvester(unittest.TestCase):
+    def test_pages_in_order(self):
+        session = FakeSession(7)
+        harvester = PageHarvester(LISTING_URL, get_accessions, max_in_flight=3, session=session)
+        pages = list(harvester.pages())
+        self.assertListEqual([number for number, _ in pages], list(range(7)))
+        self.assertListEqual(pages[3][1], ['SAMEA6', 'SAMEA7'])
+        # the pages are requested one after the other by following the cursor
+        self.assertListEqual(session.requested, list(range(7)))
+        self.assertEqual(harvester.stats['pages'], 7)
+        self.assertEqual(harvester.stats['records'], 14)
+        self.assertTrue(harvester.is_complete())
+
+    def test_incomplete(self):
+        harvester = PageHarvester(LISTING_URL, get_accessions, max_in_flight=2,
+                                  session=FakeSession(3, total_elements=8))
+        self.assertEqual(len(list(harvester.pages())), 3)
+        self.assertFalse(harvester.is_complete())
+
+    def test_resume(self):
+        with tempfile.TemporaryDirectory() as resume_dir:
+            # the pages of a listing downloaded on another day are discarded
+            old_spool = os.path.join(resume_dir, os.path.basename(
+                PageHarvester(LISTING_URL, resume_dir=resume_dir).get_spool_dir()).rsplit('_', 1)[0] + '_2020-01-01')
+            os.makedirs(old_spool)
+            harvester = PageHarvester(LISTING_URL, get_accessions, max_in_flight=1,
+                                      resume_dir=resume_dir, session=FakeSession(4, failing_page=2))
+            with self.assertRaises(ConnectionError):
+                list(harvester.pages())
+            self.assertFalse(os.path.exists(old_spool))
+            session = FakeSession(4)
+            harvester = PageHarvester(LISTING_URL, get_accessions, max_in_flight=1,
+                                      resume_dir=resume_dir, session=session)
+            self.assertEqual(len(list(harvester.pages())), 4)
+            self.assertListEqual(session.requested, [2, 3])
+            self.assertEqual(harvester.stats['resumed'], 2)
+            self.assertTrue(harvester.is_complete())
+            # the pages are removed once the harvest finished
+            self.assertListEqual(os.listdir(resume_dir), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+import unittest
+from record_counter import RecordCounter, FAANG_QUERY, get_slices
+
+
+class FakeIndices:
+    def __init__(self, aliases):
+        self.aliases = aliases
+
+    def get_alias(self, index):
+        return {name: {'aliases': {index: {}}} for name in self.aliases.get(index, [index])}
+
+
+class FakeCountElasticsearch:
+    def __init__(self, counts, aliases=None):
+        """
+        :param counts: the number of records of each index
+        :param aliases: the concrete indices of each alias
+        """
+        self.counts = counts
+        self.indices = FakeIndices(aliases if aliases else dict())
+        self.requests = list()
+
+    def count(self, index, body=None):
+        self.requests.append((index, body))
+        if body:
+            return {'count': self.counts[index] // 2}
+        return {'count': self.counts[index]}
+
+
+class TestRecordCounter(unittest.TestCase):
+    def test_cached_counts(self):
+        es = FakeCountElasticsearch({'faang_build_1_specimen': 10, 'faang_build_1_dataset': 4})
+        counter = RecordCounter()
+        self.assertEqual(counter.count(es, 'faang_build_1_specimen'), 10)
+        self.assertEqual(counter.count(es, 'faang_build_1_specimen'), 10)
+        self.assertEqual(counter.count(es, 'faang_build_1_specimen', FAANG_QUERY), 5)
+        self.assertEqual(counter.count(es, 'faang_build_1_dataset'), 4)
+        self.assertEqual(len(es.requests), 3)
+        self.assertEqual(es.requests[1][1], {'query': FAANG_QUERY})
+        counter.invalidate('faang_build_1_specimen')
+        counter.count(es, 'faang_build_1_dataset')
+        counter.count(es, 'faang_build_1_specimen')
+        self.assertEqual(len(es.requests), 4)
+
+    def test_alias_invalidated(self):
+        es = FakeCountElasticsearch({'specimen': 0}, {'specimen': ['faang_build_1_specimen']})
+        counter = RecordCounter()
+        self.assertEqual(counter.count(es, 'specimen'), 0)
+        es.counts['specimen'] = 3
+        counter.invalidate('faang_build_1_specimen')
+        self.assertEqual(counter.count(es, 'specimen'), 3)
+
+    def test_slices(self):
+        self.assertEqual(get_slices(0), 1)
+        self.assertEqual(get_slices(1500, page_size=1000), 2)
+        self.assertEqual(get_slices(1000000, page_size=1000, max_slices=4), 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+import json
+import unittest
+from unittest import mock
+import record_sync
+from record_sync import RecordSynchroniser
+
+
+class FakeResponse:
+    def __init__(self, status, etag=None, body=None):
+        self.status = status
+        self.headers = {'ETag': etag} if etag else dict()
+        self.raw_headers = [(key.encode(), value.encode()) for key, value in self.headers.items()]
+        self.body = json.dumps(body).encode() if body else b''
+
+    async def read(self):
+        return self.body
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        pass
+
+
+class FakeSession:
+    """
+    SAMEA1 is not modified, SAMEA2 has changed, SAMEA3 is new and the first request of SAMEA3 is rejected with 503,
+    SAMEA4 does not exist
+    """
+    def __init__(self):
+        self.requests = list()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        pass
+
+    def request(self, method, url, headers):
+        my_id = url.split('/')[-1].split('.')[0]
+        self.requests.append((my_id, headers.get('If-None-Match')))
+        if my_id == 'SAMEA1':
+            return FakeResponse(304)
+        if my_id == 'SAMEA3' and len([request for request in self.requests if request[0] == my_id]) == 1:
+            return FakeResponse(503)
+        if my_id == 'SAMEA4':
+            return FakeResponse(404)
+        return FakeResponse(200, f'"{my_id}-new"', {'accession': my_id})
+
+
+class TestRecordSynchroniser(unittest.TestCase):
+    def test_run(self):
+        session = FakeSession()
+        synchroniser = RecordSynchroniser({'SAMEA1': '"SAMEA1-old"', 'SAMEA2': '"SAMEA2-old"'}, max_connections=2)
+        with mock.patch.object(record_sync, 'MAX_BACKOFF', 0), \
+                mock.patch.object(record_sync.aiohttp, 'ClientSession', return_value=session):
+            synchroniser.run(['SAMEA1', 'SAMEA2', 'SAMEA3', 'SAMEA4', 'SAMEA1'])
+        self.assertIn(('SAMEA1', '"SAMEA1-old"'), session.requests)
+        self.assertIn(('SAMEA3', None), session.requests)
+        self.assertListEqual(synchroniser.unchanged, ['SAMEA1'])
+        self.assertDictEqual(synchroniser.records, {
+            'SAMEA2': {'accession': 'SAMEA2', 'etag': '"SAMEA2-new"'},
+            'SAMEA3': {'accession': 'SAMEA3', 'etag': '"SAMEA3-new"'}})
+        self.assertDictEqual(synchroniser.current_etags, {'SAMEA1': '"SAMEA1-old"', 'SAMEA2': '"SAMEA2-new"',
+                                                          'SAMEA3': '"SAMEA3-new"'})
+        self.assertDictEqual(synchroniser.failed, {'SAMEA4': 404})
+        self.assertEqual(synchroniser.stats['requests'], 5)
+        self.assertEqual(synchroniser.stats['requests_saved'], 2)
+        self.assertGreater(synchroniser.stats['bytes_saved'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
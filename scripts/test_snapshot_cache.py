@@ -0,0 +1,72 @@
+import os
+import tempfile
+import unittest
+from snapshot_cache import read_index, project
+from test_specimen_store import FakeCountingElasticsearch
+
+DOCS = [
+    {'_id': 'SAMEA1', '_source': {'biosampleId': 'SAMEA1', 'standardMet': 'FAANG',
+                                  'organism': {'biosampleId': 'SAMEA0', 'sex': {'text': 'female'}}}},
+    {'_id': 'SAMEA2', '_source': {'biosampleId': 'SAMEA2', 'standardMet': None,
+                                  'specimens': [{'biosampleId': 'SAMEA3', 'cellType': 'liver'}, 'unknown']}}
+]
+
+
+class FakeSnapshotElasticsearch(FakeCountingElasticsearch):
+    """
+    Mimic the sliced scroll, each document belongs to one slice
+    """
+    def search(self, **kwargs):
+        result = super().search(**kwargs)
+        # the scan helper passes the search body as keyword arguments
+        slice_ = kwargs.get('slice')
+        if slice_:
+            hits = [hit for i, hit in enumerate(result['hits']['hits']) if i % slice_['max'] == slice_['id']]
+            result = dict(result, hits={'hits': hits})
+        return result
+
+
+class TestSnapshotCache(unittest.TestCase):
+    def test_projection(self):
+        doc = DOCS[1]['_source']
+        self.assertDictEqual(project(doc, [['specimens', 'biosampleId'], ['specimens', 'cellType']]),
+                             {'specimens': [{'biosampleId': 'SAMEA3', 'cellType': 'liver'}, {}]})
+        self.assertDictEqual(project(DOCS[0]['_source'], [['organism', 'sex', 'text'], ['missing']]),
+                             {'organism': {'sex': {'text': 'female'}}})
+
+    def test_snapshot(self):
+        with tempfile.TemporaryDirectory() as snapshot_dir:
+            es = FakeSnapshotElasticsearch(DOCS)
+            hits = sorted(read_index(es, 'specimen', snapshot_dir=snapshot_dir), key=lambda hit: hit['_id'])
+            self.assertListEqual(hits, DOCS)
+            searches = len(es.requests)
+            hits = sorted(read_index(es, 'specimen', ['standardMet', 'organism.biosampleId'],
+                                     snapshot_dir=snapshot_dir), key=lambda hit: hit['_id'])
+            self.assertEqual(len(es.requests), searches)
+            self.assertListEqual(hits, [
+                {'_id': 'SAMEA1', '_source': {'standardMet': 'FAANG', 'organism': {'biosampleId': 'SAMEA0'}}},
+                # stored as null, unlike the missing organism
+                {'_id': 'SAMEA2', '_source': {'standardMet': None}}
+            ])
+            # the snapshot is exported again once the number of documents changes
+            es.existing = DOCS[:1]
+            self.assertEqual(len(list(read_index(es, 'specimen', False, snapshot_dir=snapshot_dir))), 1)
+            self.assertGreater(len(es.requests), searches)
+            # and once a document is updated in place
+            searches = len(es.requests)
+            es.seq_no += 1
+            self.assertEqual(len(list(read_index(es, 'specimen', False, snapshot_dir=snapshot_dir))), 1)
+            self.assertGreater(len(es.requests), searches)
+            # each export has its own folder, only the latest ones are kept
+            self.assertEqual(len(os.listdir(os.path.join(snapshot_dir, 'specimen'))), 2)
+
+    def test_filtered_read(self):
+        with tempfile.TemporaryDirectory() as snapshot_dir:
+            es = FakeSnapshotElasticsearch(DOCS)
+            list(read_index(es, 'specimen', query={'term': {'standardMet': 'FAANG'}}, snapshot_dir=snapshot_dir))
+            self.assertGreater(len(es.requests), 0)
+            self.assertListEqual(os.listdir(snapshot_dir), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
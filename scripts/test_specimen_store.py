@@ -0,0 +1,125 @@
+import os
+import pickle
+import tempfile
+import unittest
+from elasticsearch.exceptions import RequestError
+from specimen_store import SpecimenStore
+from test_bulk_indexer import FakeElasticsearch
+from utils import check_existsence
+
+SPECIMEN = {
+    'biosampleId': 'SAMEA1',
+    'material': {'text': 'specimen from organism', 'ontologyTerms': 'http://purl.obolibrary.org/obo/OBI_0001479'},
+    'cellType': {'text': 'liver', 'ontologyTerms': 'http://purl.obolibrary.org/obo/UBERON_0002107'},
+    'organism': {
+        'biosampleId': 'SAMEA0',
+        'organism': {'text': 'Sus scrofa', 'ontologyTerms': 'http://purl.obolibrary.org/obo/NCBITaxon_9823'},
+        'sex': {'text': 'female', 'ontologyTerms': 'http://purl.obolibrary.org/obo/PATO_0000383'},
+        'breed': {'text': 'Large White', 'ontologyTerms': 'http://purl.obolibrary.org/obo/LBO_0000212'}
+    },
+    'customField': [{'name': 'notes', 'value': 'not needed'}]
+}
+
+
+class FakeIndices:
+    def __init__(self, es):
+        self.es = es
+
+    def get_alias(self, index):
+        return {f'{index}_v1': {'aliases': {}}}
+
+    def stats(self, index, **kwargs):
+        primary = {'routing': {'primary': True}, 'seq_no': {'max_seq_no': self.es.seq_no}}
+        replica = {'routing': {'primary': False}, 'seq_no': {'max_seq_no': self.es.seq_no}}
+        return {'indices': {f'{index}_v1': {'shards': {'0': [primary, replica]}}}}
+
+
+class FakeCountingElasticsearch(FakeElasticsearch):
+    """
+    Answer the fingerprint searches, updateDate is mapped as keyword as in the FAANG indices
+    """
+    def __init__(self, existing=None, overloaded=0):
+        super().__init__(existing, overloaded)
+        self.indices = FakeIndices(self)
+        # the sequence number of the only shard, increased by each write
+        self.seq_no = 0
+
+    def search(self, **kwargs):
+        body = kwargs.get('body', {})
+        if body.get('size') == 0:
+            aggregation = body.get('aggs', {}).get('latest', {})
+            if 'max' in aggregation:
+                raise RequestError(400, 'search_phase_execution_exception',
+                                   'Field [updateDate] of type [keyword] is not supported for aggregation [max]')
+            dates = sorted({hit['_source']['updateDate'] for hit in self.existing if 'updateDate' in hit['_source']},
+                           reverse=True)
+            buckets = [{'key': date, 'doc_count': 1} for date in dates[:aggregation.get('terms', {}).get('size', 0)]]
+            return {'hits': {'total': {'value': len(self.existing)}}, 'aggregations': {'latest': {'buckets': buckets}}}
+        self.requests.append('search')
+        return super().search(**kwargs)
+
+
+class TestSpecimenStore(unittest.TestCase):
+    def test_record_access(self):
+        store = SpecimenStore()
+        store.add('SAMEA1', SPECIMEN)
+        store['SAMEA2'] = dict(SPECIMEN, biosampleId='SAMEA2')
+        self.assertEqual(len(store), 2)
+        self.assertIn('SAMEA1', store)
+        record = store['SAMEA1']
+        self.assertDictEqual(record['material'], SPECIMEN['material'])
+        self.assertEqual(record['organism']['organism']['text'], 'Sus scrofa')
+        self.assertEqual(check_existsence(record['organism'], 'biosampleId'), 'SAMEA0')
+        self.assertNotIn('customField', record)
+        with self.assertRaises(KeyError):
+            record['customField']
+        # identical values are kept only once
+        self.assertIs(store['SAMEA1']['cellType'], store['SAMEA2']['cellType'])
+
+    def test_organism_record(self):
+        store = SpecimenStore()
+        store.add('SAMEA0', {'biosampleId': 'SAMEA0', 'material': {'text': 'organism'},
+                             'organism': {'text': 'Sus scrofa'}})
+        self.assertEqual(store['SAMEA0']['material']['text'], 'organism')
+        self.assertNotIn('organism', store['SAMEA0']['organism'])
+
+    def test_organism_without_species(self):
+        store = SpecimenStore()
+        store.add('SAMEA1', {'biosampleId': 'SAMEA1', 'material': {'text': 'specimen from organism'},
+                             'organism': {'biosampleId': 'SAMEA0', 'sex': {'text': 'female'}}})
+        self.assertEqual(check_existsence(store['SAMEA1']['organism'], 'biosampleId'), 'SAMEA0')
+        self.assertEqual(store['SAMEA1']['organism']['sex']['text'], 'female')
+        self.assertNotIn('organism', store['SAMEA1']['organism'])
+
+    def test_local_copy(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            es = FakeCountingElasticsearch([{'_id': 'SAMEA1', '_source': SPECIMEN}])
+            self.assertFalse(SpecimenStore().load(es, 'faang_build_1_specimen', cache_dir))
+            searches = len(es.requests)
+            self.assertTrue(os.path.exists(os.path.join(cache_dir, 'faang_build_1_specimen.specimens.pickle')))
+            store = SpecimenStore()
+            self.assertTrue(store.load(es, 'faang_build_1_specimen', cache_dir))
+            self.assertEqual(len(es.requests), searches)
+            self.assertEqual(store['SAMEA1']['organism']['breed']['text'], 'Large White')
+            # a document added to the index invalidates the local copy
+            es.existing.append({'_id': 'SAMEA2', '_source': SPECIMEN})
+            self.assertFalse(SpecimenStore().load(es, 'faang_build_1_specimen', cache_dir))
+            self.assertTrue(SpecimenStore().load(es, 'faang_build_1_specimen', cache_dir))
+            # so does a document updated later than the others
+            es.existing[1] = {'_id': 'SAMEA2', '_source': dict(SPECIMEN, updateDate='2024-01-02')}
+            self.assertFalse(SpecimenStore().load(es, 'faang_build_1_specimen', cache_dir))
+            self.assertTrue(SpecimenStore().load(es, 'faang_build_1_specimen', cache_dir))
+            # and a partial update changing neither
+            es.seq_no += 1
+            self.assertFalse(SpecimenStore().load(es, 'faang_build_1_specimen', cache_dir))
+
+    def test_pickle(self):
+        store = SpecimenStore()
+        store.add('SAMEA1', SPECIMEN)
+        restored = pickle.loads(pickle.dumps(store))
+        self.assertEqual(restored['SAMEA1']['biosampleId'], 'SAMEA1')
+        self.assertDictEqual(restored['SAMEA1']['organism']['sex'], SPECIMEN['organism']['sex'])
+
+
+if __name__ == '__main__':
+    unittest.main()
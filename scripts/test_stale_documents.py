@@ -0,0 +1,26 @@
+import unittest
+from stale_documents import delete_stale_documents
+from test_bulk_indexer import FakeElasticsearch
+
+
+class TestStaleDocuments(unittest.TestCase):
+    def setUp(self):
+        existing = [{'_id': 'SAMEA1'}, {'_id': 'SAMEA2'}, {'_id': 'SAMEA3'}]
+        self.es = FakeElasticsearch(existing)
+
+    def test_dry_run(self):
+        result = delete_stale_documents(self.es, 'faang_build_1_specimen', {'SAMEA1': 1}, dry_run=True)
+        self.assertDictEqual(result, {'index': 'faang_build_1_specimen', 'stale': 2, 'ids': ['SAMEA2', 'SAMEA3'],
+                                      'dry_run': True})
+        self.assertEqual(len(self.es.requests), 0)
+
+    def test_delete(self):
+        result = delete_stale_documents(self.es, 'faang_build_1_specimen', {'SAMEA1', 'SAMEA3'})
+        self.assertEqual(result['deleted'], 1)
+        self.assertEqual(result['failed'], 0)
+        self.assertEqual(len(self.es.requests), 1)
+        self.assertIn('"_id":"SAMEA2"', self.es.requests[0][0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+import json
+import time
+import unittest
+from bulk_indexer import BulkIndexer
+from test_bulk_indexer import FakeElasticsearch
+from utils import ImportLogWriter, SystemLogBuffer
+
+
+class TestImportLogWriter(unittest.TestCase):
+    def test_duplicated_entries(self):
+        es = FakeElasticsearch()
+        indexer = BulkIndexer(es)
+        writer = ImportLogWriter(indexer, 'faang_build_1', 'import_ena')
+        writer.add('experiment', 'ERX1', 'error', 'control experiment not found')
+        writer.add('experiment', 'ERX1', 'error', 'control experiment not found')
+        writer.add('experiment', 'ERX2', 'pass', '')
+        self.assertEqual(writer.duplicates, 1)
+        self.assertDictEqual(writer.get_counts(), {'experiment': {'error': 1, 'pass': 1}})
+        writer.close()
+        indexer.close()
+        self.assertDictEqual(indexer.report(), {'succeeded': 2, 'failed': 0})
+        # the counts are still reported once the entries are sent
+        self.assertDictEqual(writer.get_counts(), {'experiment': {'error': 1, 'pass': 1}})
+
+    def test_summary_only(self):
+        es = FakeElasticsearch()
+        indexer = BulkIndexer(es)
+        writer = ImportLogWriter(indexer, 'faang_build_1', 'import_ena', summary_only=True)
+        writer.add('experiment', 'ERX1', 'error', 'control experiment not found')
+        writer.add('dataset', 'PRJEB1', 'warning', 'no valid experiments to be imported')
+        writer.add('dataset', 'PRJEB2', 'warning', 'no valid experiments to be imported')
+        writer.close()
+        indexer.close()
+        self.assertEqual(len(es.requests), 1)
+        action = json.loads(es.requests[0][0])
+        doc = json.loads(es.requests[0][1])
+        self.assertEqual(action['index']['_index'], 'faang_build_1_log')
+        self.assertEqual(doc['type'], 'summary')
+        self.assertListEqual(doc['detail'], ['dataset\twarning\t2', 'experiment\terror\t1'])
+
+    def test_system_log_flushed_by_timer(self):
+        es = FakeElasticsearch()
+        buffer = SystemLogBuffer(es, flush_interval=0.1)
+        buffer.append('import_ena-1', {'detail': 'Program starts'})
+        self.assertListEqual(es.requests, [])
+        # written without any further entry
+        for _ in range(50):
+            if es.requests:
+                break
+            time.sleep(0.1)
+        self.assertEqual(json.loads(es.requests[0][1])['serial'], 1)
+        self.assertIsNone(buffer.timer)
+
+
+if __name__ == '__main__':
+    unittest.main()
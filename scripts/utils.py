@@ -1,16 +1,28 @@
 """
 Different function that could be used in any faang backend script
 """
+import atexit
 import json
 import logging
+import threading
+import time
 from typing import Set, List, Dict
-import requests
 from constants import STANDARDS, STANDARD_FAANG, TYPES
 from elasticsearch import Elasticsearch
+from bulk_indexer import BulkIndexer
+from write_metrics import WRITE_METRICS
+from snapshot_cache import read_index
+from record_counter import RECORD_COUNTER, FAANG_QUERY, get_slices
 from misc import convert_readable
 from datetime import datetime
 from inspect import currentframe
 
+# system log entries are buffered and written into sys_log in bulk
+SYS_LOG_BUFFER_SIZE = 200
+SYS_LOG_FLUSH_INTERVAL = 30
+# one buffer per elasticsearch instance, keys are the id of the instance
+SYSTEM_LOG_BUFFERS = dict()
+
 
 def create_logging_instance(name, level=logging.INFO, to_file=True):
     """
@@ -43,20 +55,76 @@ def create_logging_instance(name, level=logging.INFO, to_file=True):
     return new_logger
 
 
+class SystemLogBuffer:
+    """
+    Collect system log entries in memory and write them into the sys_log index in bulk,
+    either when the buffer is full, when the flush interval has passed since the oldest buffered entry or when the
+    process exits. The interval is kept by a daemon timer, so the entries are written during quiet stretches too.
+    Serial numbers are assigned locally, continuing from the number of entries already in sys_log
+    """
+    def __init__(self, es, buffer_size=SYS_LOG_BUFFER_SIZE, flush_interval=SYS_LOG_FLUSH_INTERVAL):
+        """
+        :param es: elasticsearch python library instance
+        :param buffer_size: the number of entries which triggers a flush
+        :param flush_interval: the number of seconds after which the buffered entries get flushed
+        """
+        self.es = es
+        self.flush_interval = flush_interval
+        self.serial = None
+        self.bulk_indexer = BulkIndexer(es, chunk_size=buffer_size)
+        # the timer flushes from its own thread
+        self.lock = threading.Lock()
+        self.timer = None
+        atexit.register(self.flush)
+
+    def append(self, doc_id, doc: Dict) -> None:
+        """
+        Add one log entry into the buffer
+        :param doc_id: the id of the log entry
+        :param doc: the log entry, the serial number will be added
+        """
+        with self.lock:
+            if self.serial is None:
+                self.serial = self.es.count(index='sys_log')['count']
+            self.serial += 1
+            doc['serial'] = self.serial
+            self.bulk_indexer.index('sys_log', doc_id, doc)
+            if self.timer is None and self.bulk_indexer.actions:
+                self.timer = threading.Timer(self.flush_interval, self.flush)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def flush(self) -> None:
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+            self.bulk_indexer.flush()
+
+
+def get_system_log_buffer(es) -> SystemLogBuffer:
+    """
+    Get the system log buffer bound to the elasticsearch instance, create one if not existing
+    :param es: elasticsearch python library instance
+    :return: the system log buffer
+    """
+    key = id(es)
+    if key not in SYSTEM_LOG_BUFFERS:
+        SYSTEM_LOG_BUFFERS[key] = SystemLogBuffer(es)
+    return SYSTEM_LOG_BUFFERS[key]
+
+
 def write_system_log(es, script, level: str, line, detail, to_es=True):
     now = datetime.now()
     if to_es:
-        tmp = es.count(index='sys_log')
-        current_count = tmp['count'] + 1
         doc = {
-            'serial': current_count,
             'script': script,
             'level': level,
             'timestamp': now,
             'line': line,
             'detail': detail
         }
-        es.create(index='sys_log', doc_type='_doc', body=doc, id=f'{script}-{now}', refresh=True)
+        get_system_log_buffer(es).append(f'{script}-{now}', doc)
     else:
         print(f'{now} - {script} - {level.upper()} - line {line} - {detail}')
 
@@ -66,30 +134,139 @@ def get_line_number():
     return cf.f_back.f_lineno
 
 
+def write_metrics_summary(es, script, to_es=True, path=None) -> Dict:
+    """
+    Emit the write metrics collected during the run as one system log entry and as a JSON file
+    :param es: elasticsearch python library instance
+    :param script: the name of the script, used in the system log and the default file name
+    :param to_es: determine whether to output the system log to Elasticsearch (True) or terminal (False, printing)
+    :param path: the location of the JSON file, default to be write_metrics_<script>_<timestamp>.json
+    :return: the summary of the write metrics
+    """
+    summary = WRITE_METRICS.summary()
+    summary['script'] = script
+    if path is None:
+        path = f'write_metrics_{script}_{datetime.now():%Y-%m-%dT%H-%M-%S}.json'
+    with open(path, 'w') as f:
+        json.dump(summary, f, indent=2)
+    write_system_log(es, script, 'info', get_line_number(), json.dumps(summary, separators=(',', ':')), to_es)
+    return summary
+
+
 logger = create_logging_instance('utils')
 logging.getLogger('elasticsearch').setLevel(logging.WARNING)
 
 
-def insert_into_es(es, es_index_prefix, doc_type, doc_id, body):
+def insert_into_es(es, es_index_prefix, doc_type, doc_id, body, bulk_indexer=None, dead_letter=None):
     """
-    index data into ES
+    index data into ES, any existing document with the same id is overwritten
     :param es: elasticsearch python library instance
     :param es_index_prefix: combined with doc_type to determine which index to write into
     :param doc_type: combined with es_index_prefix to determine which index to write into
     :param doc_id: the id of the document to be indexed
     :param body: the data of the document to be indexed
+    :param bulk_indexer: optional BulkIndexer instance, if provided the document is queued into it
+    rather than being sent straightaway
+    :param dead_letter: optional DeadLetterQueue instance, the document is appended to it if the write fails,
+    with bulk_indexer the dead-letter file of the indexer is used instead
     :return:
     """
+    if bulk_indexer:
+        bulk_indexer.index(f'{es_index_prefix}_{doc_type}', doc_id, body)
+        return
+    index = f'{es_index_prefix}_{doc_type}'
+    started = time.time()
     try:
-        existing_flag = es.exists(index=f'{es_index_prefix}_{doc_type}', doc_type="_doc", id=doc_id)
-        if existing_flag:
-            es.delete(index=f'{es_index_prefix}_{doc_type}', doc_type="_doc", id=doc_id)
-        es.create(index=f'{es_index_prefix}_{doc_type}', doc_type="_doc", id=doc_id, body=body)
+        es.index(index=index, doc_type="_doc", id=doc_id, body=body)
+        RECORD_COUNTER.invalidate(index)
     except Exception as e:
-        logger.error(f"Error when try to insert into index {es_index_prefix}_{doc_type}: " + str(e.args))
+        logger.error(f"Error when try to insert into index {index}: " + str(e.args))
+        WRITE_METRICS.record_errors(index, 1)
+        if dead_letter:
+            dead_letter.append(index, doc_id, body)
+    size = len(body) if isinstance(body, str) else len(es.transport.serializer.dumps(body))
+    WRITE_METRICS.record_request(index, 1, size, time.time() - started)
 
 
-def insert_es_log(es, es_index_prefix, doc_type, doc_id, status, detail):
+class ImportLogWriter:
+    """
+    Collect the per-record import log entries in memory and send them into the <es_index_prefix>_log index
+    together with the data documents through a BulkIndexer.
+    Only the latest entry for each accession is kept, repeated entries within the run are counted as duplicates.
+    In summary only mode, a single document holding the counts of each type and status is stored for the run
+    """
+    def __init__(self, bulk_indexer, es_index_prefix, script, summary_only=False):
+        """
+        :param bulk_indexer: the BulkIndexer instance used for the data documents
+        :param es_index_prefix: form the string <es_index_prefix>_log, the index the entries will be written into
+        :param script: the name of the importing script, used to identify the run in summary only mode
+        :param summary_only: store the aggregated counts (True) or one document per record (False)
+        """
+        self.bulk_indexer = bulk_indexer
+        self.es_index_prefix = es_index_prefix
+        self.script = script
+        self.summary_only = summary_only
+        self.started = datetime.now()
+        self.entries: Dict[str, Dict] = dict()
+        # the counts of the entries already queued by close
+        self.queued_counts: Dict[str, Dict[str, int]] = dict()
+        self.duplicates = 0
+
+    def add(self, doc_type, doc_id, status, detail) -> None:
+        """
+        :param doc_type: the type of the data record
+        :param doc_id: the id of the data record
+        :param status: the status of the data record during importation, one of 'pass', 'warning', 'error'
+        :param detail: the detail of the import log, empty if the status is pass
+        """
+        if doc_id in self.entries:
+            self.duplicates += 1
+        self.entries[doc_id] = {
+            'accession': doc_id,
+            'type': doc_type,
+            'status': status,
+            'detail': detail,
+            'last_update': datetime.now()
+        }
+
+    def get_counts(self) -> Dict[str, Dict[str, int]]:
+        """
+        :return: the number of entries for each type and status, keys are type then status,
+        the entries already queued by close are included
+        """
+        counts = {doc_type: dict(status_counts) for doc_type, status_counts in self.queued_counts.items()}
+        for entry in self.entries.values():
+            counts.setdefault(entry['type'], dict())
+            counts[entry['type']].setdefault(entry['status'], 0)
+            counts[entry['type']][entry['status']] += 1
+        return counts
+
+    def close(self) -> None:
+        """
+        Queue the collected entries into the bulk indexer, which still needs to be closed by the caller
+        """
+        if self.summary_only:
+            run_id = f"{self.script}-{self.started.strftime('%Y-%m-%dT%H:%M:%S')}"
+            detail = list()
+            for doc_type, status_counts in sorted(self.get_counts().items()):
+                for status, count in sorted(status_counts.items()):
+                    detail.append(f"{doc_type}\t{status}\t{count}")
+            doc = {
+                'accession': run_id,
+                'type': 'summary',
+                'status': 'summary',
+                'detail': detail,
+                'last_update': datetime.now()
+            }
+            insert_into_es(None, self.es_index_prefix, 'log', run_id, doc, self.bulk_indexer)
+        else:
+            for doc_id, doc in self.entries.items():
+                insert_into_es(None, self.es_index_prefix, 'log', doc_id, doc, self.bulk_indexer)
+        self.queued_counts = self.get_counts()
+        self.entries = dict()
+
+
+def insert_es_log(es, es_index_prefix, doc_type, doc_id, status, detail, log_writer=None):
     """
     insert a log entry for the data record into ES
     :param es: elasticsearch python library instance
@@ -98,7 +275,11 @@ def insert_es_log(es, es_index_prefix, doc_type, doc_id, status, detail):
     :param doc_id: the id of the data record
     :param status: the status of the data record during importation, one of 'pass', 'warning', 'error'
     :param detail: the detail of the import log, empty if the status is pass
+    :param log_writer: optional ImportLogWriter instance, if provided the entry is collected by it
     """
+    if log_writer:
+        log_writer.add(doc_type, doc_id, status, detail)
+        return
     now = datetime.now()
     doc = {
         'accession': doc_id,
@@ -119,34 +300,32 @@ def get_record_ids(host: str, es_index_prefix: str, data_type: str, only_faang=T
     :param only_faang: indiciates whether only include FAANG standard records (when True) or all records (when False)
     :return: set of FAANG dataset id
     """
-    standard_field = 'standardMet'
-    details = get_record_details(host, es_index_prefix, data_type, [standard_field])
-    if len(details) == 0:
+    if data_type not in TYPES:
         return set()
-    if only_faang:
-        results = set()
-        for hit in details.keys():
-            if data_type == 'article' or details[hit][standard_field] == STANDARD_FAANG:
-                results.add(hit)
-        return results
-    else:
-        return set(details.keys())
+    # articles have no standard
+    only_faang = only_faang and data_type != 'article'
+    count = get_record_number(host, es_index_prefix, data_type, only_faang)
+    if count == 0:
+        return set()
+    es = Elasticsearch(host)
+    # the standard is filtered by Elasticsearch, so only the ids are transferred
+    return {hit['_id'] for hit in read_index(es, f'{es_index_prefix}_{data_type}', source=False,
+                                              query=FAANG_QUERY if only_faang else None, slices=get_slices(count))}
 
 
-def get_record_number(host: str, es_index_prefix: str, data_type: str) -> int:
+def get_record_number(host: str, es_index_prefix: str, data_type: str, only_faang=False) -> int:
     """
-    Get the number of records of one type in the Elasticsearch, which is necessary to do a full list retrieval as
-    the default size is 20 and an arbitrary hard-coded value is also not ideal, may become too small one day
+    Get the number of records of one type in the Elasticsearch with the count API, the count is cached for the run
     :param host: the Elastic Search server address
     :param es_index_prefix: the Elastic Search dataset index
     :param data_type: the type of records
+    :param only_faang: indiciates whether only count FAANG standard records (when True) or all records (when False)
     :return: the number of records
     """
     if data_type not in TYPES:
         return 0
-    url = f"http://{host}/{es_index_prefix}_{data_type}/_search?_source=standardMet"
-    response = requests.get(url).json()
-    return response['hits']['total']
+    query = FAANG_QUERY if only_faang else None
+    return RECORD_COUNTER.count(Elasticsearch(host), f'{es_index_prefix}_{data_type}', query)
 
 
 def get_record_details(host: str, es_index_prefix: str, data_type: str, return_fields: List) -> Dict:
@@ -158,15 +337,14 @@ def get_record_details(host: str, es_index_prefix: str, data_type: str, return_f
     :param return_fields: the list of fields containing the wanted information
     :return: a dict having record id as keys, and all field values as values
     """
-    total_number = get_record_number(host, es_index_prefix, data_type)
-    if total_number == 0:
+    if data_type not in TYPES:
+        return dict()
+    count = get_record_number(host, es_index_prefix, data_type)
+    if count == 0:
         return dict()
     es = Elasticsearch(host)
-    index_name = f'{es_index_prefix}_{data_type}'
-    source_str = ','.join(return_fields)
-    data = es.search(index=index_name, size=total_number, _source=source_str)
     results = dict()
-    for hit in data['hits']['hits']:
+    for hit in read_index(es, f'{es_index_prefix}_{data_type}', source=return_fields, slices=get_slices(count)):
         results[hit['_id']] = hit['_source']
     return results
 
@@ -358,7 +536,8 @@ def generate_ena_api_endpoint(result: str, data_portal: str, fields: str, option
            f"result={result}&format=JSON&limit=0&{optional}&fields={fields}&dataPortal={data_portal}"
 
 
-def process_validation_result(analyses, es, es_index_prefix, validation_results, ruleset_version, rulesets, to_es_flag):
+def process_validation_result(analyses, es, es_index_prefix, validation_results, ruleset_version, rulesets, to_es_flag,
+                              bulk_indexer=None, log_writer=None):
     analysis_validation = dict()
     for analysis_accession, analysis_es in analyses.items():
         status = ''
@@ -395,12 +574,12 @@ def process_validation_result(analyses, es, es_index_prefix, validation_results,
                 analysis_es.pop('checksums')
                 analysis_es.pop('urls')
                 body = json.dumps(analysis_es)
-                insert_into_es(es, es_index_prefix, 'analysis', analysis_accession, body)
+                insert_into_es(es, es_index_prefix, 'analysis', analysis_accession, body, bulk_indexer)
                 status = validation_results[ruleset]['detail'][analysis_accession]['status']
                 message = validation_results[ruleset]['detail'][analysis_accession]['message']
                 msgs.append(f"{status}\t{ruleset}\t{message}")
                 # index into ES so break the loop
                 break
-        insert_es_log(es, es_index_prefix, 'analysis', analysis_accession, status, ";".join(msgs))
+        insert_es_log(es, es_index_prefix, 'analysis', analysis_accession, status, ";".join(msgs), log_writer)
 
 
@@ -3,8 +3,10 @@ Different function that could be used in any faang backend script
 """
 import logging
 from typing import Set, List, Dict
-from constants import STANDARD_FAANG, TYPES
+from constants import TYPES
 from inspect import currentframe
+from snapshot_cache import read_index
+from record_counter import RECORD_COUNTER, FAANG_QUERY, get_slices
 
 
 def create_logging_instance(name, level=logging.INFO, to_file=True):
@@ -63,6 +65,7 @@ def insert_into_es(es, doc_type, doc_id, body):
 
         # add document to index
         es.index(index=doc_type, doc_type="_doc", id=doc_id, body=body)
+        RECORD_COUNTER.invalidate(doc_type)
     except Exception as e:
         logger.error(f"Error when try to insert into index {doc_type}: " + str(e.args))
 
@@ -75,33 +78,29 @@ def get_record_ids(es, data_type: str, only_faang=True) -> Set[str]:
     :param only_faang: indiciates whether only include FAANG standard records (when True) or all records (when False)
     :return: set of FAANG dataset id
     """
-    standard_field = 'standardMet'
-    details = get_record_details(es, data_type, [standard_field])
-    if len(details) == 0:
+    if data_type not in TYPES:
         return set()
-    if only_faang:
-        results = set()
-        for hit in details.keys():
-            if data_type == 'article' or details[hit][standard_field] == STANDARD_FAANG:
-                results.add(hit)
-        return results
-    else:
-        return set(details.keys())
+    # articles have no standard
+    only_faang = only_faang and data_type != 'article'
+    count = get_record_number(es, data_type, only_faang)
+    if count == 0:
+        return set()
+    # the standard is filtered by Elasticsearch, so only the ids are transferred
+    return {hit['_id'] for hit in read_index(es, data_type, source=False, query=FAANG_QUERY if only_faang else None,
+                                              page_size=10000, slices=get_slices(count, page_size=10000))}
 
 
-def get_record_number(es, data_type: str) -> int:
+def get_record_number(es, data_type: str, only_faang=False) -> int:
     """
-    Get the number of records of one type in the Elasticsearch, which is necessary to do a full list retrieval as
-    the default size is 20 and an arbitrary hard-coded value is also not ideal, may become too small one day
+    Get the number of records of one type in the Elasticsearch with the count API, the count is cached for the run
     :param es: the Elastic Search instance
     :param data_type: the type of records
+    :param only_faang: indiciates whether only count FAANG standard records (when True) or all records (when False)
     :return: the number of records
     """
     if data_type not in TYPES:
         return 0
-
-    count = es.cat.count(data_type, params={"format": "json"})
-    return int(count[0]['count'])
+    return RECORD_COUNTER.count(es, data_type, FAANG_QUERY if only_faang else None)
 
 
 def get_record_details(es, data_type: str, return_fields: List) -> Dict:
@@ -112,28 +111,15 @@ def get_record_details(es, data_type: str, return_fields: List) -> Dict:
     :param return_fields: the list of fields containing the wanted information
     :return: a dict having record id as keys, and all field values as values
     """
-
-    total_number = get_record_number(es, data_type)
-    if total_number == 0:
+    if data_type not in TYPES:
+        return dict()
+    count = get_record_number(es, data_type)
+    if count == 0:
         return dict()
-    index_name = data_type
-
-    count = 0
     results = dict()
-
-    query_body = {"_source": return_fields,
-                  "query": {"match_all": {}}}
-
-    while True:
-        res = es.search(index=index_name, size=50000, body=query_body, from_=count, track_total_hits=True)
-
-        for hit in res['hits']['hits']:
-            results[hit['_id']] = hit['_source']
-
-        count += 50000
-
-        if count > res['hits']['total']['value']:
-            break
+    for hit in read_index(es, data_type, source=return_fields, page_size=10000,
+                          slices=get_slices(count, page_size=10000)):
+        results[hit['_id']] = hit['_source']
     return results
 
 
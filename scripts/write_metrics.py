@@ -0,0 +1,96 @@
+"""
+Counters of the writes sent to Elasticsearch, kept per target index
+For each index the number of requests, documents, bytes, errors and retries are counted and the request latencies
+are collected into a histogram, so the throughput of the import scripts could be compared between runs
+"""
+import json
+import threading
+import time
+from typing import Dict
+
+# the upper bounds in milliseconds of the latency histogram buckets, the last bucket holds everything slower
+LATENCY_BUCKETS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+class WriteMetrics:
+    """
+    Thread-safe collection of the write metrics
+    """
+    def __init__(self):
+        self.started = time.time()
+        self.lock = threading.Lock()
+        self.indices: Dict[str, Dict] = dict()
+
+    def get_index_metrics(self, index) -> Dict:
+        if index not in self.indices:
+            self.indices[index] = {
+                'requests': 0,
+                'documents': 0,
+                'bytes': 0,
+                'errors': 0,
+                'retries': 0,
+                'latency_ms': {'total': 0.0, 'max': 0.0, 'histogram': [0] * (len(LATENCY_BUCKETS) + 1)}
+            }
+        return self.indices[index]
+
+    def record_request(self, index, documents: int, size: int, latency: float) -> None:
+        """
+        Record one request which wrote into the index, for _bulk requests covering several indices
+        it is recorded for each of them with the documents and bytes of that index
+        :param index: the name of the index
+        :param documents: the number of documents sent
+        :param size: the number of bytes sent
+        :param latency: the duration of the request in seconds
+        """
+        latency_ms = latency * 1000
+        bucket = len(LATENCY_BUCKETS)
+        for i, upper_bound in enumerate(LATENCY_BUCKETS):
+            if latency_ms <= upper_bound:
+                bucket = i
+                break
+        with self.lock:
+            metrics = self.get_index_metrics(index)
+            metrics['requests'] += 1
+            metrics['documents'] += documents
+            metrics['bytes'] += size
+            metrics['latency_ms']['total'] += latency_ms
+            metrics['latency_ms']['max'] = max(metrics['latency_ms']['max'], latency_ms)
+            metrics['latency_ms']['histogram'][bucket] += 1
+
+    def record_errors(self, index, errors: int) -> None:
+        with self.lock:
+            self.get_index_metrics(index)['errors'] += errors
+
+    def record_retries(self, index, retries: int) -> None:
+        with self.lock:
+            self.get_index_metrics(index)['retries'] += retries
+
+    def summary(self) -> Dict:
+        """
+        :return: the metrics of each index together with the totals and the throughput of the whole run
+        """
+        elapsed = time.time() - self.started
+        totals = {'requests': 0, 'documents': 0, 'bytes': 0, 'errors': 0, 'retries': 0}
+        indices = dict()
+        with self.lock:
+            for index, metrics in self.indices.items():
+                metrics = json.loads(json.dumps(metrics))
+                latency = metrics['latency_ms']
+                latency['mean'] = round(latency['total'] / metrics['requests'], 1) if metrics['requests'] else 0
+                latency['total'] = round(latency['total'], 1)
+                latency['max'] = round(latency['max'], 1)
+                metrics['documents_per_second'] = round(metrics['documents'] / elapsed, 1) if elapsed else 0
+                indices[index] = metrics
+                for key in totals:
+                    totals[key] += metrics[key]
+        totals['documents_per_second'] = round(totals['documents'] / elapsed, 1) if elapsed else 0
+        return {
+            'elapsed': round(elapsed, 1),
+            'latency_buckets_ms': list(LATENCY_BUCKETS),
+            'totals': totals,
+            'indices': indices
+        }
+
+
+# shared by all writers of the process
+WRITE_METRICS = WriteMetrics()